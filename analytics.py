@@ -0,0 +1,146 @@
+""" Catalog statistics kept up to date as recipes are added and removed: the count, mean, minimum and maximum of every
+    numeric field, for the whole catalog and for each type and SRM value, and histograms of some fields. Each recipe
+    added or removed since the statistics were last read updates them in constant time, so reading them never scans
+    the catalog (other than once, when they are first made). Only removing the last recipe holding a minimum or maximum
+    means finding it again, from the distinct values of that field in that group """
+from collections import Counter, defaultdict
+from itertools import filterfalse
+from math import floor, isnan
+from operator import itemgetter, mul
+from catalog import CODED_FIELDS
+from storage import NUMERIC_FIELDS, compactNumber
+
+# The width of the bins of the histogram kept of each field
+HISTOGRAM_BINS = {
+    "gravity": 1
+}
+
+def countValues(values):
+    """ Returns how many times each value appears, leaving out NaN (missing) """
+    counts = Counter(values)
+    for value in list(filter(isnan, counts)): del counts[value] # Each NaN is its own key
+    return counts
+
+class Aggregate:
+    """ Aggregate object. The count, total, minimum and maximum of a numeric field over a group of recipes, along with how
+        many recipes have each value, so that the minimum and maximum can still be found after the recipe holding one is
+        removed (which is only done then, and only when next read) """
+    __slots__ = ("count", "total", "values", "low", "high")
+
+    def __init__(self):
+        self.count, self.total, self.values = 0, 0.0, dict()
+        self.low = self.high = None # None until found again, after the last recipe holding either was removed
+
+    def __repr__(self):
+        return f"<Aggregate: {self.count} values>"
+
+    def add(self, value, count=1):
+        """ Adds a value count times (or removes it, if count is negative) """
+        self.count += count
+        self.total = self.total + count*value if self.count else 0.0 # Nothing left over from rounding once empty
+        if count > 0:
+            if self.low is not None and value < self.low: self.low = value
+            if self.high is not None and value > self.high: self.high = value
+        count += self.values.get(value, 0)
+        if count: self.values[value] = count
+        else:
+            del self.values[value]
+            if value == self.low: self.low = None
+            if value == self.high: self.high = None
+
+    def merge(self, counts, sign=1):
+        """ Adds every value of a dictionary of values to how many times each is added (or removes them, if sign is -1).
+            Values added to an empty aggregate (as when the statistics are first made) are copied in all at once """
+        if sign < 0 or self.values:
+            for (value, count) in counts.items(): self.add(value, sign*count)
+            return
+        self.values = dict(counts)
+        self.count = sum(counts.values())
+        self.total = float(sum(map(mul, counts, counts.values())))
+        self.low = self.high = None
+
+    def summary(self):
+        """ Returns the count, minimum, mean and maximum, as RecipeManager.stats gives them """
+        if not self.count: return {"count": 0, "min": None, "mean": None, "max": None}
+        if self.low is None: self.low = min(self.values)
+        if self.high is None: self.high = max(self.values)
+        return {"count": self.count, "min": compactNumber(self.low), "mean": round(self.total/self.count, 3),
+            "max": compactNumber(self.high)}
+
+class CatalogStatistics:
+    """ CatalogStatistics object. Running aggregates of a catalog, for the whole catalog and for each type and SRM
+        value. Refreshing reads only the rows added and removed since the last refresh (from the catalog's removed
+        log), like BrewingEngine, and starts again only if the catalog has been compacted """
+
+    def __init__(self, catalog):
+        self.catalog = catalog
+        self._reset()
+
+    def __repr__(self):
+        return f"<CatalogStatistics: {self.recipes} recipes>"
+
+    def _reset(self):
+        self.names, self.read, self.removed = self.catalog.names, 0, 0 # The name list is replaced when compacted
+        self.recipes = 0
+        self.totals = {field:Aggregate() for field in NUMERIC_FIELDS}
+        self.groups = {field:dict() for field in CODED_FIELDS} # Field to code to [recipes, {field: Aggregate}]
+        self.histograms = {field:dict() for field in HISTOGRAM_BINS} # Field to bin to its number of recipes
+
+    def _group(self, field, code):
+        """ Returns the recipe count and aggregates of a type or SRM value, as [recipes, {field: Aggregate}] """
+        group = self.groups[field].get(code)
+        if group is None: group = self.groups[field][code] = [0, {f:Aggregate() for f in NUMERIC_FIELDS}]
+        return group
+
+    def _count(self, rows, sign=1):
+        """ Adds the given rows to every aggregate (or takes them away, if sign is -1). Each distinct value (or value of
+            each type and SRM value) is counted first, and added once however many rows have it """
+        columns = self.catalog.columns
+        if isinstance(rows, range): pick = lambda column: column[rows.start:rows.stop]
+        else: pick = lambda column: [column[row] for row in rows]
+        self.recipes += sign*len(rows)
+        positions = dict() # Field to code to the positions (in rows) of the rows of each type and SRM value
+        for field in CODED_FIELDS:
+            positions[field] = defaultdict(list)
+            for (position, code) in enumerate(pick(columns[field])): positions[field][code].append(position)
+            for (code, codepositions) in positions[field].items(): self._group(field, code)[0] += sign*len(codepositions)
+        for field in NUMERIC_FIELDS:
+            values = pick(columns[field])
+            self.totals[field].merge(countValues(values), sign)
+            if field in self.histograms:
+                histogram, width = self.histograms[field], float(HISTOGRAM_BINS[field])
+                for (low, count) in Counter(map(floor, map(width.__rtruediv__, filterfalse(isnan, values)))).items():
+                    histogram[low] = histogram.get(low, 0) + sign*count
+            for (group, codepositions) in positions.items():
+                for (code, grouppositions) in codepositions.items():
+                    groupvalues = itemgetter(*grouppositions)(values) if len(grouppositions) > 1 else [values[grouppositions[0]]]
+                    self.groups[group][code][1][field].merge(countValues(groupvalues), sign)
+
+    def refresh(self):
+        """ Counts every row added to the catalog since the last refresh, then takes away every row removed since.
+            Rows both added and removed since are counted and taken away again, so every row is read once each way """
+        catalog = self.catalog
+        if self.names is not catalog.names: self._reset()
+        if self.read < len(catalog.names): self._count(range(self.read, len(catalog.names)))
+        if self.removed < len(catalog.removed): self._count(catalog.removed[self.removed:], -1)
+        self.read, self.removed = len(catalog.names), len(catalog.removed)
+
+    def summary(self):
+        """ Returns the statistics as a dictionary (as JSON saves it): the number of recipes, the number of each type
+            and SRM value, and the count, minimum, mean and maximum of each numeric field, followed by the same for
+            each type and SRM value (under 'groups'), and the histograms (bins by their range, eg. '1-2') """
+        self.refresh()
+        vocabularies = self.catalog.vocabularies
+        summary = {"recipes": self.recipes}
+        for field in CODED_FIELDS:
+            counts = [(vocabularies[field][code], group[0]) for (code, group) in self.groups[field].items() if group[0]]
+            summary[field] = dict(sorted(counts, key=lambda item: (-item[1], item[0])))
+        summary.update((field, aggregate.summary()) for (field, aggregate) in self.totals.items())
+        summary["groups"] = {field:{vocabularies[field][code]:{"recipes": recipes,
+            **{f:aggregate.summary() for (f, aggregate) in aggregates.items()}}
+            for (code, (recipes, aggregates)) in sorted(self.groups[field].items(), key=lambda item: vocabularies[field][item[0]].lower())
+            if recipes} for field in CODED_FIELDS}
+        summary["histograms"] = {field:{f"{compactNumber(low*width)}-{compactNumber((low+1)*width)}": count
+            for (low, count) in sorted(self.histograms[field].items()) if count}
+            for (field, width) in HISTOGRAM_BINS.items()}
+        return summary
@@ -0,0 +1,49 @@
+""" Compares the memory held by a catalog of recipes stored as a list of Beer objects (as loaded before, with every
+    field a string, and as loaded now, with parsed numbers) against the columnar RecipeCatalog.
+    Run from the repository root: 'python -m benchmarks.memory [SIZE ...]' """
+import gc, sys, tracemalloc
+
+from benchmarks.sorting import makeData
+from catalog import RecipeCatalog
+from core import Beer
+
+SIZES = [100000, 1000000]
+
+class LegacyBeer:
+    """ The Beer object as it was: a __dict__ per beer, holding every field as the string read from beers.json """
+    def __init__(self, name, jsondata):
+        self.name = name
+        self.type = jsondata["type"]
+        self.abv, self.gravity = jsondata["abv"], jsondata["gravity"]
+        self.ibu, self.srm = jsondata["ibu"], jsondata["srm"]
+        self.servingtemp = jsondata["servingtemp"]
+
+def legacyList(data):
+    return [LegacyBeer(*pair) for pair in data]
+
+def beerList(data):
+    return [Beer(*pair) for pair in data]
+
+def recipeCatalog(data):
+    catalog = RecipeCatalog(factory=Beer)
+    catalog.extend(data)
+    return catalog
+
+def measure(size, build):
+    """ Returns the memory (in MB) still held by what build makes from freshly loaded data, once the data is freed """
+    gc.collect()
+    tracemalloc.start()
+    data = makeData(size)
+    built = build(data)
+    del data
+    gc.collect()
+    held = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del built
+    return held / 2**20
+
+if __name__ == "__main__":
+    print(f"{'recipes':>9} {'legacy Beer list (MB)':>22} {'Beer list (MB)':>15} {'RecipeCatalog (MB)':>19}")
+    for size in map(int, sys.argv[1:]) if len(sys.argv) > 1 else SIZES:
+        results = [measure(size, build) for build in (legacyList, beerList, recipeCatalog)]
+        print("{:>9} {:>22.1f} {:>15.1f} {:>19.1f}".format(size, *results))
@@ -0,0 +1,134 @@
+""" Checks the colour scheme scraper's PageFetcher against a local server serving fixture palette pages (in the form
+    color-hex.com uses), so that fetching can be re-checked without scraping the real site: how much faster pages are
+    fetched concurrently, that cached pages are revalidated with their ETag rather than downloaded again, and that
+    Retry-After is waited for, unless it asks for longer than the fetcher's maxwait.
+    Run from the repository root: 'python -m benchmarks.scraper [--pages 32] [--delay 0.05]' (exits with 1 on failures) """
+import argparse, gzip, hashlib, sys, tempfile, threading
+from http.client import HTTPException
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import perf_counter, sleep
+
+from colourschemescraper import PageFetcher, parsePalettes
+
+PALETTES_PER_PAGE = 10
+CONCURRENCY = 8
+
+def fixturePage(page):
+    """ Returns a fixture page of palettes (as bytes), each with 5 colours """
+    palettes = list()
+    for n in range(PALETTES_PER_PAGE):
+        colours = "".join(f'<div class="palettecolordiv" style="background-color:#{(page*PALETTES_PER_PAGE + n)*5 + i:06x};"></div>'
+            for i in range(5))
+        palettes.append(f'<div class="palettecontainerlist"><a href="/color-palette/{n}" title="Color palette page {page} '
+            f'palette {n}"><div class="palettecolordivcon">{colours}</div></a></div>')
+    return f'<html><body><div class="palettes">{"".join(palettes)}</div></body></html>'.encode()
+
+class FixtureHandler(BaseHTTPRequestHandler):
+    """ Serves /palettes/N as fixture page N (after the server's delay), with an ETag and gzip if asked for.
+        /busy/N is refused with 503 and 'Retry-After: 1' the first time it is asked for, then served as /palettes/N.
+        /overloaded is always refused, asking for an hour's wait """
+    protocol_version = "HTTP/1.1" # So that connections are kept alive, as they are by the real site
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.requests += 1
+            server.active += 1
+            server.peak = max(server.peak, server.active)
+        try:
+            sleep(server.delay)
+            kind, _, page = self.path.strip("/").partition("/")
+            if kind == "overloaded": return self.reply(503, headers={"Retry-After": "3600"})
+            if kind == "busy":
+                with server.lock:
+                    refused = page in server.refused
+                    server.refused.add(page)
+                if not refused:
+                    return self.reply(503, headers={"Retry-After": "1"})
+            elif kind != "palettes": return self.reply(404)
+            body = fixturePage(int(page))
+            etag = f'"{hashlib.sha1(body).hexdigest()}"'
+            if self.headers.get("If-None-Match") == etag:
+                with server.lock: server.notmodified += 1
+                return self.reply(304, headers={"ETag": etag})
+            headers = {"ETag": etag}
+            if "gzip" in (self.headers.get("Accept-Encoding") or ""):
+                body, headers["Content-Encoding"] = gzip.compress(body), "gzip"
+            self.reply(200, body, headers)
+        finally:
+            with server.lock: server.active -= 1
+
+    def reply(self, status, body=b"", headers=None):
+        self.send_response(status)
+        for (header, value) in (headers or dict()).items(): self.send_header(header, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass # Every request would otherwise be printed
+
+def startServer(delay):
+    """ Starts the fixture server (on a free port) on a background thread, returning it """
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FixtureHandler)
+    server.daemon_threads = True
+    server.delay, server.lock = delay, threading.Lock()
+    server.requests = server.active = server.peak = server.notmodified = 0
+    server.refused = set() # The /busy pages already refused once
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def timed(function):
+    start = perf_counter()
+    result = function()
+    return result, perf_counter() - start
+
+def check(pages, delay):
+    """ Runs every check, printing each, and returns the number that failed """
+    server = startServer(delay)
+    base = f"http://127.0.0.1:{server.server_address[1]}"
+    urls = [f"{base}/palettes/{page}" for page in range(pages)]
+    failures = 0
+    def report(name, passed, detail):
+        nonlocal failures
+        failures += not passed
+        print(f"{'ok' if passed else 'FAILED':<7} {name:<26} {detail}")
+    try:
+        with tempfile.TemporaryDirectory() as cachedir:
+            serial, serialseconds = timed(lambda: list(PageFetcher(1, cachedir=None).fetchAll(urls)))
+            server.peak = 0
+            fetcher = PageFetcher(CONCURRENCY, cachedir=cachedir)
+            fetched, seconds = timed(lambda: list(fetcher.fetchAll(urls)))
+            palettes = sum(len(list(parsePalettes(page))) for (url, page) in fetched)
+            report("fetched in order", [url for (url, page) in fetched] == urls and fetched == serial,
+                f"{len(fetched)} pages, {palettes} palettes")
+            report("concurrency", server.peak > 1 and seconds < serialseconds,
+                f"{serialseconds*1000:.0f} ms one at a time, {seconds*1000:.0f} ms {CONCURRENCY} at a time "
+                f"({server.peak} requests at once)")
+            notmodified = server.notmodified
+            revalidating = PageFetcher(CONCURRENCY, cachedir=cachedir)
+            cached, seconds = timed(lambda: list(revalidating.fetchAll(urls)))
+            report("ETag revalidation", cached == fetched and revalidating.stats["revalidated"] == pages
+                and revalidating.stats["fetched"] == 0 and server.notmodified - notmodified == pages,
+                f"{revalidating.stats['revalidated']} of {pages} pages not modified, in {seconds*1000:.0f} ms")
+        fetcher = PageFetcher(1, cachedir=None, retries=2, backoff=0.1, maxwait=2)
+        page, seconds = timed(lambda: fetcher.fetch(f"{base}/busy/0"))
+        report("Retry-After waited for", page == fixturePage(0) and fetcher.stats["retried"] == 1 and seconds >= 1,
+            f"served after {seconds*1000:.0f} ms ({fetcher.stats['retried']} retry)")
+        requests = server.requests
+        try: _, seconds = timed(lambda: fetcher.fetch(f"{base}/overloaded"))
+        except HTTPException as error: passed, detail = True, str(error).split(": ", 1)[-1]
+        else: passed, detail = False, "served"
+        report("Retry-After over maxwait", passed and server.requests - requests == 1,
+            f"{detail} after {server.requests - requests} request(s), rather than waiting an hour")
+    finally:
+        server.shutdown()
+        server.server_close()
+    return failures
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.scraper", description="Colour scheme scraper fetch checks")
+    parser.add_argument("--pages", type=int, default=32, help="number of fixture pages to fetch")
+    parser.add_argument("--delay", type=float, default=0.05, help="seconds the server takes to answer each request")
+    args = parser.parse_args()
+    sys.exit(1 if check(args.pages, args.delay) else 0)
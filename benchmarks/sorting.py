@@ -0,0 +1,68 @@
+""" Compares sorting beers with the old string-comparing Beer.__lt__ against the key-based sort, and times switching
+    between cached sorting modes. Run from the repository root: 'python -m benchmarks.sorting [SIZE ...]' """
+import random, sys
+from time import perf_counter
+
+from catalog import RecipeCatalog
+from core import Beer
+
+SIZES = [10000, 1000000]
+MODES = ['abc+', 'abv-', 'ibu+', 'gravity-', 'type+abv-']
+LEGACY_MODES = ['abc+', 'abc-', 'abv+', 'abv-', 'ibu+', 'ibu-', 'gravity+', 'gravity-']
+
+class LegacyBeer:
+    """ The Beer sort as it was: a chain of sorting_mode comparisons on the raw strings from beers.json """
+    sorting_mode = 'abc+'
+
+    def __init__(self, name, jsondata):
+        self.name = name
+        self.abv, self.gravity, self.ibu = jsondata["abv"], jsondata["gravity"], jsondata["ibu"]
+
+    def __lt__(self, other):
+        if self.sorting_mode == 'abc+': return self.name < other.name
+        elif self.sorting_mode == 'abc-': return self.name > other.name
+        elif self.sorting_mode == 'abv+': return self.abv < other.abv
+        elif self.sorting_mode == 'abv-': return self.abv > other.abv
+        elif self.sorting_mode == 'ibu+': return self.ibu < other.ibu
+        elif self.sorting_mode == 'ibu-': return self.ibu > other.ibu
+        elif self.sorting_mode == 'gravity+': return self.gravity < other.gravity
+        elif self.sorting_mode == 'gravity-': return self.gravity > other.gravity
+
+def makeData(size):
+    """ Returns synthetic (name, jsondata) pairs, in random order, with numbers stored as strings like beers.json """
+    rand = random.Random(size)
+    data = [(f"Beer {n:07d}", {"type": f"Type {rand.randint(0, 99)}", "abv": str(round(rand.uniform(2, 12), 1)),
+        "gravity": str(round(rand.uniform(1, 12), 1)), "ibu": str(rand.randint(5, 100)), "srm": "Straw",
+        "servingtemp": str(rand.randint(3, 14))}) for n in range(size)]
+    rand.shuffle(data)
+    return data
+
+def timed(function):
+    start = perf_counter()
+    result = function()
+    return result, perf_counter() - start
+
+def benchmark(size):
+    data = makeData(size)
+    legacy = [LegacyBeer(*pair) for pair in data]
+    catalog = RecipeCatalog(factory=Beer)
+    _, loading = timed(lambda: catalog.extend(data))
+    print(f"\n{size} beers (loading into the catalog, parsing numeric fields and sorting by name: {loading:.2f}s)")
+    print(f"{'mode':>10} {'__lt__ (s)':>11} {'key (s)':>9} {'from abc+ (s)':>13} {'cached switch (ms)':>19}")
+    for mode in MODES:
+        if mode in LEGACY_MODES:
+            LegacyBeer.sorting_mode = mode
+            legacytime = f"{timed(lambda: sorted(legacy))[1]:>11.2f}"
+        else: legacytime = f"{'n/a':>11}"
+        keytime = timed(lambda: catalog.sortRows(catalog.rows(), mode))[1]
+        cachedtime = timed(lambda: catalog.ordering(mode))[1] # First use, sorted from the cached name ordering
+        switch = timed(lambda: catalog.ordering(mode))[1]
+        print(f"{mode:>10} {legacytime} {keytime:>9.2f} {cachedtime:>13.2f} {switch*1000:>19.4f}")
+    beer = {"type": "Type 0", "abv": "5", "gravity": "5", "ibu": "20", "srm": "Straw", "servingtemp": "7"}
+    _, adding = timed(lambda: catalog.add("Aaa", beer))
+    _, removing = timed(lambda: catalog.remove("Aaa"))
+    print(f"Keeping {len(MODES)} cached orderings sorted: add {adding*1000:.2f}ms, remove {removing*1000:.2f}ms")
+
+if __name__ == "__main__":
+    for size in map(int, sys.argv[1:]) if len(sys.argv) > 1 else SIZES:
+        benchmark(size)
@@ -0,0 +1,315 @@
+""" Times each stage of the recipe manager (loading, saving, sorting, searching and rendering) against synthetic catalogs
+    of increasing size, recording the peak memory of each, and saves the results as JSON so that runs can be compared.
+    Every stage runs in a fresh process, so that its peak memory isn't hidden by an earlier stage's.
+    GUI stages need a display: without one they are run under Xvfb (or skipped, if it isn't installed).
+    Run from the repository root: 'python -m benchmarks.suite [--sizes 1000 100000] [--output FILE] [--compare FILE]' """
+import argparse, json, os, platform, random, shutil, subprocess, sys, tempfile, time
+from datetime import datetime, timezone
+from statistics import median
+from time import perf_counter
+
+try: import resource
+except ImportError: resource = None # Not available on Windows, where peak memory isn't recorded
+
+from catalog import loadVocabulary
+
+SIZES = [1000, 100000, 1000000]
+SEARCHES = ['type:"american ipa" abv:5-7 ibu>50', 'type:IPA abv:5-7', 'srm:straw temp<=6', 'beer 00001', 'gravity:2-3']
+SEARCH_REPEATS = 25
+DETAIL_VIEWS = 200
+EDIT_REPEATS = 25
+HISTORY_EDITS = 500
+
+# The stages timed, in order, and whether each needs a display
+STAGES = {
+    "loadBeers": False,
+    "loadCatalog": False,
+    "loadSnapshot": False,
+    "saveBeers": False,
+    "sortBeers": False,
+    "sortCatalog": False,
+    "search": False,
+    "brewing": False,
+    "statistics": False,
+    "statisticsContinuous": False,
+    "history": False,
+    "setupWindow": True,
+    "displayBeerList": True,
+    "displayInformation": True,
+    "editBeer": True
+}
+
+# How much slower (as a ratio of the earlier run) a stage must be to count as a regression when comparing runs
+REGRESSION_THRESHOLD = 1.2
+
+def makeCatalog(size, path, continuous=False):
+    """ Writes a synthetic beers.json of the given size, using the real beer types and SRM values. Numbers are rounded
+        as brewers give them, unless continuous, when (almost) every value of every field is different """
+    beertypes, srmscale = loadVocabulary("data/beertypes.csv"), loadVocabulary("data/srm.csv")
+    rand = random.Random(size)
+    number = (lambda low, high, digits: str(rand.uniform(low, high))) if continuous else \
+        (lambda low, high, digits: str(round(rand.uniform(low, high), digits) if digits else rand.randint(low, high)))
+    beers = {f"Beer {n:07d}": {
+        "type": rand.choice(beertypes), "abv": number(2, 12, 1), "gravity": number(1, 12, 1), "ibu": number(5, 100, 0),
+        "srm": rand.choice(srmscale), "servingtemp": number(3, 14, 0)
+    } for n in range(size)}
+    with open(path, "w") as beerfile:
+        json.dump(beers, beerfile)
+
+def addIngredients(catalog):
+    """ Gives every recipe of a catalog synthetic ingredients (1 to 4 hop additions and grains), as brewing reads them """
+    rand = random.Random(len(catalog))
+    for row in catalog.rows():
+        catalog.extra[row] = {"fg": round(rand.uniform(1.005, 1.02), 3), "batchsize": 20,
+            "hops": [{"amount": rand.randint(10, 60), "alpha": round(rand.uniform(3, 14), 1), "time": rand.choice([60, 30, 10, 0])}
+                for _ in range(rand.randint(1, 4))],
+            "grains": [{"amount": round(rand.uniform(0.2, 5), 2), "colour": rand.randint(2, 300)} for _ in range(rand.randint(1, 4))]}
+
+def timed(function):
+    start = perf_counter()
+    result = function()
+    return result, perf_counter() - start
+
+def countWidgets(widget):
+    """ Returns the number of Tk widgets under (and including) the given one """
+    return 1 + sum(map(countWidgets, widget.winfo_children()))
+
+def peakMemory():
+    """ Returns the peak memory (resident set size, in MB) of this process so far, or None if it can't be measured """
+    if resource is None: return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2**20 if sys.platform == "darwin" else peak / 2**10 # Bytes on macOS, kilobytes elsewhere
+
+def runStage(stage, path):
+    """ Runs a single stage against the recipes file, returning the time it took (in seconds) and any details """
+    import core
+    if stage == "loadBeers": return timed(lambda: core.loadBeers(path))[1], dict()
+    elif stage == "loadCatalog": # From the JSON file (which includes saving its snapshot)
+        from snapshot import snapshotPath
+        if os.path.exists(snapshotPath(path)): os.remove(snapshotPath(path))
+        return timed(lambda: core.loadCatalog(path))[1], dict()
+    elif stage == "loadSnapshot": # From the snapshot saved by an earlier run (in another process)
+        from snapshot import snapshotPath
+        if not os.path.exists(snapshotPath(path)): subprocess.run([sys.executable, "-c",
+            f"import core; core.loadCatalog({path!r})"], check=True)
+        return timed(lambda: core.loadCatalog(path))[1], dict()
+    elif stage == "saveBeers":
+        catalog, savepath = core.loadCatalog(path), os.path.join(os.path.dirname(path), "saved.json")
+        seconds = timed(lambda: core.saveBeers(catalog, savepath))[1]
+        os.remove(savepath)
+        return seconds, dict()
+    elif stage == "sortBeers":
+        beers = core.loadBeers(path)
+        core.Beer.sorting_mode = 'abv-'
+        return timed(lambda: sorted(beers))[1], {"sorting_mode": 'abv-'}
+    elif stage == "sortCatalog": # Every sorting mode, as the catalog sorts them (starting from the name ordering)
+        catalog, modes = core.loadCatalog(path), dict()
+        for sorting_mode in core.Beer.sorting_modes: modes[sorting_mode] = timed(lambda: catalog.ordering(sorting_mode))[1]
+        return sum(modes.values()), {"sorting_modes": modes}
+    elif stage == "search": # The median time of each search, once the indexes it uses have been built
+        catalog, searches = core.loadCatalog(path), dict()
+        filters = [core.parseQuery(query, catalog.vocabularies) for query in SEARCHES]
+        indexing = timed(lambda: [catalog.match(f) for f in filters])[1]
+        for (query, f) in zip(SEARCHES, filters):
+            searches[query] = median(timed(lambda: catalog.match(f))[1] for _ in range(SEARCH_REPEATS))
+        return sum(searches.values()), {"indexing": indexing, "searches": searches}
+    elif stage == "brewing": # The median time to calculate every recipe, once the engine has read their ingredients
+        from brewing import BrewingEngine
+        catalog = core.loadCatalog(path)
+        addIngredients(catalog)
+        engine = BrewingEngine(catalog)
+        reading = timed(engine.refresh)[1]
+        seconds = median(timed(engine.calculate)[1] for _ in range(SEARCH_REPEATS))
+        return seconds, {"reading": reading, "hops": len(engine.hoprows), "grains": len(engine.grainrows)}
+    elif stage in ("statistics", "statisticsContinuous"):
+        # The median time to bring the statistics up to date after a recipe is removed, and again once it is added back
+        # (and the same for the recipe with the highest ABV, in the details), with unrounded numbers for statisticsContinuous
+        if stage == "statisticsContinuous":
+            copypath = os.path.join(os.path.dirname(path), "continuous.json")
+            with open(path) as beerfile: makeCatalog(len(json.load(beerfile)), copypath, continuous=True)
+            path = copypath
+        manager = core.RecipeManager(path)
+        building = timed(manager.stats)[1]
+        def change(name):
+            data = manager.catalog.record(manager.catalog.row(name))[1]
+            manager.catalog.remove(name)
+            manager.stats()
+            manager.catalog.add(name, data)
+            return manager.stats()
+        manager.catalog.add("Benchmark", manager.catalog.record(0)[1])
+        seconds = median(timed(lambda: change("Benchmark"))[1] for _ in range(SEARCH_REPEATS))
+        strongest = manager.catalog.names[max(manager.catalog.rows(), key=manager.catalog.columns["abv"].__getitem__)]
+        extreme = median(timed(lambda: change(strongest))[1] for _ in range(SEARCH_REPEATS))
+        manager.close()
+        if stage == "statisticsContinuous":
+            for suffix in (".json", ".snapshot", ".lock"):
+                if os.path.exists(os.path.splitext(copypath)[0] + suffix): os.remove(os.path.splitext(copypath)[0] + suffix)
+        return seconds, {"building": building, "extreme": extreme}
+    elif stage == "history": # The median time to restore every recipe to a point in its history, with its size on disk
+        from history import historyPath
+        copypath = os.path.join(os.path.dirname(path), "history.json") # Edited, so a copy of the catalog is used
+        shutil.copyfile(path, copypath)
+        manager, rand = core.RecipeManager(copypath), random.Random(len(path))
+        names, versions, middle = [manager.catalog.names[rand.randrange(50)] for _ in range(HISTORY_EDITS)], 0, None
+        for (edit, name) in enumerate(names):
+            field = rand.choice(["abv", "ibu", "servingtemp"])
+            manager.update(name, {field: str(rand.randint(3, 12) if field != "ibu" else rand.randint(5, 100))})
+            versions += len(json.dumps({"t": round(time.time(), 3), "name": name, "data": manager.catalog.record(
+                manager.catalog.row(name))[1]}, separators=(",", ":"))) + 1 # As the history would save it whole
+            if edit == HISTORY_EDITS // 2: middle = time.time()
+        manager.close()
+        seconds = median(timed(lambda: manager.history.restoreAll(middle))[1] for _ in range(SEARCH_REPEATS))
+        details = {"edits": HISTORY_EDITS, "history_bytes": os.path.getsize(historyPath(copypath)),
+            "whole_versions_bytes": versions, "file_copies_bytes": HISTORY_EDITS * os.path.getsize(path),
+            "restore_one": median(timed(lambda: manager.history.restore(names[0], middle))[1] for _ in range(SEARCH_REPEATS))}
+        for suffix in (".json", ".journal", ".snapshot", ".lock"):
+            if os.path.exists(os.path.splitext(copypath)[0] + suffix): os.remove(os.path.splitext(copypath)[0] + suffix)
+        os.remove(historyPath(copypath))
+        return seconds, details
+    import main
+    main.SYSTEM = platform.system()
+    if stage == "setupWindow": # Until the window is shown (and, in the details, until the recipes are shown in it)
+        def setup():
+            main.application = main.setupWindow(path)
+            main.application.app.update()
+        def show():
+            main.application.waitForWorker()
+            main.application.app.update()
+        seconds = timed(setup)[1]
+        details = {"loaded": seconds + timed(show)[1]}
+    elif stage == "displayBeerList":
+        main.application = main.setupWindow(path)
+        main.application.waitForWorker()
+        main.application.app.update()
+        def display():
+            main.displayBeerList()
+            main.application.app.update()
+        seconds, details = timed(display)[1], dict()
+    elif stage == "displayInformation": # The median time to switch the detail window to another beer
+        main.application = main.setupWindow(path)
+        main.application.waitForWorker()
+        beers = main.application.beers
+        def display(index):
+            beers[index * len(beers) // DETAIL_VIEWS].displayInformation()
+            main.application.app.update()
+        display(0)
+        widgets = countWidgets(main.application.app)
+        seconds = median(timed(lambda: display(index))[1] for index in range(1, DETAIL_VIEWS))
+        details = {"views": DETAIL_VIEWS, "widgets": widgets, "widgets_after": countWidgets(main.application.app)}
+    elif stage == "editBeer": # The median time to add a beer and delete it again in the window, compared to a restart
+        main.application = main.setupWindow(path)
+        main.application.waitForWorker()
+        data = {"type": "Altbier", "abv": "5", "gravity": "5", "ibu": "20", "srm": "Straw", "servingtemp": "7"}
+        def add(name):
+            main.application.addBeer(name, data)
+            main.application.app.update()
+        def remove(name):
+            main.application.removeBeer(name)
+            main.application.app.update()
+        added, removed = list(), list()
+        for n in range(EDIT_REPEATS):
+            added.append(timed(lambda: add(f"Aaa {n:02d}"))[1])
+            removed.append(timed(lambda: remove(f"Aaa {n:02d}"))[1])
+        def restart(): # Destroys the window and sets up a new one from scratch, as every edit used to
+            main.application.manager.close() # Waits for the edits to be saved, so that they are loaded again
+            main.application.app.destroy()
+            main.application = main.setupWindow(path)
+            main.application.waitForWorker()
+            main.application.app.update()
+        seconds = median(map(sum, zip(added, removed)))
+        details = {"edits": EDIT_REPEATS, "add": median(added), "remove": median(removed), "restart": timed(restart)[1]}
+    else: raise KeyError(stage)
+    main.application.manager.close()
+    main.application.app.destroy()
+    return seconds, details
+
+def measureStage(stage, size, path, environment):
+    """ Runs a stage in a new process, returning its result (as saved in the results file) """
+    process = subprocess.run([sys.executable, "-m", "benchmarks.suite", "--stage", stage, path], env=environment,
+        capture_output=True, text=True)
+    if process.returncode != 0:
+        return {"stage": stage, "size": size, "error": process.stderr.strip().splitlines()[-1:]}
+    return {"stage": stage, "size": size, **json.loads(process.stdout.strip().splitlines()[-1])}
+
+def startDisplay():
+    """ Starts Xvfb if there is no display, returning its process (or None), and the environment GUI stages are run in,
+        or None if there is no display to run them on """
+    if os.environ.get("DISPLAY") or sys.platform in ("win32", "darwin"): return None, dict(os.environ)
+    if not shutil.which("Xvfb"): return None, None
+    display = f":{100 + os.getpid() % 100}"
+    xvfb = subprocess.Popen(["Xvfb", display, "-screen", "0", "1280x1024x24", "-nolisten", "tcp"],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    time.sleep(1)
+    return xvfb, {**os.environ, "DISPLAY": display}
+
+def gitCommit():
+    """ Returns the commit being benchmarked, or None if it isn't known """
+    try: return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True).stdout.strip() or None
+    except OSError: return None
+
+def benchmark(sizes, stages, directory):
+    """ Runs every stage against a catalog of each size, printing and returning the results """
+    xvfb, display = startDisplay()
+    results = list()
+    try:
+        for size in sizes:
+            path = os.path.join(directory, f"beers_{size}.json")
+            if not os.path.exists(path): makeCatalog(size, path)
+            for stage in stages:
+                if STAGES[stage] and display is None:
+                    result = {"stage": stage, "size": size, "skipped": "No display (and Xvfb isn't installed)"}
+                else: result = measureStage(stage, size, path, display if STAGES[stage] else dict(os.environ))
+                results.append(result)
+                printResult(result)
+    finally:
+        if xvfb: xvfb.terminate()
+    return results
+
+def printResult(result):
+    if "seconds" in result:
+        peak = f"{result['peak_mb']:>9.1f}" if result.get("peak_mb") is not None else f"{'n/a':>9}"
+        print(f"{result['size']:>8} {result['stage']:<20} {result['seconds']*1000:>12.3f} {peak}")
+    else: print(f"{result['size']:>8} {result['stage']:<20} {result.get('skipped') or result.get('error')}")
+
+def compare(results, earlier):
+    """ Prints how each stage's time has changed since an earlier run, returning the number of regressions """
+    before = {(r["stage"], r["size"]):r["seconds"] for r in earlier["results"] if "seconds" in r}
+    print(f"\nCompared with {earlier.get('commit') or 'the earlier run'} ({earlier.get('date')}):")
+    regressions = 0
+    for result in results:
+        key = (result["stage"], result["size"])
+        if "seconds" not in result or not before.get(key): continue
+        ratio = result["seconds"] / before[key]
+        regressed = ratio > REGRESSION_THRESHOLD
+        regressions += regressed
+        print(f"{result['size']:>8} {result['stage']:<20} {ratio:>7.2f}x{'  REGRESSION' if regressed else ''}")
+    return regressions
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.suite", description="Recipe manager benchmark suite")
+    parser.add_argument("--sizes", type=int, nargs="+", default=SIZES, help="catalog sizes to benchmark")
+    parser.add_argument("--stages", nargs="+", default=list(STAGES), choices=list(STAGES), help="stages to run")
+    parser.add_argument("--output", default="benchmark-results.json", help="file to save the results to (as JSON)")
+    parser.add_argument("--compare", help="an earlier results file to compare against (exits with 1 on regressions)")
+    parser.add_argument("--catalogs", help="directory to keep the generated catalogs in, to reuse them between runs")
+    parser.add_argument("--stage", help=argparse.SUPPRESS) # Used to run a single stage in a new process
+    parser.add_argument("path", nargs="?", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.stage:
+        seconds, details = runStage(args.stage, args.path)
+        print(json.dumps({"seconds": seconds, "peak_mb": peakMemory(), "details": details}))
+        sys.exit(0)
+    print(f"{'recipes':>8} {'stage':<20} {'time (ms)':>12} {'peak (MB)':>9}")
+    if args.catalogs:
+        os.makedirs(args.catalogs, exist_ok=True)
+        results = benchmark(args.sizes, args.stages, args.catalogs)
+    else:
+        with tempfile.TemporaryDirectory() as directory: results = benchmark(args.sizes, args.stages, directory)
+    run = {"date": datetime.now(timezone.utc).isoformat(timespec="seconds"), "commit": gitCommit(),
+        "python": platform.python_version(), "platform": platform.platform(), "sizes": args.sizes, "results": results}
+    with open(args.output, "w") as outputfile:
+        json.dump(run, outputfile, indent=2)
+    print(f"Saved the results to {args.output}")
+    if args.compare:
+        with open(args.compare, "r") as comparefile:
+            sys.exit(1 if compare(results, json.load(comparefile)) else 0)
@@ -0,0 +1,141 @@
+""" Brewing calculations: ABV from the original and final gravity, IBU from the hop additions (Tinseth) and SRM from the
+    grain bill (Morey), for recipes with the optional ingredient fields they need (see INGREDIENT_FIELDS in core.py).
+    BrewingEngine calculates them for every recipe of a catalog at once with NumPy, so that checking the whole catalog
+    after a formula or ingredient change takes a few array operations rather than a Python loop over every recipe """
+from array import array
+from core import SRM_SCALE, RecipeError
+from storage import compactNumber, numeric
+
+try: import numpy
+except ImportError: numpy = None # Only needed by the BrewingEngine, so the rest of the recipe manager runs without it
+
+# Gravities up to this are specific gravities (eg. 1.048), and anything above it is in degrees Plato (eg. 12)
+PLATO_THRESHOLD = 2
+
+# The ABV (in %) given by each unit of specific gravity fermented
+ABV_FACTOR = 131.25
+
+# Tinseth's constants: the bigness factor (and its base), and the boil time factor (and its maximum utilisation)
+TINSETH_BIGNESS = 1.65
+TINSETH_BIGNESS_BASE = 0.000125
+TINSETH_TIME = 0.04
+TINSETH_MAX = 4.15
+
+# Morey's constants, turning malt colour units (lbs x degrees Lovibond per US gallon) into SRM
+MOREY_FACTOR = 1.4922
+MOREY_EXPONENT = 0.6859
+
+POUNDS_PER_KILOGRAM = 2.20462
+LITRES_PER_GALLON = 3.78541
+
+# How far a stated value may be from the calculated one before check reports it (SRM is compared by colour name)
+TOLERANCES = {
+    "abv": 0.3,
+    "ibu": 5
+}
+
+def specificGravity(gravity):
+    """ Returns gravities as specific gravities, converting any given in degrees Plato """
+    gravity = numpy.asarray(gravity, dtype=float)
+    return numpy.where(gravity > PLATO_THRESHOLD, 1 + gravity / (258.6 - gravity / 258.2 * 227.1), gravity)
+
+def alcohol(og, fg):
+    """ Returns the ABV (in %) of beers with the given original and final gravities """
+    return (specificGravity(og) - specificGravity(fg)) * ABV_FACTOR
+
+def tinseth(og, grams, alpha, minutes, litres):
+    """ Returns the IBU each hop addition gives (by Tinseth's formula), from the wort's original gravity, the weight of
+        the hops, their alpha acid %, how long they are boiled for, and the batch size """
+    bigness = TINSETH_BIGNESS * TINSETH_BIGNESS_BASE ** (specificGravity(og) - 1)
+    boil = (1 - numpy.exp(-TINSETH_TIME * numpy.asarray(minutes, dtype=float))) / TINSETH_MAX
+    return bigness * boil * numpy.asarray(alpha, dtype=float) / 100 * numpy.asarray(grams, dtype=float) * 1000 / litres
+
+def maltColourUnits(kilograms, lovibond, litres):
+    """ Returns the malt colour units each grain gives, from its weight, colour and the batch size """
+    return numpy.asarray(kilograms, dtype=float) * POUNDS_PER_KILOGRAM * lovibond / (numpy.asarray(litres) / LITRES_PER_GALLON)
+
+def morey(mcu):
+    """ Returns the SRM of beers with the given (total) malt colour units, by Morey's formula """
+    return MOREY_FACTOR * numpy.asarray(mcu, dtype=float) ** MOREY_EXPONENT
+
+def srmIndices(srm):
+    """ Returns, for each SRM number, the index of its colour in SRM_SCALE (as srmName picks it), or -1 where the SRM
+        is missing """
+    indices = numpy.searchsorted([value for (name, value) in SRM_SCALE], srm, side="left")
+    return numpy.where(numpy.isnan(srm), -1, numpy.minimum(indices, len(SRM_SCALE) - 1))
+
+class BrewingEngine:
+    """ BrewingEngine object. Calculates the ABV, IBU and SRM of every recipe of a catalog at once. The ingredients are
+        kept flattened into arrays (one entry per hop addition or grain, along with the row it belongs to), which are
+        extended as recipes are added rather than rebuilt, so calculating only reads the rows added since last time """
+
+    def __init__(self, catalog):
+        if numpy is None: raise RecipeError("Brewing calculations need NumPy (pip install numpy)")
+        self.catalog = catalog
+        self._reset()
+
+    def __repr__(self):
+        return f"<BrewingEngine: {len(self.hoprows)} hop additions, {len(self.grainrows)} grains>"
+
+    def _reset(self):
+        self.names, self.read = self.catalog.names, 0 # The catalog's name list is replaced when it is compacted
+        self.fg, self.batchsize = array("d"), array("d")
+        self.hoprows, self.hops = array("I"), {part:array("d") for part in ("amount", "alpha", "time")}
+        self.grainrows, self.grains = array("I"), {part:array("d") for part in ("amount", "colour")}
+
+    def refresh(self):
+        """ Reads the ingredients of every row added to the catalog since the last refresh (or of every row, if the
+            catalog has been compacted since). Rows that have since been removed are left in, and masked out later """
+        if self.names is not self.catalog.names: self._reset()
+        nan, extras = float("nan"), self.catalog.extra
+        for row in range(self.read, len(self.catalog.names)):
+            extra = extras.get(row, dict())
+            fg, batchsize = numeric(extra.get("fg")), numeric(extra.get("batchsize"))
+            self.fg.append(nan if fg is None else fg)
+            self.batchsize.append(nan if batchsize is None else batchsize)
+            for (rows, parts, items) in ((self.hoprows, self.hops, "hops"), (self.grainrows, self.grains, "grains")):
+                for item in extra.get(items) or ():
+                    rows.append(row)
+                    for (part, values) in parts.items(): values.append(numeric(item.get(part)) or 0.0)
+        self.read = len(self.catalog.names)
+
+    def calculate(self):
+        """ Returns a dictionary of arrays of the calculated ABV, IBU and SRM of every row, which are NaN where a
+            recipe doesn't have the ingredients needed (or its row has been removed) """
+        self.refresh()
+        size = self.read
+        og, fg, litres = column(self.catalog.columns["gravity"]), column(self.fg), column(self.batchsize)
+        hoprows, grainrows = column(self.hoprows, numpy.uint32), column(self.grainrows, numpy.uint32)
+        hops, grains = {p:column(v) for (p,v) in self.hops.items()}, {p:column(v) for (p,v) in self.grains.items()}
+        ibu = numpy.bincount(hoprows, minlength=size, weights=tinseth(og[hoprows], hops["amount"], hops["alpha"],
+            hops["time"], litres[hoprows]))
+        mcu = numpy.bincount(grainrows, minlength=size,
+            weights=maltColourUnits(grains["amount"], grains["colour"], litres[grainrows]))
+        ibu[numpy.bincount(hoprows, minlength=size) == 0] = numpy.nan
+        mcu[numpy.bincount(grainrows, minlength=size) == 0] = numpy.nan
+        calculated = {"abv": alcohol(og, fg), "ibu": ibu, "srm": morey(mcu)}
+        dead = column(self.catalog.alive, numpy.uint8) == 0
+        for values in calculated.values(): values[dead] = numpy.nan
+        return calculated
+
+    def check(self, tolerances=TOLERANCES):
+        """ Returns (row, field, stated value, calculated value) for every field of every recipe whose stated value
+            doesn't match the value calculated from its ingredients, in name order. The SRM is compared by its colour
+            name, so the calculated SRM is given as the name too """
+        calculated, columns, catalog = self.calculate(), self.catalog.columns, self.catalog
+        problems = list()
+        for (field, tolerance) in tolerances.items(): # NaN (ie. missing) is never further than the tolerance
+            stated = column(columns[field])
+            for row in numpy.flatnonzero(numpy.abs(stated - calculated[field]) > tolerance).tolist():
+                problems.append((row, field, stated[row], round(float(calculated[field][row]), 1)))
+        indices = srmIndices(calculated["srm"])
+        codes = numpy.array([catalog._codes["srm"].get(name, -1) for (name, value) in SRM_SCALE])
+        for row in numpy.flatnonzero((indices >= 0) & (codes[indices] != column(columns["srm"], numpy.uint16))).tolist():
+            problems.append((row, "srm", catalog.value(row, "srm"), SRM_SCALE[indices[row]][0]))
+        problems.sort(key=lambda problem: (catalog.names[problem[0]].lower(), problem[1]))
+        return [(row, field, compactNumber(numeric(stated)) if field != "srm" else stated, value) for (row, field, stated, value) in problems]
+
+def column(values, dtype=float):
+    """ Returns a copy of an array (or bytearray) as a NumPy array. A copy is taken, rather than a view of its buffer,
+        so that the array can still grow (Python arrays can't be resized while they are being viewed) """
+    return numpy.frombuffer(values, dtype=dtype).copy() if len(values) else numpy.zeros(0, dtype=dtype)
@@ -0,0 +1,443 @@
+import csv, sys
+from array import array
+from bisect import bisect_left
+from itertools import chain, islice, product
+from operator import eq
+from storage import FIELDS, NUMERIC_FIELDS, numeric, compactNumber, parseSortingMode
+
+# The sort key given to numeric fields that are missing (or couldn't be parsed), so that they always sort last
+MISSING = float("inf")
+
+# Fields stored as small integer codes, indexing into the vocabulary read from the given CSV file
+CODED_FIELDS = {
+    "type": "data/beertypes.csv",
+    "srm": "data/srm.csv"
+}
+
+# The (ascending) sorting mode whose ordering is used as the range index of each numeric field
+RANGE_MODES = {
+    "abv": "abv+",
+    "ibu": "ibu+",
+    "gravity": "gravity+",
+    "servingtemp": "temp+"
+}
+
+# Few enough candidate rows for a search to check one by one, rather than combining a type or SRM filter with a range
+FEW_CANDIDATES = 1024
+
+def loadVocabulary(path):
+    """ Loads a vocabulary (ie. the list of beer types or SRM values) from a single-row CSV file """
+    with open(path, "r") as csvfile:
+        return list(csv.reader(csvfile))[0]
+
+class RecipeCatalog:
+    """ RecipeCatalog object. Holds every recipe in compact columns rather than one object per recipe:
+        numeric fields in typed arrays (NaN when missing), type and SRM as integer codes into their vocabularies
+        (from beertypes.csv and srm.csv, extended with any unknown values), and names in a single string table.
+        Each recipe is a row number. Beer objects are only created on demand, as views of a row, by the factory.
+        Removed rows are marked dead, and reclaimed when the catalog is compacted.
+        Searches use the cached orderings as indexes (name order for name prefixes, and ascending numeric orderings for
+        ranges), along with a posting list of rows for each type and SRM value, and (once a search has combined the two)
+        those posting lists sorted by a numeric field. All of them are kept up to date as recipes are added and removed,
+        rather than being rebuilt """
+
+    def __init__(self, vocabularies=None, factory=None):
+        if vocabularies is None: vocabularies = {field:loadVocabulary(path) for (field, path) in CODED_FIELDS.items()}
+        self.vocabularies = {field:list(map(sys.intern, vocabularies[field])) for field in CODED_FIELDS}
+        self._codes = {field:{v:c for (c,v) in enumerate(vocab)} for (field, vocab) in self.vocabularies.items()}
+        self.factory = factory
+        self.names = list()
+        self.columns = {field:array("d") for field in NUMERIC_FIELDS}
+        self.columns.update({field:array("H") for field in CODED_FIELDS})
+        self.alive = bytearray()
+        self.extra = dict() # Row number to any fields that don't have a column
+        self.deleted = 0
+        self.removed = array("I") # Removed rows in the order they were removed, so summaries can catch up without a scan
+        self.orderings = dict()
+        self.postings = {field:dict() for field in CODED_FIELDS} # Code to an array of its (live) rows, in row order
+        self.rangepostings = dict() # (Coded field, numeric field) to code to an array of its rows, in that field's range order
+        self.changes = 0 # Counts every change, so that views can tell when they are out of date
+
+    def __repr__(self):
+        return f"<RecipeCatalog: {len(self)} recipes>"
+
+    def __len__(self):
+        return len(self.names) - self.deleted
+
+    def __contains__(self, name):
+        return self.row(name) is not None
+
+    def __iter__(self):
+        for row in self.rows(): yield self.view(row)
+
+    def rows(self):
+        """ Yields the number of every live row """
+        alive = self.alive
+        for row in range(len(alive)):
+            if alive[row]: yield row
+
+    def code(self, field, value):
+        """ Returns the code of a value of a coded field, adding it to the field's vocabulary if it is new """
+        codes = self._codes[field]
+        if value not in codes:
+            codes[value] = len(self.vocabularies[field])
+            self.vocabularies[field].append(sys.intern(value))
+        return codes[value]
+
+    def _append(self, name, data):
+        """ Appends a recipe as a new row (without updating the cached orderings), returning its row number """
+        row = len(self.names)
+        self.names.append(name)
+        for field in NUMERIC_FIELDS:
+            value = numeric(data.get(field))
+            self.columns[field].append(value if value is not None else float("nan"))
+        for field in CODED_FIELDS:
+            code = self.code(field, data.get(field) or "")
+            self.columns[field].append(code)
+            self.postings[field].setdefault(code, array("I")).append(row)
+        extra = {k:v for (k,v) in data.items() if k not in FIELDS}
+        if extra: self.extra[row] = extra
+        self.alive.append(1)
+        self.changes += 1
+        return row
+
+    def extend(self, pairs):
+        """ Adds many (name, data) pairs at once, then sorts by name once, rather than inserting each in turn. Of names
+            differing only by case (which row and add take to be the same recipe), only the last one added is kept """
+        for (name, data) in pairs: self._append(name, data)
+        self.orderings, self.rangepostings = dict(), dict()
+        names, byname = self.names, self.ordering('abc+')
+        lowered = list(map(str.lower, map(names.__getitem__, byname)))
+        if any(map(eq, lowered, islice(lowered, 1, None))): # The sort is stable, so the later row of each clash is after
+            for row in [byname[i] for i in range(len(byname) - 1) if lowered[i] == lowered[i+1]]: self._kill(row)
+
+    def add(self, name, data):
+        """ Adds a recipe (replacing any recipe with the same name), returning its row number and its position in
+            every cached ordering (by sorting mode) """
+        if (old := self.row(name)) is not None: self._kill(old)
+        row = self._append(name, data)
+        positions = dict()
+        for (sorting_mode, ordering) in self.orderings.items():
+            key = self.rowKey(sorting_mode)
+            positions[sorting_mode] = index = bisectRows(ordering, key(row), key, right=True)
+            ordering.insert(index, row)
+        for ((codedfield, field), rangepostings) in self.rangepostings.items():
+            posting, key = rangepostings.setdefault(self.columns[codedfield][row], array("I")), self.rowKey(RANGE_MODES[field])
+            posting.insert(bisectRows(posting, key(row), key, right=True), row)
+        return row, positions
+
+    def update(self, name, data):
+        """ Updates some fields of a recipe, returning its (new) row number and positions, as add does """
+        record = self.record(self.row(name))[1]
+        record.update(data)
+        return self.add(name, record)
+
+    def remove(self, name):
+        """ Removes the recipe with the given name (ignoring case, as row does), returning its (now dead) row number and
+            the position it had in every cached ordering, or (None, {}) if there is no such recipe """
+        row = self.row(name)
+        if row is None: return None, dict()
+        return row, self._kill(row)
+
+    def _kill(self, row):
+        positions = dict()
+        for (sorting_mode, ordering) in self.orderings.items():
+            key = self.rowKey(sorting_mode)
+            index = bisectRows(ordering, key(row), key)
+            while ordering[index] != row: index += 1 # Step over any rows that sort equally
+            positions[sorting_mode] = index
+            del ordering[index]
+        for ((codedfield, field), rangepostings) in self.rangepostings.items():
+            posting, key = rangepostings[self.columns[codedfield][row]], self.rowKey(RANGE_MODES[field])
+            index = bisectRows(posting, key(row), key)
+            while posting[index] != row: index += 1
+            del posting[index]
+        for field in CODED_FIELDS:
+            posting = self.postings[field][self.columns[field][row]]
+            del posting[bisect_left(posting, row)]
+        self.alive[row] = 0
+        self.removed.append(row)
+        self.deleted += 1
+        self.changes += 1
+        return positions
+
+    def row(self, name):
+        """ Returns the row number of the recipe with the given name (ignoring case), or None. Binary searches the
+            name ordering, so no separate name-to-row dictionary is needed """
+        byname = self.ordering('abc+')
+        lowered = name.lower()
+        index = bisectRows(byname, lowered, self.rowKey('abc+'))
+        if index < len(byname) and self.names[byname[index]].lower() == lowered: return byname[index]
+        return None
+
+    def position(self, row, sorting_mode):
+        """ Returns the position of a live row in the ordering for the given sorting mode """
+        ordering, key = self.ordering(sorting_mode), self.rowKey(sorting_mode)
+        index = bisectRows(ordering, key(row), key)
+        while ordering[index] != row: index += 1 # Step over any rows that sort equally
+        return index
+
+    def findPrefix(self, prefix):
+        """ Returns the row of the first recipe (in name order) whose name starts with prefix, ignoring case, or None """
+        byname, lowered = self.ordering('abc+'), prefix.lower()
+        index = bisectRows(byname, lowered, self.rowKey('abc+'))
+        if index < len(byname) and self.names[byname[index]].lower().startswith(lowered): return byname[index]
+        return None
+
+    def value(self, row, field):
+        """ Returns the value of a field of a row, as it would be stored in a Beer """
+        if field == "name": return self.names[row]
+        elif field in NUMERIC_FIELDS:
+            value = self.columns[field][row]
+            return value if value == value else None # NaN (missing) is the only value not equal to itself
+        elif field in CODED_FIELDS: return self.vocabularies[field][self.columns[field][row]]
+        return self.extra.get(row, dict()).get(field)
+
+    def record(self, row):
+        """ Returns a row as a (name, data) pair, with data in the form saved to the recipes file """
+        data = {field:compactNumber(self.value(row, field)) for field in FIELDS}
+        data.update(self.extra.get(row, dict()))
+        return self.names[row], data
+
+    def items(self):
+        """ Yields every recipe as a (name, data) pair """
+        for row in self.rows(): yield self.record(row)
+
+    def view(self, row):
+        """ Returns a (new) Beer view of a row, made by the catalog's factory """
+        name, data = self.record(row)
+        return self.factory(name, data) if self.factory else (name, data)
+
+    def get(self, name):
+        """ Returns a Beer view of the recipe with the given name, or None """
+        row = self.row(name)
+        return None if row is None else self.view(row)
+
+    def ordering(self, sorting_mode):
+        """ Returns an array of live row numbers sorted by the given sorting mode, sorting only if it isn't cached """
+        if sorting_mode not in self.orderings:
+            if sorting_mode != 'abc+' and 'abc+' in self.orderings: # Already in name order, so skip the tie-break sort
+                self.orderings[sorting_mode] = self.sortRows(self.orderings['abc+'], sorting_mode, byname=True)
+            else: self.orderings[sorting_mode] = self.sortRows(self.rows(), sorting_mode)
+        return self.orderings[sorting_mode]
+
+    def ordered(self, sorting_mode):
+        """ Returns a sequence of Beer views in the given sorting mode, which stays up to date as the catalog changes """
+        return CatalogView(self, sorting_mode)
+
+    def search(self, filters, sorting_mode='abc+'):
+        """ Returns a sequence of Beer views of the recipes matching filters (as match takes them) in the given sorting
+            mode, which stays up to date as the catalog changes """
+        if not filters: return CatalogView(self, sorting_mode)
+        return SearchView(self, sorting_mode, filters)
+
+    def match(self, filters):
+        """ Returns an array of the rows matching every filter, in no particular order. filters is a dictionary of
+            field to either a value to match exactly, or a (low, high) range for numeric fields (either end may be
+            None), with the special 'prefix' key matching the start of the name (ignoring case). Type and SRM may also
+            be given a list of values, matching any of them.
+            Every filter finds the rows it matches from its index without looking at them, as does every pair of a type or
+            SRM filter and a numeric range (from the posting lists sorted by that field), so only the rows of the filter
+            (or pair) matching the fewest are checked against the other filters """
+        if not filters: return array("I", self.ordering('abc+'))
+        candidates = {field:self._candidates(field, value) for (field, value) in filters.items()}
+        best, covered = min(candidates.values(), key=lambda candidate: candidate[0]), ()
+        for (codedfield, field) in product(CODED_FIELDS.keys() & filters.keys(), RANGE_MODES.keys() & filters.keys()):
+            if best[0] <= FEW_CANDIDATES: break
+            pair = self._rangeCandidates(codedfield, filters[codedfield], field, filters[field])
+            if pair[0] < best[0]: best, covered = pair, (codedfield, field)
+        if not covered: covered = (next(field for (field, candidate) in candidates.items() if candidate is best),)
+        rows = best[1]
+        for (count, _rows, narrow) in sorted((candidates[field] for field in candidates if field not in covered),
+            key=lambda candidate: candidate[0]): rows = narrow(rows)
+        return rows[:] if isinstance(rows, array) else array("I", rows) # A copy, never an index itself
+
+    def _candidates(self, field, value):
+        """ Returns the number of rows matching a single filter, the rows themselves (found from its index), and a
+            function narrowing any other list of rows down to those matching it """
+        if field == "prefix":
+            byname, key, prefix = self.ordering('abc+'), self.rowKey('abc+'), value.lower()
+            low, high = bisectRows(byname, prefix, key), bisectRows(byname, prefix + "\U0010ffff", key)
+            names = self.names
+            return high - low, byname[low:high], lambda rows: [row for row in rows if names[row].lower().startswith(prefix)]
+        elif field in NUMERIC_FIELDS:
+            low, high = value if isinstance(value, tuple) else (value, value)
+            low, high = -MISSING if low is None else low, MISSING if high is None else high
+            ordering, key, column = self.ordering(RANGE_MODES[field]), self._keyGetter(field, False), self.columns[field]
+            start = bisectRows(ordering, low, key)
+            end = bisectRows(ordering, high, key, right=True) if high < MISSING else bisectRows(ordering, MISSING, key)
+            return end - start, ordering[start:end], lambda rows: [row for row in rows if low <= column[row] <= high] # NaN fails
+        elif field in CODED_FIELDS:
+            values = [value] if isinstance(value, str) else value
+            codes = {self._codes[field][v] for v in values if v in self._codes[field]}
+            postings = [self.postings[field].get(code, array("I")) for code in codes]
+            rows = postings[0] if len(postings) == 1 else chain.from_iterable(postings)
+            column, count = self.columns[field], sum(map(len, postings))
+            if len(codes) == 1:
+                (code,) = codes
+                return count, rows, lambda rows: [row for row in rows if column[row] == code]
+            return count, rows, lambda rows: [row for row in rows if column[row] in codes]
+        raise KeyError(field)
+
+    def _rangeCandidates(self, codedfield, codedvalue, field, value):
+        """ Returns the number of rows matching both a type or SRM filter and a numeric range, and the rows themselves,
+            as _candidates does. Each code's rows in the range are a single slice of its range-ordered posting list """
+        values = [codedvalue] if isinstance(codedvalue, str) else codedvalue
+        low, high = value if isinstance(value, tuple) else (value, value)
+        low, high = -MISSING if low is None else low, MISSING if high is None else high
+        postings, key, rows = self.rangePostings(codedfield, field), self._keyGetter(field, False), array("I")
+        for code in {self._codes[codedfield][v] for v in values if v in self._codes[codedfield]}:
+            posting = postings.get(code, ())
+            start = bisectRows(posting, low, key)
+            end = bisectRows(posting, high, key, right=True) if high < MISSING else bisectRows(posting, MISSING, key)
+            rows.extend(posting[start:end])
+        return len(rows), rows, None
+
+    def rangePostings(self, codedfield, field):
+        """ Returns, for each code of a coded field, an array of its live rows in the range ordering of a numeric field
+            (ascending, with missing numbers last), built from that ordering the first time it is needed """
+        if (codedfield, field) not in self.rangepostings:
+            codes, rangepostings = self.columns[codedfield], dict()
+            for row in self.ordering(RANGE_MODES[field]):
+                code = codes[row]
+                if code not in rangepostings: rangepostings[code] = array("I")
+                rangepostings[code].append(row)
+            self.rangepostings[(codedfield, field)] = rangepostings
+        return self.rangepostings[(codedfield, field)]
+
+    def _rank(self, field):
+        """ Returns, for each code of a coded field, the position of its value in alphabetical order """
+        vocab = self.vocabularies[field]
+        rank = [0]*len(vocab)
+        for (position, code) in enumerate(sorted(range(len(vocab)), key=lambda c: (vocab[c].lower(), vocab[c]))):
+            rank[code] = position
+        return rank
+
+    def sortRows(self, rows, sorting_mode, byname=False):
+        """ Returns an array of the given rows sorted by the given sorting mode. Sorts once per key, from the last key
+            to the first, relying on sorts being stable, so that each sort compares plain values rather than tuples.
+            If the rows are already in name order, byname=True skips the final (tie-breaking) sort by name """
+        keys = parseSortingMode(sorting_mode)
+        if byname and keys[-1] == ("name", False): keys = keys[:-1]
+        ordering = list(rows)
+        for (field, descending) in reversed(keys):
+            if field in NUMERIC_FIELDS: # Missing numbers are set aside, and always sort last
+                column = self.columns[field]
+                missing = [row for row in ordering if column[row] != column[row]]
+                if missing: ordering = [row for row in ordering if column[row] == column[row]]
+                ordering.sort(key=column.__getitem__, reverse=descending)
+                ordering += missing
+            elif field in CODED_FIELDS:
+                rank, codes = self._rank(field), self.columns[field]
+                ordering.sort(key=lambda row: rank[codes[row]], reverse=descending)
+            else:
+                names = self.names
+                ordering.sort(key=lambda row: names[row].lower(), reverse=descending)
+        return array("I", ordering)
+
+    def rowKey(self, sorting_mode):
+        """ Returns a key function ordering rows the same way as sortRows does for the given sorting mode.
+            Building a key for every row is slower than sortRows, so it is only used to compare a few rows at a time """
+        getters = [self._keyGetter(field, descending) for (field, descending) in parseSortingMode(sorting_mode)]
+        if len(getters) == 1: return getters[0]
+        return lambda row: tuple([getter(row) for getter in getters])
+
+    def _keyGetter(self, field, descending):
+        """ Returns a function getting the (ascending) sort key of a single field from a row """
+        if field in NUMERIC_FIELDS:
+            column, sign = self.columns[field], -1 if descending else 1
+            return lambda row: sign*v if (v := column[row]) == v else MISSING
+        elif field in CODED_FIELDS:
+            rank, codes, sign = self._rank(field), self.columns[field], -1 if descending else 1
+            return lambda row: sign*rank[codes[row]]
+        names = self.names
+        if descending: # Text can't be negated, so compare the negated code points instead
+            return lambda row: tuple([-ord(c) for c in names[row].lower()]) + (1,)
+        return lambda row: names[row].lower()
+
+    def compact(self):
+        """ Reclaims dead rows, renumbering the live ones (and the cached orderings) """
+        if not self.deleted: return
+        renumber, live = array("I", bytes(4*len(self.names))), list(self.rows())
+        for (new, old) in enumerate(live): renumber[old] = new
+        self.names = [self.names[row] for row in live]
+        for field in self.columns:
+            column = self.columns[field]
+            self.columns[field] = array(column.typecode, (column[row] for row in live))
+        self.extra = {renumber[row]:extra for (row, extra) in self.extra.items() if self.alive[row]}
+        self.orderings = {mode:array("I", (renumber[row] for row in ordering)) for (mode, ordering) in self.orderings.items()}
+        self.postings = {field:{code:array("I", (renumber[row] for row in posting)) for (code, posting) in postings.items()}
+            for (field, postings) in self.postings.items()}
+        self.rangepostings = {fields:{code:array("I", (renumber[row] for row in posting)) for (code, posting) in postings.items()}
+            for (fields, postings) in self.rangepostings.items()}
+        self.alive, self.deleted, self.removed = bytearray(b"\x01")*len(live), 0, array("I")
+        self.changes += 1
+
+class CatalogView:
+    """ CatalogView object. A read-only sequence of Beer views of a catalog, in a given sorting mode """
+    def __init__(self, catalog, sorting_mode):
+        self.catalog, self.sorting_mode = catalog, sorting_mode
+
+    def __repr__(self):
+        return f"<CatalogView: {len(self)} recipes by {self.sorting_mode}>"
+
+    def __len__(self):
+        return len(self.catalog)
+
+    def __getitem__(self, index):
+        ordering = self.rows()
+        if isinstance(index, slice): return [self.catalog.view(row) for row in ordering[index]]
+        return self.catalog.view(ordering[index])
+
+    def __iter__(self):
+        for row in self.rows(): yield self.catalog.view(row)
+
+    def rows(self):
+        """ Returns the array of rows shown, in order """
+        return self.catalog.ordering(self.sorting_mode)
+
+    def position(self, row):
+        """ Returns the position of a row in the view, or None if it isn't shown """
+        return self.catalog.position(row, self.sorting_mode) if self.catalog.alive[row] else None
+
+class SearchView(CatalogView):
+    """ SearchView object. A read-only sequence of Beer views of the recipes of a catalog matching some filters, in a
+        given sorting mode. The search is only run again once the catalog has changed """
+    def __init__(self, catalog, sorting_mode, filters):
+        super().__init__(catalog, sorting_mode)
+        self.filters = filters
+        self.results, self.changes = None, None
+
+    def __repr__(self):
+        return f"<SearchView: {len(self)} recipes matching {self.filters} by {self.sorting_mode}>"
+
+    def __len__(self):
+        return len(self.rows())
+
+    def rows(self):
+        catalog = self.catalog
+        if self.changes != catalog.changes:
+            matched = catalog.match(self.filters)
+            if len(matched) > len(catalog) // 16: # Cheaper to pick them out of the (cached) ordering than to sort them
+                marked = bytearray(len(catalog.names))
+                for row in matched: marked[row] = 1
+                self.results = array("I", [row for row in catalog.ordering(self.sorting_mode) if marked[row]])
+            else: self.results = catalog.sortRows(matched, self.sorting_mode)
+            self.changes = catalog.changes
+        return self.results
+
+    def position(self, row):
+        results, key = self.rows(), self.catalog.rowKey(self.sorting_mode)
+        index = bisectRows(results, key(row), key)
+        while index < len(results) and results[index] != row and key(results[index]) == key(row): index += 1
+        return index if index < len(results) and results[index] == row else None
+
+def bisectRows(ordering, keyvalue, key, right=False):
+    """ Binary searches an ordering of rows (sorted by key) for where keyvalue belongs """
+    lo, hi = 0, len(ordering)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        midvalue = key(ordering[mid])
+        if midvalue < keyvalue or (right and midvalue == keyvalue): lo = mid + 1
+        else: hi = mid
+    return lo
@@ -0,0 +1,183 @@
+""" Command line interface to the recipe manager, for scripting batch jobs and for servers without a display.
+    Doesn't import tkinter, so it starts quickly. Run 'python cli.py --help' for the commands """
+import argparse, json, sys
+from datetime import datetime
+from core import Beer, RecipeError, RecipeManager, formatNumber, parseQuery
+from importer import importFile, writeReport
+from storage import FIELDS, NUMERIC_FIELDS
+
+# The columns shown by 'list' (field, heading, width)
+LIST_COLUMNS = [
+    ("name", "Name", 16),
+    ("type", "Type", 28),
+    ("abv", "ABV", 5),
+    ("ibu", "IBU", 5),
+    ("gravity", "Gravity", 7),
+    ("srm", "SRM", 14),
+    ("servingtemp", "Temp", 5)
+]
+
+def numericFilter(value):
+    """ Parses a numeric filter given on the command line: either a value, or a 'LOW:HIGH' range (either end may be
+        left out, eg. '5:' for 5 and above) """
+    if ":" not in value: return float(value)
+    low, high = value.split(":", 1)
+    return (float(low) if low else None, float(high) if high else None)
+
+def fieldDefault(value):
+    """ Parses a default value given on the command line as 'FIELD=VALUE' """
+    field, _, value = value.partition("=")
+    if field not in FIELDS: raise argparse.ArgumentTypeError(f"unknown field {field!r}")
+    return field, value
+
+def timestamp(value):
+    """ Parses a time given on the command line, either as a date and time (eg. '2024-05-01 18:30') or as seconds since
+        the epoch, into seconds since the epoch """
+    try: return float(value)
+    except ValueError: pass
+    try: return datetime.fromisoformat(value).timestamp()
+    except ValueError: raise argparse.ArgumentTypeError(f"invalid time {value!r}") from None
+
+def getFilters(manager, args):
+    """ Returns the search filters given on the command line (by --query and the options for each field), as
+        RecipeManager.search takes them """
+    filters = parseQuery(args.query, manager.catalog.vocabularies) if args.query else dict()
+    filters.update({field:getattr(args, field) for field in ["prefix", *FIELDS] if getattr(args, field) is not None})
+    return filters
+
+def listRecipes(manager, args):
+    pairs = manager.page(args.sort, getFilters(manager, args), args.offset, args.limit)
+    if args.json:
+        json.dump(dict(pairs), sys.stdout, indent=2)
+        print()
+        return
+    print(" ".join(f"{heading:<{width}}" for (field, heading, width) in LIST_COLUMNS))
+    for (name, data) in pairs:
+        beer = Beer(name, data)
+        values = [formatNumber(getattr(beer, field)) if field in NUMERIC_FIELDS else getattr(beer, field)
+            for (field, heading, width) in LIST_COLUMNS]
+        print(" ".join(f"{value:<{width}}" for (value, (field, heading, width)) in zip(values, LIST_COLUMNS)))
+
+def addRecipe(manager, args):
+    manager.create(args.name, {field:getattr(args, field) for field in FIELDS})
+    print(f"Added {args.name}")
+
+def deleteRecipe(manager, args):
+    row, positions = manager.delete(args.name)
+    if row is None: raise RecipeError(f"No recipe named {args.name!r}")
+    print(f"Deleted {args.name}")
+
+def importRecipes(manager, args):
+    created, problems = importFile(manager, args.file, dict(args.default), args.workers)
+    if args.report: writeReport(problems, args.report)
+    else:
+        for problem in problems: print(f"Skipped record {problem.record} ({problem.name}): {problem.error}", file=sys.stderr)
+    print(f"Imported {len(created)} recipes ({len(problems)} skipped)")
+
+def exportRecipes(manager, args):
+    print(f"Exported {manager.exportFile(args.file, args.sort, getFilters(manager, args))} recipes to {args.file}")
+
+def showStats(manager, args):
+    json.dump(manager.stats(), sys.stdout, indent=2)
+    print()
+
+def checkRecipes(manager, args):
+    problems = manager.check()
+    if args.json:
+        checked = dict()
+        for (name, field, stated, calculated) in problems:
+            checked.setdefault(name, dict())[field] = {"stated": stated, "calculated": calculated}
+        json.dump(checked, sys.stdout, indent=2)
+        print()
+        return
+    for (name, field, stated, calculated) in problems:
+        print(f"{name:<16} {field:<5} {formatNumber(stated) if field in NUMERIC_FIELDS else stated:<14} calculated {calculated}")
+    print(f"{len({problem[0] for problem in problems})} recipes don't match their ingredients")
+
+def showHistory(manager, args):
+    try: base, versions = manager.history.every(args.name)
+    except KeyError: raise RecipeError(f"No history of a recipe named {args.name!r}") from None
+    if base is not None: print(f"{'(before)':<19}  {json.dumps(base)}")
+    for (version, data) in versions:
+        print(f"{datetime.fromtimestamp(version).isoformat(' ', 'seconds')}  {json.dumps(data) if data is not None else '(deleted)'}")
+
+def restoreRecipes(manager, args):
+    restored = manager.restore(args.time, args.name)
+    for name in restored: print(f"Restored {name}")
+    print(f"Restored {len(restored)} recipes to {datetime.fromtimestamp(args.time).isoformat(' ', 'seconds')}")
+
+def addFilterArguments(parser):
+    parser.add_argument("--sort", default="abc+", choices=Beer.sorting_modes, help="sorting mode (default: abc+)")
+    parser.add_argument("--query", help="only recipes matching a search, eg. 'type:IPA abv:5-7 ibu>50'")
+    parser.add_argument("--prefix", help="only recipes whose name starts with PREFIX")
+    for field in FIELDS:
+        if field in NUMERIC_FIELDS:
+            parser.add_argument(f"--{field}", type=numericFilter, metavar="VALUE|LOW:HIGH", help=f"only recipes with this {field}")
+        else: parser.add_argument(f"--{field}", help=f"only recipes of this {field}")
+
+def makeParser():
+    parser = argparse.ArgumentParser(prog="cli.py", description="Crown Brewery Recipe Manager")
+    parser.add_argument("--data", default="data/beers.json", help="recipes file (JSON, or an SQLite database)")
+    parser.add_argument("--diagnostics", action="store_true", help="save the time taken by each stage to diagnostics.json")
+    parser.add_argument("--profile", action="store_true", help="as --diagnostics, also saving a cProfile profile")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    listparser = commands.add_parser("list", help="list recipes")
+    addFilterArguments(listparser)
+    listparser.add_argument("--offset", type=int, default=0, help="skip the first OFFSET recipes")
+    listparser.add_argument("--limit", type=int, help="show at most LIMIT recipes")
+    listparser.add_argument("--json", action="store_true", help="print the recipes as JSON")
+    listparser.set_defaults(run=listRecipes)
+
+    addparser = commands.add_parser("add", help="add a recipe")
+    addparser.add_argument("name")
+    for field in FIELDS: addparser.add_argument(f"--{field}", default="")
+    addparser.set_defaults(run=addRecipe)
+
+    deleteparser = commands.add_parser("delete", help="delete a recipe")
+    deleteparser.add_argument("name")
+    deleteparser.set_defaults(run=deleteRecipe)
+
+    importparser = commands.add_parser("import", help="add every recipe in a CSV, BeerXML or JSON file")
+    importparser.add_argument("file")
+    importparser.add_argument("--default", type=fieldDefault, action="append", default=[], metavar="FIELD=VALUE",
+        help="value for a field missing from the file (eg. servingtemp=7 for BeerXML)")
+    importparser.add_argument("--workers", type=int, help="number of processes validating records (default: one per CPU)")
+    importparser.add_argument("--report", help="save the records that couldn't be imported to this CSV file")
+    importparser.set_defaults(run=importRecipes)
+
+    exportparser = commands.add_parser("export", help="save recipes to a JSON file (as beers.json is saved)")
+    exportparser.add_argument("file")
+    addFilterArguments(exportparser)
+    exportparser.set_defaults(run=exportRecipes)
+
+    statsparser = commands.add_parser("stats", help="print a summary of the recipes (overall and by type and SRM) as JSON")
+    statsparser.set_defaults(run=showStats)
+
+    checkparser = commands.add_parser("check", help="list the ABV, IBU and SRM values that don't match the ingredients")
+    checkparser.add_argument("--json", action="store_true", help="print the mismatches as JSON")
+    checkparser.set_defaults(run=checkRecipes)
+
+    historyparser = commands.add_parser("history", help="list every saved version of a recipe")
+    historyparser.add_argument("name")
+    historyparser.set_defaults(run=showHistory)
+
+    restoreparser = commands.add_parser("restore", help="restore every recipe (or one) to how it was at a given time")
+    restoreparser.add_argument("time", type=timestamp, help="eg. '2024-05-01 18:30' (or seconds since the epoch)")
+    restoreparser.add_argument("--name", help="only restore the recipe with this name")
+    restoreparser.set_defaults(run=restoreRecipes)
+    return parser
+
+def main(argv=None):
+    args = makeParser().parse_args(argv)
+    # Listing is paged by the backend where it can be, so the recipes are only loaded if needed
+    manager = RecipeManager(args.data, load=args.run is not listRecipes)
+    try: args.run(manager, args)
+    except RecipeError as error:
+        print(f"Error: {error}", file=sys.stderr)
+        return 1
+    finally: manager.close()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,19 +1,216 @@
-import json, sys, pickle
+import gzip, hashlib, json, os, random, re, sys, pickle, threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from html.parser import HTMLParser
+from http.client import HTTPConnection, HTTPException, HTTPSConnection
 from time import sleep
-from bs4 import BeautifulSoup
-from urllib.request import urlopen
+from urllib.parse import urljoin, urlsplit
+from journal import writeAtomic
+from themes import THEME_FEATURES, resolveColour
+
+# The colour of a palette colour div, from its style attribute
+BACKGROUND = re.compile(r"background-color:\s*([^;]+)")
 
 class Palette:
-    def __init__(self, soup):
-        self.title = soup.a['title'].replace('Color palette ', '')
+    def __init__(self, title, colours):
+        self.title = title.replace('Color palette ', '')
         self.title = ' '.join([w.capitalize() for w in self.title.split(' ')])
-        self.colours = list()
-        for colordiv in soup.findAll('div', {'class': 'palettecolordiv'}):
-            self.colours.append(colordiv['style'].replace('background-color:', ''))
+        self.colours = colours
 
     def __repr__(self):
         return f"<Color Palette: {self.title} {self.colours}>"
 
+class PaletteParser(HTMLParser):
+    """ PaletteParser object. Streams palettes out of color-hex.com pages as they are fed in: everything outside the
+        palette containers is skipped, and each Palette is made (and queued in PaletteParser.palettes) as soon as its
+        container closes, so no tree of the page is ever built """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.depth = 0 # How many divs deep inside a palette container the parser is (0 outside of one)
+        self.title, self.colours = None, list()
+        self.palettes = deque()
+
+    def handle_starttag(self, tag, attrs):
+        if tag == "a" and self.depth and self.title is None:
+            self.title = dict(attrs).get("title")
+        elif tag == "div":
+            classes = (dict(attrs).get("class") or "").split()
+            if self.depth:
+                self.depth += 1
+                if "palettecolordiv" in classes and (match := BACKGROUND.search(dict(attrs).get("style") or "")):
+                    self.colours.append(match.group(1).strip())
+            elif "palettecontainerlist" in classes:
+                self.depth, self.title, self.colours = 1, None, list()
+
+    def handle_endtag(self, tag):
+        if tag != "div" or not self.depth: return
+        self.depth -= 1
+        if not self.depth and self.title: self.palettes.append(Palette(self.title, self.colours))
+
+def parsePalettes(page, chunksize=65536):
+    """ Yields the palettes of a page (as bytes) as they are parsed """
+    parser, text = PaletteParser(), page.decode("utf-8", "replace")
+    for start in range(0, len(text), chunksize):
+        parser.feed(text[start:start+chunksize])
+        while parser.palettes: yield parser.palettes.popleft()
+    parser.close()
+    while parser.palettes: yield parser.palettes.popleft()
+
+def colourKey(theme):
+    """ Returns a theme's colours as a tuple (in THEME_FEATURES order, resolved so that eg. '#FFF' and '#ffffff' are
+        the same), or None if it doesn't have every colour """
+    key = tuple(resolveColour(theme.get(feature)) for feature in THEME_FEATURES)
+    return None if None in key else key
+
+def mergeThemes(batches, path="data/themes.json"):
+    """ Adds batches of palettes (eg. those of each page, as pages are scraped) to the themes file, skipping any whose
+        title or colours are already there. The themes added from each batch are saved before the next batch is read,
+        in a single atomic write, so an interrupted scrape keeps every page already merged. Only the titles and colours
+        seen are kept between batches. Returns the number of palettes added, the number skipped as duplicates, and the
+        number skipped for not having 5 valid colours """
+    with open(path, "r") as themefile: themes = json.load(themefile)
+    titles = {title.lower() for title in themes}
+    colourkeys = {key for theme in themes.values() if isinstance(theme, dict) and (key := colourKey(theme))}
+    del themes
+    added, duplicates, invalid = 0, 0, 0
+    for palettes in batches:
+        batch = dict()
+        for palette in palettes:
+            theme = dict(zip(THEME_FEATURES, map(resolveColour, palette.colours)))
+            if len(palette.colours) < len(THEME_FEATURES) or (key := colourKey(theme)) is None:
+                invalid += 1
+            elif palette.title.lower() in titles or key in colourkeys:
+                duplicates += 1
+            else:
+                titles.add(palette.title.lower())
+                colourkeys.add(key)
+                batch[palette.title] = theme
+        if batch:
+            with open(path, "r") as themefile: themes = json.load(themefile)
+            writeAtomic(path, {**themes, **batch}) # Written to a temporary file, then renamed over the themes file
+            added += len(batch)
+            del themes
+    return added, duplicates, invalid
+
+class PageFetcher:
+    """ PageFetcher object. Fetches pages concurrently (up to 'concurrency' at a time), each thread reusing a keep-alive
+        connection per host, retrying failed requests with exponential backoff (or after the server's Retry-After, unless
+        it asks for longer than maxwait seconds, when the request is given up on), and keeping every page in an on-disk
+        cache (keyed by URL) that is revalidated with ETag/Last-Modified, so unchanged pages aren't downloaded again """
+
+    RETRY_STATUSES = (429, 500, 502, 503, 504)
+    REDIRECT_STATUSES = (301, 302, 303, 307, 308)
+
+    def __init__(self, concurrency=8, cachedir=".scrapecache", retries=4, backoff=0.5, timeout=15, maxwait=None):
+        self.concurrency, self.cachedir = concurrency, cachedir
+        self.retries, self.backoff, self.timeout = retries, backoff, timeout
+        self.maxwait = backoff * 2**retries if maxwait is None else maxwait # By default, the longest backoff
+        self.local = threading.local() # Each thread's open connections, by (scheme, host)
+        self.stats, self.statslock = dict(fetched=0, cached=0, revalidated=0, retried=0), threading.Lock()
+        if cachedir: os.makedirs(cachedir, exist_ok=True)
+
+    def __repr__(self):
+        return f"<PageFetcher: {self.concurrency} at a time, cache {self.cachedir}>"
+
+    def fetchAll(self, urls):
+        """ Yields (url, page) for every URL, in order, fetching them concurrently. Only a few pages are fetched ahead
+            of the one being used, so that pages aren't all held in memory when they are used slower than fetched """
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            pending = deque()
+            for url in urls:
+                pending.append((url, pool.submit(self.fetch, url)))
+                if len(pending) >= 2*self.concurrency:
+                    url, future = pending.popleft()
+                    yield url, future.result()
+            while pending:
+                url, future = pending.popleft()
+                yield url, future.result()
+
+    def fetch(self, url):
+        """ Returns the body of the page at url, from the cache if the server says it hasn't changed """
+        cached = self._cached(url)
+        headers = {"Accept-Encoding": "gzip", "User-Agent": "CrownBreweryRecipeManager colourschemescraper"}
+        if cached and cached["etag"]: headers["If-None-Match"] = cached["etag"]
+        if cached and cached["last_modified"]: headers["If-Modified-Since"] = cached["last_modified"]
+        status, responseheaders, body = self._request(url, headers)
+        if status == 304 and cached:
+            self._count("revalidated")
+            return cached["body"]
+        if status != 200: raise HTTPException(f"{url}: HTTP {status}")
+        self._count("fetched")
+        self._store(url, responseheaders, body)
+        return body
+
+    def _request(self, url, headers, redirects=5):
+        """ Makes a GET request, following redirects and retrying connection errors and temporary failures """
+        for attempt in range(self.retries + 1):
+            try:
+                connection = self._connection(url)
+                connection.request("GET", self._target(url), headers=headers)
+                response = connection.getresponse()
+                body = response.read() # Always read the whole body, so the connection can be reused
+                if response.getheader("Content-Encoding") == "gzip": body = gzip.decompress(body)
+                if response.will_close: self._close(url)
+            except (OSError, HTTPException):
+                self._close(url)
+                if attempt == self.retries: raise
+            else:
+                if response.status in self.REDIRECT_STATUSES and redirects:
+                    return self._request(urljoin(url, response.getheader("Location")), headers, redirects - 1)
+                if response.status not in self.RETRY_STATUSES or attempt == self.retries:
+                    return response.status, response, body
+                retryafter = response.getheader("Retry-After")
+                if retryafter and retryafter.isdigit():
+                    if int(retryafter) > self.maxwait: return response.status, response, body # Not worth waiting for
+                    self._count("retried")
+                    sleep(int(retryafter))
+                    continue
+            self._count("retried")
+            sleep(self.backoff * 2**attempt * random.uniform(0.5, 1.5))
+
+    def _count(self, stat):
+        with self.statslock: self.stats[stat] += 1
+
+    def _connection(self, url):
+        """ Returns this thread's (keep-alive) connection to the URL's host, opening it if needed """
+        parts = urlsplit(url)
+        connections = self.local.__dict__.setdefault("connections", dict())
+        if (parts.scheme, parts.netloc) not in connections:
+            connectionclass = HTTPSConnection if parts.scheme == "https" else HTTPConnection
+            connections[(parts.scheme, parts.netloc)] = connectionclass(parts.netloc, timeout=self.timeout)
+        return connections[(parts.scheme, parts.netloc)]
+
+    def _close(self, url):
+        parts = urlsplit(url)
+        connection = self.local.__dict__.get("connections", dict()).pop((parts.scheme, parts.netloc), None)
+        if connection: connection.close()
+
+    def _target(self, url):
+        parts = urlsplit(url)
+        return (parts.path or "/") + (f"?{parts.query}" if parts.query else "")
+
+    def _cachepath(self, url):
+        return os.path.join(self.cachedir, hashlib.sha256(url.encode()).hexdigest())
+
+    def _cached(self, url):
+        """ Returns the cached page (with its ETag and Last-Modified) for url, or None """
+        if not self.cachedir: return None
+        try:
+            with open(self._cachepath(url) + ".json", "r") as metafile: cached = json.load(metafile)
+            with open(self._cachepath(url) + ".html", "rb") as bodyfile: cached["body"] = bodyfile.read()
+        except (OSError, ValueError): return None
+        self._count("cached")
+        return cached
+
+    def _store(self, url, response, body):
+        """ Saves a page to the cache, if the server gave a way to revalidate it """
+        etag, lastmodified = response.getheader("ETag"), response.getheader("Last-Modified")
+        if not self.cachedir or not (etag or lastmodified): return
+        path, meta = self._cachepath(url), json.dumps(dict(url=url, etag=etag, last_modified=lastmodified)).encode()
+        for (extension, data) in ((".html", body), (".json", meta)): # Body first, so metadata never points to a partial page
+            with open(path + extension + ".tmp", "wb") as cachefile: cachefile.write(data)
+            os.replace(path + extension + ".tmp", path + extension)
 
 def saveJSON(palettes, pckl, path="schemes"):
     JSONdata = dict()
@@ -47,6 +244,24 @@ if __name__ == '__main__':
             log("Could not get valid '-n' argument. Defaulting to 1 page (40 items)", 'warn')
     elif len(sys.argv) > 1 and '-n' not in sys.argv:
         log("Could not get '-n' argument. Defaulting to 1 page (40 items)", 'warn')
+    CONCURRENCY = 8
+    if len(sys.argv) > 1 and '-c' in sys.argv:
+        try:
+            CONCURRENCY = max(1, int(sys.argv[sys.argv.index('-c')+1]))
+        except:
+            log("Could not get valid '-c' argument. Defaulting to 8 pages at a time", 'warn')
+    URL = "http://www.color-hex.com/color-palettes/?page={pagenum}"
+    if len(sys.argv) > 1 and '-u' in sys.argv: # eg. a local server serving saved pages, for testing
+        try:
+            URL = sys.argv[sys.argv.index('-u')+1]
+        except:
+            log("Could not get '-u' argument. Defaulting to color-hex.com", 'warn')
+    OUTPUT = "data/themes.json"
+    if len(sys.argv) > 1 and '-o' in sys.argv:
+        try:
+            OUTPUT = sys.argv[sys.argv.index('-o')+1]
+        except:
+            log("Could not get '-o' argument. Defaulting to data/themes.json", 'warn')
     if len(sys.argv) > 1 and '-p' in sys.argv:
         try:
             if (pk:=sys.argv[sys.argv.index('-p')+1]) in ('True', 'False'):
@@ -56,22 +271,17 @@ if __name__ == '__main__':
         except:
             log("Could not get '-p' argument. Defaulting to False", 'warn')
 
-    URL = "http://www.color-hex.com/color-palettes/?page={pagenum}"
-    PALETTES = list()
-
     log(f"Scraping {PAGES} page{'s' if PAGES > 1 else ''}...", 'ok')
 
-    for pagenum in range(1, PAGES+1):
-        client = urlopen(URL.format(pagenum=pagenum))
-        html_data = client.read()
-        client.close()
-        soup_data = BeautifulSoup(html_data, "html.parser")
-        palettes = soup_data.findAll("div", {"class": "palettecontainerlist"})
-        palettes = map(Palette, palettes)
-        PALETTES += palettes
-
-    log(f"Scraped {len(PALETTES)} palettes", 'ok')
-    sleep(1)
-    log(f"Saving to schemes.{'pk' if PICKLE else 'json'}...", 'ok')
-    saveJSON(PALETTES, PICKLE)
+    fetcher = PageFetcher(concurrency=CONCURRENCY)
+    pages = fetcher.fetchAll([URL.format(pagenum=pagenum) for pagenum in range(1, PAGES+1)])
+    if PICKLE:
+        log("Saving to schemes.pk...", 'ok')
+        saveJSON([palette for (url, page) in pages for palette in parsePalettes(page)], PICKLE)
+    else:
+        log(f"Merging into {OUTPUT}...", 'ok')
+        added, duplicates, invalid = mergeThemes((parsePalettes(page) for (url, page) in pages), OUTPUT)
+        log(f"Added {added} themes ({duplicates} already there, {invalid} without 5 valid colours)", 'ok')
+    log(f"{fetcher.stats['fetched']} pages downloaded, {fetcher.stats['revalidated']} unchanged since cached, "
+        f"{fetcher.stats['retried']} retries", 'status')
     log("Scrape complete. Palettes saved", 'ok')
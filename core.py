@@ -0,0 +1,484 @@
+import json, re, shlex, threading, time
+from collections import deque
+from functools import lru_cache
+from math import inf, nextafter
+from analytics import CatalogStatistics
+from catalog import CODED_FIELDS, MISSING, RecipeCatalog, loadVocabulary
+from diagnostics import instrumented
+from history import openHistory
+from journal import writeAtomic
+from snapshot import loadSnapshot, saveSnapshot
+from storage import FIELDS, NUMERIC_FIELDS, compactNumber, numeric, openBackend, parseSortingMode
+
+# The number of changes that can be undone (older ones are still kept in the history, see history.py)
+MAX_UNDO = 100
+
+# The longest name a recipe can have (so that it fits on the buttons of the "View Recipes" frame)
+MAX_NAME_LENGTH = 16
+
+# A dictionary to translate fields to how they are named in error messages
+FIELD_NAMES = {
+    "servingtemp": "serving temp",
+    "fg": "final gravity",
+    "batchsize": "batch size"
+}
+
+# The range of values each numeric field may take (gravity allows both specific gravity and degrees Plato)
+NUMERIC_RANGES = {
+    "abv": (0, 70),
+    "gravity": (0, 60),
+    "ibu": (0, 250),
+    "servingtemp": (-5, 30)
+}
+
+# Optional fields holding the ingredients a recipe's ABV, IBU and SRM can be calculated from (see brewing.py), and the
+# range of each number in them: the final gravity, the batch size (in litres), and lists of hop additions (grams, alpha
+# acid % and boil time in minutes) and grains (kilograms, and colour in degrees Lovibond)
+INGREDIENT_FIELDS = {
+    "fg": (0, 60),
+    "batchsize": (0.1, 100000),
+    "hops": {"amount": (0, 100000), "alpha": (0, 100), "time": (0, 300)},
+    "grains": {"amount": (0, 100000), "colour": (0, 1000)}
+}
+
+# The SRM colour each value of srm.csv stands for, from lightest to darkest
+SRM_SCALE = [
+    ("Pale Straw", 2), ("Straw", 3), ("Pale Gold", 4), ("Deep Gold", 6), ("Pale Amber", 9), ("Medium Amber", 12),
+    ("Deep Amber", 15), ("Amber-Brown", 18), ("Brown", 20), ("Ruby Brown", 24), ("Deep Brown", 30)
+]
+
+# A dictionary to translate the fields named in search queries to the filters they give
+QUERY_FIELDS = {
+    "name": "prefix",
+    "type": "type", "style": "type",
+    "srm": "srm", "colour": "srm", "color": "srm",
+    "abv": "abv",
+    "ibu": "ibu",
+    "gravity": "gravity", "og": "gravity",
+    "temp": "servingtemp", "servingtemp": "servingtemp"
+}
+
+# A single term of a search query (eg. 'abv:5-7' or 'ibu>50'), and a range of numbers (eg. '5-7' or '5..7')
+QUERY_TERM = re.compile(r"([A-Za-z]+)(:|>=|<=|=|>|<)(.+)")
+NUMBER_RANGE = re.compile(r"([\d.]+)\s*(?:-|–|\.\.)\s*([\d.]+)")
+
+class RecipeError(ValueError):
+    """ Raised when a recipe can't be created or changed. The message is meant to be shown to the user """
+
+class Beer:
+    """ Beer object. Stores all data about custom beers, including name, recipe, ABV, gravity, etc... """
+
+    __slots__ = ("name", *FIELDS, "__dict__") # Any other (optional) fields are kept in __dict__
+    sorting_mode = 'abc+'
+    sorting_modes = ['abc+', 'abc-', 'abv+', 'abv-', 'ibu+', 'ibu-', 'gravity+', 'gravity-', 'temp+', 'temp-',
+        'type+', 'type+abv-']
+
+    def __init__(self, name, jsondata=None):
+        """ Initialise the Beer object, loading its data from JSON string if passed (numeric fields are parsed here,
+            once, so that sorting compares numbers rather than strings) """
+        self.name = name
+        if jsondata:
+            self.type = jsondata["type"]
+            self.abv, self.gravity = numeric(jsondata["abv"]), numeric(jsondata["gravity"])
+            self.ibu, self.srm = numeric(jsondata["ibu"]), jsondata["srm"]
+            self.servingtemp = numeric(jsondata["servingtemp"])
+            for (k,v) in jsondata.items():
+                if k not in FIELDS: setattr(self, k, v)
+            # self.recipe = jsondata["recipe"]
+            # self.image = None
+
+    def __repr__(self):
+        return f"<Beer ({self.type}): {self.name}>"
+
+    def __str__(self):
+        return repr(self)
+
+    def __lt__(self, other):
+        key = sortingKey(self.sorting_mode)
+        return key(self) < key(other)
+
+    def _getjsondata(self):
+        """ Returns the beer's data as saved to the JSON file (ie. everything except its name, which is the key) """
+        jsondata = {field:compactNumber(getattr(self, field)) for field in FIELDS}
+        jsondata.update(self.__dict__)
+        return jsondata
+
+@lru_cache(maxsize=None)
+def sortingKey(sorting_mode):
+    """ Returns a key function that orders beers the same way as the catalog's orderings for the given sorting mode
+        (text is compared ignoring case, and missing numbers always sort last) """
+    getters = [keyGetter(field, descending) for (field, descending) in parseSortingMode(sorting_mode)]
+    if len(getters) == 1: return getters[0]
+    return lambda beer: tuple([getter(beer) for getter in getters])
+
+def keyGetter(field, descending):
+    """ Returns a function getting the (ascending) sort key of a single field from a beer """
+    if field in NUMERIC_FIELDS and descending:
+        return lambda beer: -v if (v := getattr(beer, field)) is not None else MISSING
+    elif field in NUMERIC_FIELDS:
+        return lambda beer: v if (v := getattr(beer, field)) is not None else MISSING
+    elif descending: # Text can't be negated, so compare the negated code points instead
+        return lambda beer: tuple([-ord(c) for c in getattr(beer, field).lower()]) + (1,)
+    return lambda beer: getattr(beer, field).lower()
+
+def formatNumber(value):
+    """ Returns a parsed number formatted for display (ie. 5.0 as '5'), or an empty string if it is missing """
+    if value is None: return ""
+    return str(compactNumber(value))
+
+def validateName(name, catalog=None):
+    """ Raises a RecipeError if name can't be given to a new recipe (ie. it is empty, too long, or already taken) """
+    if catalog is not None and name in catalog: raise RecipeError("Name already taken")
+    elif name == "": raise RecipeError("Enter valid name")
+    elif len(name) > MAX_NAME_LENGTH: raise RecipeError(f"Name must not be more than {MAX_NAME_LENGTH} characters long")
+
+def validateRecipe(data, vocabularies=None, saved=None):
+    """ Returns a recipe's data as it should be saved (with numbers parsed), or raises a RecipeError naming the first
+        field that is missing or invalid. Fields are checked in the order they are given, then any missing ones.
+        If vocabularies (as loadVocabularies returns) are given, the type and SRM value must be in them.
+        If the recipe's saved data is given, fields left as they were saved are kept without being checked again (so a
+        recipe saved with a type since dropped from beertypes.csv can still have its other fields changed) """
+    recipe = dict()
+    for field in [*data, *(field for field in FIELDS if field not in data)]:
+        value, keyword = data.get(field), FIELD_NAMES.get(field, field)
+        if saved is not None and field in saved and saved[field] == value:
+            recipe[field] = value
+            continue
+        if field in NUMERIC_FIELDS: value = compactNumber(numeric(value))
+        elif field in FIELDS and isinstance(value, str): value = value.strip()
+        if field in FIELDS and value in (None, ""): raise RecipeError(f"Enter valid {keyword}.")
+        if field in INGREDIENT_FIELDS:
+            if value in (None, "", []): continue
+            value = validateIngredient(field, value)
+        if field in NUMERIC_RANGES and not NUMERIC_RANGES[field][0] <= value <= NUMERIC_RANGES[field][1]:
+            raise RecipeError(f"Enter valid {keyword} (between {NUMERIC_RANGES[field][0]} and {NUMERIC_RANGES[field][1]}).")
+        if vocabularies and field in vocabularies:
+            if not isinstance(value, str) or value.lower() not in vocabularies[field]:
+                raise RecipeError(f"Unknown {keyword}: {value!r}")
+            value = vocabularies[field][value.lower()]
+        recipe[field] = value
+    return recipe
+
+def validateIngredient(field, value):
+    """ Returns an optional ingredient field as it should be saved (with numbers parsed), or raises a RecipeError """
+    keyword, ranges = FIELD_NAMES.get(field, field), INGREDIENT_FIELDS[field]
+    if isinstance(ranges, tuple):
+        number = compactNumber(numeric(value))
+        if number is None or not ranges[0] <= number <= ranges[1]:
+            raise RecipeError(f"Enter valid {keyword} (between {ranges[0]} and {ranges[1]}).")
+        return number
+    if not isinstance(value, list) or not all(isinstance(item, dict) for item in value):
+        raise RecipeError(f"Enter valid {keyword}.")
+    items = list()
+    for item in value:
+        parsed = {part:compactNumber(numeric(item.get(part))) for part in ranges}
+        for (part, (low, high)) in ranges.items():
+            if parsed[part] is None or not low <= parsed[part] <= high:
+                raise RecipeError(f"Enter valid {keyword} ({part} between {low} and {high}).")
+        items.append({**item, **parsed})
+    return items
+
+def loadVocabularies():
+    """ Returns, for each coded field, a dictionary of its values (from beertypes.csv and srm.csv) by their lower case
+        form, so that values can be checked and spelt consistently ignoring case """
+    return {field:{value.lower():value for value in loadVocabulary(path)} for (field, path) in CODED_FIELDS.items()}
+
+def srmName(srm):
+    """ Returns the name (from srm.csv) of the colour with the given SRM number """
+    for (name, value) in SRM_SCALE:
+        if srm <= value: return name
+    return SRM_SCALE[-1][0]
+
+def parseQuery(query, vocabularies):
+    """ Reads a search query into filters (as RecipeCatalog.match takes them). A query is made of terms like 'abv:5-7',
+        'ibu>50', 'temp<=8', 'type:IPA' or 'srm:"pale straw"' (with spaces around the operator allowed), and any other
+        words, which are matched against the start of the name. Type and SRM match every value of the vocabulary
+        (ie. of catalog.vocabularies) containing the given text, ignoring case, unless one matches it exactly """
+    query = re.sub(r"\s*(:|>=|<=|=|>|<)\s*", r"\1", query.strip())
+    try: terms = shlex.split(query)
+    except ValueError as error: raise RecipeError(f"Invalid search: {error}")
+    filters, words = dict(), list()
+    for term in terms:
+        match = QUERY_TERM.fullmatch(term)
+        if not match or match.group(1).lower() not in QUERY_FIELDS:
+            words.append(term)
+            continue
+        field, operator, value = QUERY_FIELDS[match.group(1).lower()], match.group(2), match.group(3)
+        if field in CODED_FIELDS:
+            values = [v for v in vocabularies[field] if value.lower() in v.lower()]
+            exact = [v for v in values if v.lower() == value.lower()]
+            filters[field] = exact or values
+        elif field == "prefix": words.append(value)
+        else: filters[field] = numericRange(field, operator, value)
+    if words: filters["prefix"] = " ".join(words)
+    return filters
+
+def numericRange(field, operator, value):
+    """ Returns the (low, high) range of a numeric term of a search query (eg. 'abv:5-7' or 'ibu>50') """
+    if operator in (":", "=") and (match := re.fullmatch(r"(>=|<=|>|<)(.+)", value)): operator, value = match.groups()
+    if operator in (":", "=") and (match := NUMBER_RANGE.fullmatch(value)): numbers = list(map(numeric, match.groups()))
+    else: numbers = [numeric(value)]
+    if None in numbers: raise RecipeError(f"Invalid search: {FIELD_NAMES.get(field, field)} must be a number")
+    if len(numbers) == 2: return tuple(numbers)
+    number = numbers[0]
+    return {">": (nextafter(number, inf), None), ">=": (number, None), "<": (None, nextafter(number, -inf)),
+        "<=": (None, number)}.get(operator, (number, number))
+
+@instrumented("loadBeers")
+def loadBeers(path="data/beers.json", factory=Beer):
+    """ Loads beer data from the recipes file passed as arg (JSON, replaying its journal, or an SQLite database) """
+    try:
+        beerdata = openBackend(path).load()
+        return [factory(k, v) for (k,v) in beerdata.items()]
+    except json.JSONDecodeError:
+        return list()
+
+@instrumented("loadCatalog")
+def loadCatalog(path="data/beers.json", factory=Beer):
+    """ Loads beer data from the recipes file passed as arg into a RecipeCatalog, which creates Beer objects on demand.
+        Starts from the file's snapshot (see snapshot.py) if it is up to date, or saves a new one if it isn't """
+    backend = openBackend(path)
+    catalog = loadSnapshot(backend, factory)
+    if catalog is not None: return catalog
+    catalog = RecipeCatalog(factory=factory)
+    try: catalog.extend(backend.load().items())
+    except json.JSONDecodeError: catalog.extend(())
+    else: saveSnapshot(backend, catalog)
+    return catalog
+
+@instrumented("saveBeers")
+def saveBeers(beers, path="data/beers.json"):
+    """ Saves beer data to the recipes file passed as arg, replacing everything stored in it """
+    saveJSON = {beer.name:beer._getjsondata() for beer in beers if beer.name != ''}
+    openBackend(path).saveAll(saveJSON)
+
+class RecipeManager:
+    """ RecipeManager object. Everything the recipe manager does to recipes, without any GUI: validates, creates,
+        updates and deletes recipes (keeping the catalog and the recipes file in step), and sorts, searches, imports,
+        exports and summarises them. Used by both the GUI (main.py) and the command line (cli.py) """
+
+    def __init__(self, path="data/beers.json", factory=Beer, worker=None, load=True):
+        """ Loads the recipes file. If an IOWorker (see worker.py) is given, changes are saved on its thread instead,
+            with every change made before it gets to them saved in a single write, and the recipes aren't loaded here:
+            the catalog stays empty (and can't be changed) until a catalog made by load is given to useCatalog.
+            If load is False, the recipes aren't loaded either (until needed by page or count, if the backend can't
+            page them itself) """
+        self.path, self.worker = path, worker
+        self.backend = openBackend(path)
+        self.loaded = worker is None and load
+        self.catalog = loadCatalog(path, factory) if self.loaded else RecipeCatalog(factory=factory)
+        self.vocabularies = loadVocabularies()
+        self.brewing, self.statistics = None, None # The BrewingEngine and CatalogStatistics, made when first needed
+        self.unsaved, self.lock = list(), threading.Lock() # Changes waiting for the worker to save them
+        self.history, self.unrecorded = openHistory(path), list() # Changes waiting for the worker to add to the history
+        # The changes that can be undone and redone, as lists of (time, name, data before, data after) changes made at once
+        self.done, self.undone = deque(maxlen=MAX_UNDO), list()
+
+    def __repr__(self):
+        return f"<RecipeManager: {self.path} ({len(self.catalog)} recipes)>"
+
+    def __len__(self):
+        return len(self.catalog)
+
+    def load(self):
+        """ Loads the recipes file into a new catalog, without using it (so it can be run on the worker's thread) """
+        return loadCatalog(self.path, self.catalog.factory)
+
+    def useCatalog(self, catalog):
+        """ Replaces the catalog with one made by load """
+        self.catalog, self.loaded, self.brewing, self.statistics = catalog, True, None, None
+
+    def _save(self, record, before=None, undoable=True):
+        """ Saves a single change (as a journal record) and adds it to the history, given the recipe's data before it,
+            or leaves it for the worker to save along with any others. Returns the change, as the history takes it """
+        change = (time.time(), record["name"], before, None if record["op"] == "delete" else record["data"])
+        if undoable:
+            self.done.append([change])
+            self.undone.clear()
+        if self.worker is None:
+            self.backend.apply([record])
+            self.history.record([change])
+            return change
+        with self.lock:
+            self.unsaved.append(record)
+            self.unrecorded.append(change)
+        self.worker.submit(self.flush, key=(self.path, "save"))
+        return change
+
+    def flush(self):
+        """ Saves every change the worker hasn't saved yet in a single write, then adds them to the history """
+        with self.lock: records, self.unsaved, changes, self.unrecorded = self.unsaved, list(), self.unrecorded, list()
+        if not records: return
+        try: self.backend.apply(records)
+        except Exception:
+            with self.lock: # Kept to be saved by the next flush
+                self.unsaved[:0], self.unrecorded[:0] = records, changes
+            raise
+        self.history.record(changes)
+
+    def changes(self):
+        """ Returns the recipes changed in the recipes file since they were last loaded or checked, eg. by other
+            processes sharing it (as RecipeBackend.changes returns them). Run on the worker's thread, if there is one """
+        return self.backend.changes()
+
+    def merge(self, changes):
+        """ Applies the changes returned by changes to the catalog, returning the names of the recipes that changed.
+            Conflicts are resolved the same way in every process: the change saved to the file last wins (as it does
+            when the file is loaded), so recipes with changes of this process still waiting to be saved are left as
+            they are, as those will be saved after. Changes are merged in the order they were saved, and a change to a
+            name differing only by case from a recipe's replaces that recipe """
+        with self.lock: waiting = {record["name"].lower() for record in self.unsaved}
+        merged = list()
+        for (name, data) in changes.items():
+            if name.lower() in waiting: continue
+            row = self.catalog.row(name)
+            if data is None:
+                if row is None: continue
+                self.catalog.remove(name)
+            elif row is not None and self.catalog.record(row) == (name, data): continue
+            else: self.catalog.add(name, data)
+            merged.append(name)
+        return merged
+
+    def _checkLoaded(self):
+        if not self.loaded: raise RecipeError("Recipes are still loading")
+
+    def create(self, name, data):
+        """ Validates and saves a new recipe, returning its row number and its position in every cached ordering """
+        self._checkLoaded()
+        validateName(name, self.catalog)
+        recipe = validateRecipe(data, self.vocabularies)
+        row, positions = self.catalog.add(name, recipe)
+        self._save({"op": "add", "name": name, "data": recipe})
+        return row, positions
+
+    def update(self, name, data):
+        """ Validates and saves changes to some fields of a recipe, returning its row number and positions as create
+            does """
+        self._checkLoaded()
+        row = self.catalog.row(name)
+        if row is None: raise RecipeError(f"No recipe named {name!r}")
+        name, before = self.catalog.record(row)
+        recipe = validateRecipe({**before, **data}, self.vocabularies, before)
+        row, positions = self.catalog.add(name, recipe)
+        self._save({"op": "update", "name": name, "data": recipe}, before)
+        return row, positions
+
+    def delete(self, name):
+        """ Deletes the recipe with the given name (ignoring case), returning its (now dead) row number and the position it
+            had in every cached ordering, or (None, {}) if there is no such recipe """
+        self._checkLoaded()
+        row, positions = self.catalog.remove(name)
+        if row is not None: self._save({"op": "delete", "name": self.catalog.names[row]}, self.catalog.record(row)[1]) # Dead rows keep their data
+        return row, positions
+
+    def _restore(self, name, data, undoable=False):
+        """ Sets a recipe back to the given (already validated) data, or deletes it if data is None, returning the
+            change saved, or None if it already had that data """
+        row = self.catalog.row(name)
+        saved, before = (name, None) if row is None else self.catalog.record(row)
+        if (saved, before) == (name, data) or before is data is None: return None
+        if data is None:
+            self.catalog.remove(name)
+            return self._save({"op": "delete", "name": saved}, before, undoable)
+        self.catalog.add(name, data)
+        return self._save({"op": "add", "name": name, "data": data}, before, undoable)
+
+    def undo(self):
+        """ Undoes the last change (or restore) made that hasn't been undone, returning the names of the recipes changed
+            back. Undoing is saved (and added to the history) as a change of its own, so it can be redone """
+        self._checkLoaded()
+        if not self.done: return list()
+        changes = self.done.pop()
+        for (timestamp, name, before, after) in reversed(changes): self._restore(name, before)
+        self.undone.append(changes)
+        return [name for (timestamp, name, before, after) in changes]
+
+    def redo(self):
+        """ Makes the last change undone again, returning the names of the recipes changed """
+        self._checkLoaded()
+        if not self.undone: return list()
+        changes = self.undone.pop()
+        for (timestamp, name, before, after) in changes: self._restore(name, after)
+        self.done.append(changes)
+        return [name for (timestamp, name, before, after) in changes]
+
+    def restore(self, timestamp, name=None):
+        """ Restores a recipe (or every recipe with a history, if no name is given) to how it was at the given time (in
+            seconds since the epoch), returning the names of the recipes changed. Can be undone in a single step.
+            Reads at most CHECKPOINT_EVERY versions of each recipe (see history.py), however long its history is """
+        self._checkLoaded()
+        if self.worker is not None: self.worker.flush() # So that the history has every change made so far
+        try: restored = {name: self.history.restore(name, timestamp)} if name else self.history.restoreAll(timestamp)
+        except KeyError: raise RecipeError(f"No history of a recipe named {name!r}") from None
+        changes = [self._restore(name, data) for (name, data) in sorted(restored.items())]
+        changes = [change for change in changes if change is not None]
+        if changes:
+            self.done.append(changes)
+            self.undone.clear()
+        return [name for (timestamp, name, before, after) in changes]
+
+    def sorted(self, sorting_mode='abc+'):
+        """ Returns a sequence of Beer views in the given sorting mode """
+        return self.catalog.ordered(sorting_mode)
+
+    def search(self, sorting_mode='abc+', filters=None):
+        """ Returns an array of the rows matching filters (as RecipeCatalog.match takes them, or a query string as
+            parseQuery reads), in the given sorting mode """
+        if isinstance(filters, str): filters = parseQuery(filters, self.catalog.vocabularies)
+        return self.catalog.search(filters, sorting_mode).rows()
+
+    def page(self, sorting_mode='abc+', filters=None, offset=0, limit=None):
+        """ Returns a page of the (name, data) pairs matching filters (as search takes them), in the given sorting mode.
+            Paged by the backend where it can be (eg. by SQLite, without loading every recipe), or else by the catalog """
+        if isinstance(filters, str): filters = parseQuery(filters, self.catalog.vocabularies)
+        if self.backend.pageable and not self.unsaved: return self.backend.query(sorting_mode, filters, offset, limit)
+        self._loadIfNeeded()
+        rows = self.search(sorting_mode, filters)
+        return [self.catalog.record(row) for row in rows[offset:None if limit is None else offset+limit]]
+
+    def count(self, filters=None):
+        """ Returns the number of recipes matching filters (as search takes them) """
+        if isinstance(filters, str): filters = parseQuery(filters, self.catalog.vocabularies)
+        if self.backend.pageable and not self.unsaved: return self.backend.count(filters)
+        self._loadIfNeeded()
+        return len(self.search('abc+', filters))
+
+    def _loadIfNeeded(self):
+        if not self.loaded and self.worker is None: self.useCatalog(self.load())
+
+    def addMany(self, beerdata):
+        """ Adds every recipe in a dictionary of (already validated) recipes by name, none of which may be taken, then
+            saves them all in a single write """
+        if not beerdata: return
+        self.catalog.extend(beerdata.items())
+        self.backend.addMany(beerdata)
+        self.history.record([(time.time(), name, None, data) for (name, data) in beerdata.items()])
+
+    def exportFile(self, path, sorting_mode='abc+', filters=None):
+        """ Saves the recipes matching filters to a JSON file of recipes by name (as beers.json is saved), in the given
+            sorting mode, returning the number saved """
+        beerdata = dict(map(self.catalog.record, self.search(sorting_mode, filters)))
+        writeAtomic(path, beerdata)
+        return len(beerdata)
+
+    def stats(self):
+        """ Returns a summary of the catalog: the number of recipes, the number of each type and SRM value, and the
+            count, minimum, mean and maximum of each numeric field, for every recipe and for each type and SRM value,
+            along with histograms (see analytics.py). Kept up to date as recipes change, rather than counted again """
+        if self.statistics is None: self.statistics = CatalogStatistics(self.catalog)
+        return self.statistics.summary()
+
+    def check(self):
+        """ Returns (name, field, stated value, calculated value) for every field of every recipe that doesn't match
+            the value calculated from its ingredients (see brewing.py, which needs NumPy) """
+        if self.brewing is None:
+            from brewing import BrewingEngine
+            self.brewing = BrewingEngine(self.catalog)
+        return [(self.catalog.names[row], *problem) for (row, *problem) in self.brewing.check()]
+
+    def close(self):
+        """ Saves any changes still waiting for the worker (closing the worker), then closes the recipes file """
+        if self.worker is not None: self.worker.close()
+        self.flush()
+        self.backend.close()
@@ -0,0 +1,99 @@
+""" Opt-in instrumentation: records the time taken by (and the number of calls to) the application's hot paths, such as
+    loading recipes, loading themes and creating widgets, and can capture a cProfile profile of the whole run.
+    Enabled by setting RECIPES_DIAGNOSTICS (to 'timing', or 'profile' to also run cProfile), or by passing --diagnostics
+    or --profile on the command line. When disabled, instrumented functions are left exactly as they are """
+import atexit, cProfile, json, os, sys
+from collections import deque
+from functools import wraps
+from time import perf_counter
+
+# A dictionary to translate command line flags to the mode they enable
+FLAGS = {
+    "--diagnostics": "timing",
+    "--profile": "profile"
+}
+
+# The number of recent durations kept for each stage to work out percentiles from (calls and totals count every call)
+SAMPLES = 10000
+
+PERCENTILES = [50, 90, 99]
+
+# Where the stats (as JSON) and the cProfile profile are saved when the application exits
+STATS_PATH = os.environ.get("RECIPES_DIAGNOSTICS_FILE", "diagnostics.json")
+PROFILE_PATH = os.path.splitext(STATS_PATH)[0] + ".prof"
+
+MODE = os.environ.get("RECIPES_DIAGNOSTICS") or next((FLAGS[arg] for arg in sys.argv[1:] if arg in FLAGS), None)
+ENABLED = MODE not in (None, "", "0", "off")
+
+class StageStats:
+    """ StageStats object. The number of calls to a stage, their total duration, and the most recent durations """
+    __slots__ = ("calls", "total", "samples")
+
+    def __init__(self):
+        self.calls, self.total, self.samples = 0, 0.0, deque(maxlen=SAMPLES)
+
+    def __repr__(self):
+        return f"<StageStats: {self.calls} calls, {self.total:.3f}s>"
+
+    def add(self, seconds):
+        self.calls += 1
+        self.total += seconds
+        self.samples.append(seconds)
+
+    def summary(self):
+        """ Returns the calls, total, mean, percentiles and maximum of the stage (durations in milliseconds) """
+        ordered = sorted(self.samples)
+        summary = {"calls": self.calls, "total_ms": self.total*1000, "mean_ms": self.total*1000 / max(1, self.calls)}
+        for percentile in PERCENTILES: summary[f"p{percentile}_ms"] = percentileOf(ordered, percentile)*1000
+        summary["max_ms"] = ordered[-1]*1000 if ordered else 0.0
+        return summary
+
+def percentileOf(ordered, percentile):
+    """ Returns the given percentile (by nearest rank) of a sorted list of durations, or 0 if it is empty """
+    if not ordered: return 0.0
+    return ordered[max(0, min(len(ordered)-1, -(-percentile*len(ordered)//100) - 1))]
+
+STATS = dict() # Stage name to its StageStats
+
+def record(stage, seconds):
+    """ Records a single call to a stage """
+    if stage not in STATS: STATS[stage] = StageStats()
+    STATS[stage].add(seconds)
+
+def instrumented(stage):
+    """ Decorator recording the duration of every call to a function as the given stage. Does nothing (returning the
+        function itself) unless diagnostics are enabled """
+    def decorator(function):
+        if not ENABLED: return function
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            start = perf_counter()
+            try: return function(*args, **kwargs)
+            finally: record(stage, perf_counter() - start)
+        return wrapper
+    return decorator
+
+def summary():
+    """ Returns the summary of every stage recorded, by stage name """
+    return {stage:stats.summary() for (stage, stats) in sorted(STATS.items())}
+
+def dump(path=STATS_PATH):
+    """ Saves the summary of every stage recorded as JSON """
+    with open(path, "w") as statsfile:
+        json.dump({"mode": MODE, "stages": summary()}, statsfile, indent=2)
+
+def stripFlags(argv):
+    """ Returns the command line arguments without the diagnostics flags """
+    return [arg for arg in argv if arg not in FLAGS]
+
+PROFILER = None
+if ENABLED:
+    if MODE == "profile":
+        PROFILER = cProfile.Profile()
+        PROFILER.enable()
+    def _save():
+        if PROFILER:
+            PROFILER.disable()
+            PROFILER.dump_stats(PROFILE_PATH)
+        if STATS: dump()
+    atexit.register(_save)
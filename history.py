@@ -0,0 +1,171 @@
+""" Version history of every recipe, so that changes (and deletions) can be undone, and any recipe (or the whole
+    catalog) restored to how it was at a given time. The history of a recipes file is kept next to it (eg.
+    data/beers.json.history), as one line per version: the fields that changed since the previous version, or every field
+    every CHECKPOINT_EVERY versions (and whenever a recipe is created or deleted), so restoring a version reads at most
+    CHECKPOINT_EVERY lines, however long the recipe's history is. Like the journal, it is only ever appended to """
+import json, math, os, threading
+from bisect import bisect_right
+
+try: import fcntl
+except ImportError: fcntl = None # Not available on Windows, where a history can't be shared between processes
+
+# Number of versions of a recipe saved as changes before its next version is saved whole (as a checkpoint)
+CHECKPOINT_EVERY = 16
+
+class RecipeHistory:
+    """ RecipeHistory object. The versions of every recipe changed since the history was started, indexed by recipe
+        name as (time, offset in the file, position of its checkpoint). The index is read from the file the first time
+        it is needed, and then only the versions appended since (by any process) are read.
+        A version is either a checkpoint, holding the whole recipe as 'data' (null once deleted), or the fields 'set'
+        (and any 'unset') since the previous version. The first version of a recipe is always a checkpoint, also holding the
+        recipe as it was before its history started as 'base' """
+
+    def __init__(self, path):
+        self.path = path
+        self.index = None # Recipe name to a list of its versions, as (time, offset, checkpoint position)
+        self.offset = 0 # How much of the file has been read into the index
+        self.latest = dict() # Recipe name to the data of its latest version, for recipes whose history was just written
+        self.lock = threading.RLock()
+
+    def __repr__(self):
+        return f"<RecipeHistory: {self.path}>"
+
+    def _read(self, historyfile):
+        """ Reads the versions appended since the index was last read into the index. Returns the length of the file
+            read (up to the end of its last whole line) """
+        if self.index is None: self.index, self.offset = dict(), 0
+        historyfile.seek(self.offset)
+        for line in historyfile:
+            if not line.endswith(b"\n"): break # Still being written (or torn by a crash, and dropped by the next write)
+            try: version = json.loads(line)
+            except json.JSONDecodeError: break
+            versions = self.index.setdefault(version["name"], list())
+            checkpoint = len(versions) if "data" in version else versions[-1][2]
+            versions.append((version["t"], self.offset, checkpoint))
+            self.latest.pop(version["name"], None)
+            self.offset += len(line)
+        return self.offset
+
+    def _refresh(self):
+        """ Brings the index up to date with the file """
+        try:
+            with open(self.path, "rb") as historyfile: self._read(historyfile)
+        except FileNotFoundError:
+            if self.index is None: self.index = dict()
+
+    def _version(self, historyfile, offset):
+        historyfile.seek(offset)
+        return json.loads(historyfile.readline())
+
+    def _restore(self, historyfile, versions, position):
+        """ Returns a recipe as it was at a version (by its position in the recipe's versions), or None if it didn't
+            exist, from its checkpoint and the changes since """
+        if position < 0: return self._version(historyfile, versions[0][1]).get("base")
+        data = None
+        for (_, offset, _) in versions[versions[position][2]:position+1]:
+            version = self._version(historyfile, offset)
+            if "data" in version: data = version["data"]
+            else:
+                data = {**data, **version["set"]}
+                for field in version.get("unset", ()): data.pop(field, None)
+        return data
+
+    def record(self, changes):
+        """ Saves a version for each change, as (time, name, data before, data after), in a single write. The data
+            before is only used if the recipe has no history yet (and None means it didn't exist, as does None after) """
+        if not changes: return
+        with self.lock, open(self.path, "ab+") as historyfile:
+            if fcntl is not None: fcntl.flock(historyfile.fileno(), fcntl.LOCK_EX)
+            historyfile.truncate(self._read(historyfile)) # Catch up with other processes, dropping any torn write
+            lines, offset = list(), self.offset
+            for (timestamp, name, before, after) in changes:
+                # Down to the millisecond (which is all that is saved), so a change is never saved as made after it was
+                timestamp = math.floor(timestamp * 1000) / 1000
+                versions = self.index.setdefault(name, list())
+                if versions: timestamp = max(timestamp, versions[-1][0]) # Kept in order, for restore to search
+                if not versions: version = {"t": timestamp, "name": name, "base": before, "data": after}
+                else:
+                    previous = self.latest[name] if name in self.latest else self._restore(historyfile, versions, len(versions)-1)
+                    if previous is None or after is None or len(versions) - versions[-1][2] >= CHECKPOINT_EVERY:
+                        version = {"t": timestamp, "name": name, "data": after}
+                    else:
+                        version = {"t": timestamp, "name": name,
+                            "set": {k:v for (k,v) in after.items() if k not in previous or previous[k] != v}}
+                        unset = [field for field in previous if field not in after]
+                        if unset: version["unset"] = unset
+                line = (json.dumps(version, separators=(",", ":")) + "\n").encode()
+                versions.append((timestamp, offset, len(versions) if "data" in version else versions[-1][2]))
+                self.latest[name] = after
+                lines.append(line)
+                offset += len(line)
+            historyfile.seek(0, os.SEEK_END)
+            historyfile.write(b"".join(lines))
+            historyfile.flush()
+            self.offset = offset
+
+    def names(self):
+        """ Returns the names of every recipe with a history """
+        with self.lock:
+            self._refresh()
+            return list(self.index)
+
+    def versions(self, name):
+        """ Returns the times of every version of a recipe, oldest first """
+        with self.lock:
+            self._refresh()
+            return [timestamp for (timestamp, _, _) in self.index.get(name, ())]
+
+    def restore(self, name, timestamp=None):
+        """ Returns a recipe's data as it was at the given time (in seconds since the epoch), or its latest version if
+            no time is given, or None if it didn't exist then. Raises a KeyError if the recipe has no history """
+        with self.lock:
+            self._refresh()
+            versions = self.index[name]
+            if timestamp is None and name in self.latest: return self.latest[name]
+            if timestamp is None: position = len(versions) - 1
+            else: position = bisect_right(versions, timestamp, key=lambda version: version[0]) - 1
+            with open(self.path, "rb") as historyfile: return self._restore(historyfile, versions, position)
+
+    def every(self, name):
+        """ Returns a recipe's data as it was before its history started, and (time, data) for every version of it,
+            oldest first, reading each version once. Versions saved within the same millisecond share a time, so can
+            only be told apart here (restore returns the latest of them). Raises a KeyError if the recipe has no history """
+        with self.lock:
+            self._refresh()
+            versions, restored, data = self.index[name], list(), None
+            with open(self.path, "rb") as historyfile:
+                for (timestamp, offset, _) in versions:
+                    version = self._version(historyfile, offset)
+                    if "base" in version: base = version["base"]
+                    if "data" in version: data = version["data"]
+                    else:
+                        data = {**data, **version["set"]}
+                        for field in version.get("unset", ()): data.pop(field, None)
+                    restored.append((timestamp, data))
+            return base, restored
+
+    def restoreAll(self, timestamp):
+        """ Returns every recipe with a history as it was at the given time, as a dictionary of recipes by name (with
+            None for those that didn't exist then) """
+        with self.lock:
+            self._refresh()
+            if not self.index: return dict()
+            restored = dict()
+            with open(self.path, "rb") as historyfile:
+                for (name, versions) in self.index.items():
+                    position = bisect_right(versions, timestamp, key=lambda version: version[0]) - 1
+                    restored[name] = self._restore(historyfile, versions, position)
+            return restored
+
+def historyPath(path):
+    """ Returns the path of the history of the given recipes file """
+    # The whole file name, so that recipes files differing only in their extension (eg. beers.json and a beers.db
+    # migrated from it) don't share a history
+    return path + ".history"
+
+_HISTORIES = dict()
+
+def openHistory(path):
+    """ Returns the (shared) history of the given recipes file """
+    if path not in _HISTORIES: _HISTORIES[path] = RecipeHistory(historyPath(path))
+    return _HISTORIES[path]
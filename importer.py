@@ -0,0 +1,181 @@
+""" Bulk import of recipes from CSV, BeerXML or JSON files (as exported by brewing software, or saved as beers.json).
+    Records are read as a stream, validated in chunks by a pool of processes, deduplicated by name, and then saved in a
+    single write, with every record that couldn't be imported reported rather than stopping at the first """
+import csv, json, os, re
+import xml.etree.ElementTree as ElementTree
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import chain, islice
+from core import RecipeError, srmName, validateName, validateRecipe
+from storage import numeric
+
+# The number of records validated by each task given to the process pool
+CHUNKSIZE = 1000
+
+# A dictionary to translate CSV column headings (lower case, without spaces or punctuation) to the field they hold
+CSV_COLUMNS = {
+    "name": "name", "beer": "name", "beername": "name", "recipe": "name",
+    "type": "type", "style": "type", "beertype": "type",
+    "abv": "abv", "alcohol": "abv",
+    "gravity": "gravity", "og": "gravity", "originalgravity": "gravity",
+    "ibu": "ibu", "ibus": "ibu", "bitterness": "ibu",
+    "srm": "srm", "colour": "srm", "color": "srm",
+    "servingtemp": "servingtemp", "servingtemperature": "servingtemp", "temp": "servingtemp"
+}
+
+# The BeerXML elements (inside each RECIPE) read for each field, in order of preference. BeerXML has no serving
+# temperature, so it is only read from the (non-standard) SERVING_TEMP element, if there is one
+BEERXML_ELEMENTS = {
+    "name": ["NAME"],
+    "type": ["STYLE/NAME"],
+    "abv": ["ABV", "EST_ABV"],
+    "gravity": ["OG", "EST_OG"],
+    "ibu": ["IBU"],
+    "srm": ["EST_COLOR"],
+    "servingtemp": ["SERVING_TEMP"]
+}
+
+# The BeerXML elements read for the optional ingredient fields: the final gravity and batch size (in litres) of each
+# RECIPE, and the parts of each HOP and FERMENTABLE (weights are given in kilograms, and hops are saved in grams)
+BEERXML_INGREDIENTS = {
+    "fg": ["FG", "EST_FG"],
+    "batchsize": ["BATCH_SIZE"]
+}
+BEERXML_HOPS = {"amount": "AMOUNT", "alpha": "ALPHA", "time": "TIME"}
+BEERXML_GRAINS = {"amount": "AMOUNT", "colour": "COLOR"}
+
+# The BeerXML hop uses that don't add bitterness (so aren't counted towards the IBU)
+UNBOILED_HOPS = ["dry hop"]
+
+# The leading number of a BeerXML value (some programs add units, eg. '5.2 %' or '12 SRM')
+LEADING_NUMBER = re.compile(r"\s*(-?\d+(?:\.\d*)?|-?\.\d+)")
+
+class ImportProblem:
+    """ ImportProblem object. Why a single record couldn't be imported, and where it was in the file """
+    __slots__ = ("record", "name", "error")
+
+    def __init__(self, record, name, error):
+        self.record, self.name, self.error = record, name, error
+
+    def __repr__(self):
+        return f"<ImportProblem: record {self.record} ({self.name!r}): {self.error}>"
+
+def readRecords(path):
+    """ Yields (record number, name, data) for every record in a CSV, BeerXML or JSON file, by its extension """
+    extension = os.path.splitext(path)[1].lower()
+    if extension == ".csv": return readCSV(path)
+    elif extension in (".xml", ".beerxml"): return readBeerXML(path)
+    return readJSON(path)
+
+def readCSV(path):
+    """ Yields the records of a CSV file with a heading row, numbered by line. Unknown columns are ignored """
+    with open(path, "r", newline="", encoding="utf-8-sig") as csvfile:
+        reader = csv.reader(csvfile)
+        headings = [CSV_COLUMNS.get(re.sub(r"[^a-z]", "", heading.lower())) for heading in next(reader, [])]
+        for row in reader:
+            if not any(row): continue
+            data = {field:value for (field, value) in zip(headings, row) if field}
+            if (srm := numeric(data.get("srm"))) is not None: data["srm"] = srmName(srm) # Given as an SRM number
+            yield reader.line_num, data.pop("name", ""), data
+
+def readBeerXML(path):
+    """ Yields the recipes of a BeerXML file, numbered in order, parsing one RECIPE element at a time (and discarding
+        it once read) so that large files aren't held in memory. The colour (in SRM) is given its name from srm.csv """
+    number = 0
+    for (event, element) in ElementTree.iterparse(path, events=("end",)):
+        if element.tag != "RECIPE": continue
+        number += 1
+        data = dict()
+        for (field, paths) in BEERXML_ELEMENTS.items():
+            text = next((text.strip() for text in map(element.findtext, paths) if text and text.strip()), "")
+            if field in ("type", "name"): data[field] = text
+            elif (match := LEADING_NUMBER.match(text)): data[field] = match.group(1)
+        if "srm" in data: data["srm"] = srmName(float(data["srm"]))
+        data.update(readBeerXMLIngredients(element))
+        element.clear()
+        yield number, data.pop("name"), data
+
+def readBeerXMLIngredients(recipe):
+    """ Returns the optional ingredient fields of a BeerXML RECIPE element (leaving out any it doesn't have) """
+    def number(element, path):
+        match = LEADING_NUMBER.match(element.findtext(path) or "")
+        return float(match.group(1)) if match else None
+    data = {field:value for (field, paths) in BEERXML_INGREDIENTS.items()
+        if (value := next((v for v in (number(recipe, path) for path in paths) if v is not None), None)) is not None}
+    hops = [hop for hop in recipe.iterfind("HOPS/HOP") if (hop.findtext("USE") or "").strip().lower() not in UNBOILED_HOPS]
+    data["hops"] = [{part:number(hop, path) for (part, path) in BEERXML_HOPS.items()} for hop in hops]
+    for hop in data["hops"]:
+        if hop["amount"] is not None: hop["amount"] = round(hop["amount"] * 1000, 3)
+    data["grains"] = [{part:number(grain, path) for (part, path) in BEERXML_GRAINS.items()}
+        for grain in recipe.iterfind("FERMENTABLES/FERMENTABLE")]
+    return data
+
+def readJSON(path):
+    """ Yields the recipes of a JSON file of recipes by name (as beers.json is saved), numbered in order """
+    with open(path, "r") as jsonfile:
+        beerdata = json.load(jsonfile)
+    for (number, (name, data)) in enumerate(beerdata.items(), start=1):
+        yield number, name, data if isinstance(data, dict) else dict()
+
+_vocabularies, _defaults = None, None
+
+def _initWorker(vocabularies, defaults):
+    """ Keeps the vocabularies and defaults in each worker process, so they aren't sent with every chunk """
+    global _vocabularies, _defaults
+    _vocabularies, _defaults = vocabularies, defaults or dict()
+
+def validateChunk(chunk):
+    """ Validates a list of records, returning (record number, name, recipe, error) for each, where either the recipe
+        (as it should be saved) or the error is None """
+    results = list()
+    for (number, name, data) in chunk:
+        data = {**_defaults, **{k:v for (k,v) in data.items() if v not in (None, "")}}
+        try:
+            name = name.strip() if isinstance(name, str) else ""
+            validateName(name)
+            results.append((number, name, validateRecipe(data, _vocabularies), None))
+        except RecipeError as error: results.append((number, name, None, str(error)))
+    return results
+
+def validateRecords(records, vocabularies, defaults=None, workers=None, chunksize=CHUNKSIZE):
+    """ Yields (record number, name, recipe, error) for every record, in order, validating chunks of records in a
+        pool of processes. Only a few chunks are read ahead of the results, so memory use doesn't grow with the file.
+        Files with no more than one chunk of records are validated in this process, as starting the pool would take
+        longer than validating them """
+    records = iter(records)
+    chunks = iter(lambda: list(islice(records, chunksize)), [])
+    first, second = next(chunks, None), next(chunks, None)
+    if second is None:
+        _initWorker(vocabularies, defaults)
+        if first: yield from validateChunk(first)
+        return
+    workers = workers or os.cpu_count() or 1
+    with ProcessPoolExecutor(workers, initializer=_initWorker, initargs=(vocabularies, defaults)) as pool:
+        pending = deque()
+        for chunk in chain([first, second], chunks):
+            pending.append(pool.submit(validateChunk, chunk))
+            if len(pending) > 2*workers: yield from pending.popleft().result()
+        while pending: yield from pending.popleft().result()
+
+def importFile(manager, path, defaults=None, workers=None):
+    """ Imports every valid recipe in a CSV, BeerXML or JSON file into the RecipeManager, saving them in a single
+        write. defaults gives values for fields missing from the file (eg. {"servingtemp": 7} for BeerXML files).
+        Returns the names imported, and an ImportProblem for each record that wasn't """
+    taken = {manager.catalog.names[row].lower() for row in manager.catalog.rows()}
+    accepted, problems = dict(), list()
+    for (number, name, recipe, error) in validateRecords(readRecords(path), manager.vocabularies, defaults, workers):
+        if error is None and name.lower() in taken: error = "Name already taken"
+        if error is not None:
+            problems.append(ImportProblem(number, name, error))
+            continue
+        taken.add(name.lower())
+        accepted[name] = recipe
+    manager.addMany(accepted)
+    return list(accepted), problems
+
+def writeReport(problems, path):
+    """ Saves a CSV report of the records that couldn't be imported """
+    with open(path, "w", newline="") as reportfile:
+        writer = csv.writer(reportfile)
+        writer.writerow(["record", "name", "error"])
+        writer.writerows((problem.record, problem.name, problem.error) for problem in problems)
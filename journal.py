@@ -0,0 +1,233 @@
+import hashlib, json, os, threading
+from contextlib import contextmanager
+
+try: import fcntl
+except ImportError: fcntl = None # Not available on Windows, where a recipes file can't be shared between processes
+
+# Number of journal records written before they are compacted into the main JSON file
+COMPACT_EVERY = 256
+
+class RecipeJournal:
+    """ RecipeJournal object. Append-only log of changes (add, update, delete) made to a recipes JSON file.
+        Each change is written to the journal as a single line, so saving one recipe costs the same however many
+        recipes are stored. The journal is periodically compacted into the JSON file, which is replaced atomically.
+        Several processes may share a recipes file: every read and write holds an advisory lock on its lock file, and
+        changes reads only the records other processes have appended since it was last read """
+
+    def __init__(self, path, compact_every=COMPACT_EVERY):
+        self.path, self.compact_every = path, compact_every
+        self.journalpath = os.path.splitext(path)[0] + ".journal"
+        self.lockpath = os.path.splitext(path)[0] + ".lock"
+        self.records = 0
+        self.threadlock, self.lockdepth = threading.RLock(), 0
+        # What was last read: the JSON file's (inode, size, mtime) and content hash, and the journal's inode, length and
+        # the (running) hash of what has been read of it, which snapshots are keyed on (see snapshot.py)
+        self.signature, self.digest = None, None
+        self.journalinode, self.offset, self.journalhash = None, 0, hashlib.sha256()
+
+    def __repr__(self):
+        return f"<RecipeJournal: {self.journalpath} ({self.records} records)>"
+
+    @property
+    def due(self):
+        """ True when the journal has grown long enough to be compacted """
+        return self.records >= self.compact_every
+
+    @contextmanager
+    def locked(self, shared=False):
+        """ Holds the advisory lock (flock) on the lock file: shared while reading, or exclusive while writing.
+            Held locks are re-entered rather than taken again, so a write may read (or compact) under its own lock """
+        with self.threadlock:
+            if self.lockdepth or fcntl is None:
+                self.lockdepth += 1
+                try: yield
+                finally: self.lockdepth -= 1
+                return
+            with open(self.lockpath, "a") as lockfile:
+                fcntl.flock(lockfile.fileno(), fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+                self.lockdepth += 1
+                try: yield
+                finally:
+                    self.lockdepth -= 1
+                    fcntl.flock(lockfile.fileno(), fcntl.LOCK_UN)
+
+    def replay(self):
+        """ Loads the JSON file and replays the journal on top of it, returning a dictionary of recipes by name """
+        with self.locked():
+            try:
+                with open(self.path, "rb") as beerfile:
+                    content, stat = beerfile.read(), os.fstat(beerfile.fileno())
+                beerdata = json.loads(content)
+                self.signature, self.digest = fileSignature(stat), hashlib.sha256(content).digest()
+            except FileNotFoundError:
+                beerdata, self.signature, self.digest = dict(), None, None
+            self.records, self.journalinode, self.offset, self.journalhash = 0, None, 0, hashlib.sha256()
+            lowered = dict(zip(map(str.lower, beerdata), beerdata)) # The last of any names differing only by case wins
+            if len(lowered) != len(beerdata): beerdata = {name:beerdata[name] for name in lowered.values()}
+            try:
+                with open(self.journalpath, "rb+") as journalfile:
+                    good = 0
+                    for line in journalfile:
+                        if not line.endswith(b"\n"): break
+                        try: record = json.loads(line)
+                        except json.JSONDecodeError: break # A torn write at the end of the journal (ie. a crash mid-save)
+                        applyRecord(beerdata, record, lowered)
+                        self.records += 1
+                        good += len(line)
+                        self.journalhash.update(line)
+                    journalfile.truncate(good) # Drop any torn write, so that new records aren't appended after it
+                    self.journalinode, self.offset = os.fstat(journalfile.fileno()).st_ino, good
+            except FileNotFoundError:
+                pass
+        return beerdata
+
+    def changes(self):
+        """ Returns the records appended to the journal (by any process) since it was last replayed or read, or None
+            if the JSON file or journal has been replaced since (eg. compacted by another process), in which case it
+            must be replayed instead. Only stats the files if nothing has changed, and only hashes the JSON file when
+            its inode, size or modification time has changed (so a file touched but not changed isn't replayed) """
+        with self.locked(shared=True):
+            try: stat = os.stat(self.path)
+            except FileNotFoundError: stat = None
+            if (fileSignature(stat) if stat else None) != self.signature:
+                if stat is None: return None
+                with open(self.path, "rb") as beerfile:
+                    if hashlib.sha256(beerfile.read()).digest() != self.digest: return None
+                self.signature = fileSignature(stat)
+            try: journalfile = open(self.journalpath, "rb")
+            except FileNotFoundError: return [] if self.offset == 0 else None
+            with journalfile:
+                stat = os.fstat(journalfile.fileno())
+                if self.offset and (stat.st_ino != self.journalinode or stat.st_size < self.offset): return None
+                journalfile.seek(self.offset)
+                records = list()
+                for line in journalfile:
+                    if not line.endswith(b"\n"): break # Still being written (or torn, and replay will drop it)
+                    try: records.append(json.loads(line))
+                    except json.JSONDecodeError: break
+                    self.offset += len(line)
+                    self.journalhash.update(line)
+                self.journalinode = stat.st_ino
+        self.records += len(records)
+        return records
+
+    def key(self):
+        """ Returns what identifies the recipes last replayed or read (as a dictionary that can be saved as JSON): the
+            JSON file's size, modification time and content hash, and the length and hash of the journal read """
+        if self.signature is None: return None
+        return {"size": self.signature[1], "mtime": self.signature[2], "sha256": self.digest.hex(),
+            "journal": self.offset, "journalsha256": self.journalhash.hexdigest(), "records": self.records}
+
+    def resume(self, key):
+        """ Picks up from the recipes identified by a key (as returned by key), rather than replaying the whole file.
+            Returns the records appended to the journal since, or None if the JSON file has changed since or the
+            journal no longer starts with what was read of it (eg. it has been compacted), in which case it must be
+            replayed instead. Only hashes the JSON file if its modification time has changed """
+        with self.locked():
+            try:
+                with open(self.path, "rb") as beerfile:
+                    stat = os.fstat(beerfile.fileno())
+                    if stat.st_size != key["size"]: return None
+                    if stat.st_mtime_ns != key["mtime"] and hashlib.sha256(beerfile.read()).hexdigest() != key["sha256"]:
+                        return None
+            except FileNotFoundError: return None
+            journalhash, records = hashlib.sha256(), list()
+            try:
+                with open(self.journalpath, "rb+") as journalfile:
+                    good = key["journal"]
+                    journalhash.update(journalfile.read(good))
+                    if journalfile.tell() != good or journalhash.hexdigest() != key["journalsha256"]: return None
+                    for line in journalfile:
+                        if not line.endswith(b"\n"): break
+                        try: records.append(json.loads(line))
+                        except json.JSONDecodeError: break # A torn write, dropped as replay drops it
+                        good += len(line)
+                        journalhash.update(line)
+                    journalfile.truncate(good)
+                    journalinode = os.fstat(journalfile.fileno()).st_ino
+            except FileNotFoundError:
+                if key["journal"]: return None
+                journalinode, good = None, 0
+            self.signature, self.digest = fileSignature(stat), bytes.fromhex(key["sha256"])
+            self.journalinode, self.offset, self.journalhash = journalinode, good, journalhash
+            self.records = key["records"] + len(records)
+        return records
+
+    def add(self, name, data):
+        self.append({"op": "add", "name": name, "data": data})
+
+    def update(self, name, data):
+        self.append({"op": "update", "name": name, "data": data})
+
+    def delete(self, name):
+        self.append({"op": "delete", "name": name})
+
+    def append(self, record):
+        """ Appends a single record to the journal, and makes sure it has reached the disk before returning """
+        self.appendMany([record])
+
+    def appendMany(self, records):
+        """ Appends records to the journal in a single write (and a single sync to disk) """
+        with self.locked(), open(self.journalpath, "a") as journalfile:
+            journalfile.write("".join(json.dumps(record) + "\n" for record in records))
+            journalfile.flush()
+            os.fsync(journalfile.fileno())
+        self.records += len(records)
+
+    def compact(self, beerdata):
+        """ Atomically replaces the JSON file with the given recipes, then empties the journal.
+            If interrupted between the two steps, replaying the (already applied) journal again is harmless.
+            The recipes given should come from a replay made under the same lock, or other processes' changes are lost """
+        with self.locked():
+            self.digest = writeAtomic(self.path, beerdata)
+            try: os.remove(self.journalpath)
+            except FileNotFoundError: pass
+            fsyncDirectory(self.path)
+            self.signature, self.journalinode, self.offset = fileSignature(os.stat(self.path)), None, 0
+            self.journalhash = hashlib.sha256()
+        self.records = 0
+
+def applyRecord(beerdata, record, lowered=None):
+    """ Applies a single journal record to a dictionary of recipes by name. Names are matched ignoring case (as
+        RecipeCatalog matches them), so a record for a name differing only by case from a recipe's changes that recipe,
+        which takes on the record's name: whichever process saved last names it. lowered maps the lowercase name of
+        every recipe to its name, and is kept up to date (without it, names are matched exactly) """
+    name = record["name"]
+    if lowered is not None:
+        other = lowered.get(name.lower())
+        if other is not None and other != name: beerdata[name] = beerdata.pop(other)
+        if record["op"] == "delete": lowered.pop(name.lower(), None)
+        else: lowered[name.lower()] = name
+    if record["op"] == "add": beerdata[name] = record["data"]
+    elif record["op"] == "update": beerdata.setdefault(name, dict()).update(record["data"])
+    elif record["op"] == "delete": beerdata.pop(name, None)
+
+def writeAtomic(path, data):
+    """ Writes data as JSON to a temporary file, syncs it to disk, then renames it over the given path. Returns the
+        content hash (SHA-256) of what was written """
+    temppath, content = path + ".tmp", json.dumps(data, indent=2).encode()
+    with open(temppath, "wb") as tempfile:
+        tempfile.write(content)
+        tempfile.flush()
+        os.fsync(tempfile.fileno())
+    os.replace(temppath, path)
+    fsyncDirectory(path)
+    return hashlib.sha256(content).digest()
+
+def fileSignature(stat):
+    """ Returns what identifies a version of a file without reading it (its inode, size and modification time) """
+    return stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+def fsyncDirectory(path):
+    """ Syncs the directory containing path, so that a rename or removal inside it is durable """
+    if not hasattr(os, "O_DIRECTORY"): return # Directories can't be opened on Windows
+    fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY | os.O_DIRECTORY)
+    try: os.fsync(fd)
+    finally: os.close(fd)
+
+_JOURNALS = dict()
+
+def openJournal(path, compact_every=COMPACT_EVERY):
+    """ Returns the (shared) journal for the given recipes file """
+    if path not in _JOURNALS: _JOURNALS[path] = RecipeJournal(path, compact_every)
+    return _JOURNALS[path]
@@ -1,7 +1,14 @@
-import csv, json, pickle, platform, re
-from collections import defaultdict
+import pickle, platform, re, sys
+from collections import OrderedDict, defaultdict
 from tkinter import *
 from tkinter.ttk import Button, Entry, Label, Scrollbar, Separator, Style
+from catalog import loadVocabulary
+import diagnostics
+from core import Beer as BaseBeer, RecipeError, RecipeManager, formatNumber, parseQuery
+from diagnostics import instrumented
+from storage import NUMERIC_FIELDS
+from themes import openRegistry
+from worker import IOWorker
 
 # A list of widget types that take ARGS instead of KWARGS
 # (ie. widgets that must take multiple positional variables on initialisation)
@@ -52,70 +59,87 @@ TTKWIDGET_MAPPINGS = {
     }
 }
 
-# Dictionary of options saved to pickle file for persistance between application runs. Used only on first run on machine
-BASIC_PERSIST = {
-    "THEME": "Default",
-    "SORTING": 'abc+'
+def parseFeature(feature):
+    """ Splits a styling rule (eg. 'fg', 'fg=tint' or 'borderwidth-0') into the feature, the operator and its value """
+    for operator in "-=":
+        if operator in feature:
+            feature, value = feature.split(operator, 1)
+            return feature, operator, value
+    return feature, "", feature
+
+# The styling rules above, parsed (and the mapping patterns compiled) once, rather than every time a widget is styled
+PARSED_WIDGET_STYLES = {widget_type:([parseFeature(f) for f in styles] if styles else None)
+    for (widget_type, styles) in WIDGET_STYLES.items()}
+PARSED_OVERRIDES = {widget_name:[parseFeature(f) for f in features]
+    for (widget_name, features) in OVERRIDE_WIDGET_FEATURES.items()}
+COMPILED_MAPPINGS = [(re.compile(pattern), mapping) for (pattern, mapping) in TTKWIDGET_MAPPINGS.items()]
+
+# The layout of the recipe buttons shown in the "View Recipes" frame of the main window
+VIEW_ROWSIZE, VIEW_ROWNUM = 4, 2
+
+# Placeholder values shown by the option menus of the "Create New Recipe" frame
+CREATE_PLACEHOLDERS = {
+    "type": "Choose a type",
+    "srm": "Choose an SRM value"
 }
 
-class BeerEncoder(json.JSONEncoder):
-    """ An encoder class for saving Beer object data to JSON """
-    def default(self, o):
-        return o.__dict__
+# The fields shown in a recipe's detail window, as (heading, field)
+DETAIL_FIELDS = [
+    ("name", "name"),
+    ("beer type", "type"),
+    ("abv", "abv"),
+    ("serving temp.", "servingtemp"),
+    ("gravity", "gravity"),
+    ("ibu", "ibu"),
+    ("srm", "srm")
+]
+
+# The groupings the statistics window can show (as the option shown, and the field grouped by), and the columns of
+# its table (as the heading, and the numeric field and aggregate shown)
+STATISTICS_GROUPS = {
+    "Beer type": "type",
+    "SRM": "srm"
+}
+STATISTICS_COLUMNS = [
+    ("ABV min", "abv", "min"),
+    ("ABV mean", "abv", "mean"),
+    ("ABV max", "abv", "max"),
+    ("IBU min", "ibu", "min"),
+    ("IBU mean", "ibu", "mean"),
+    ("IBU max", "ibu", "max")
+]
 
-class Beer:
-    """ Beer object. Stores all data about custom beers, including name, recipe, ABV, gravity, etc... """
+# The width (in characters) of the longest bar of the histograms shown by the statistics window
+HISTOGRAM_WIDTH = 30
 
-    sorting_mode = 'abc+'
-    sorting_modes = ['abc+', 'abc-', 'abv+', 'abv-', 'ibu+', 'ibu-', 'gravity+', 'gravity-']
+# How many recipe detail windows can be pinned open at once (the least recently viewed is closed to make room)
+MAX_PINNED = 4
 
-    def __init__(self, name, jsondata=None):
-        """ Initialise the Beer object, loading its data from JSON string if passed """
-        self.name = name
-        if jsondata:
-            self.type = jsondata["type"]
-            self.abv, self.gravity = jsondata["abv"], jsondata["gravity"]
-            self.ibu, self.srm = jsondata["ibu"], jsondata["srm"]
-            self.servingtemp = jsondata["servingtemp"]
-            # self.recipe = jsondata["recipe"]
-            # self.image = None
+# How often (in milliseconds) the results of the I/O worker's jobs are handed back to the GUI
+WORKER_POLL = 50
 
-    def __repr__(self):
-        return f"<Beer ({self.type}): {self.name}>"
+# How often (in milliseconds) the recipes file is checked for changes saved by other instances sharing it
+CHANGES_POLL = 1000
 
-    def __str__(self):
-        return repr(self)
+# Dictionary of options saved to pickle file for persistance between application runs. Used only on first run on machine
+BASIC_PERSIST = {
+    "THEME": "Default",
+    "SORTING": 'abc+'
+}
 
-    def __lt__(self, other):
-        if self.sorting_mode == 'abc+': return self.name < other.name
-        elif self.sorting_mode == 'abc-': return self.name > other.name
-        elif self.sorting_mode == 'abv+': return self.abv < other.abv
-        elif self.sorting_mode == 'abv-': return self.abv > other.abv
-        elif self.sorting_mode == 'ibu+': return self.ibu < other.ibu
-        elif self.sorting_mode == 'ibu-': return self.ibu > other.ibu
-        elif self.sorting_mode == 'gravity+': return self.gravity < other.gravity
-        elif self.sorting_mode == 'gravity-': return self.gravity > other.gravity
+class Beer(BaseBeer):
+    """ Beer object, as shown by the GUI. Its data (and sorting) is handled by core.Beer """
 
-    def _getformattedname(self):
-        """ Returns the formatted name for view button """
-        return "".join([w.capitalize() for w in self.name.split()])
+    __slots__ = ()
 
+    @instrumented("Beer.displayInformation")
     def displayInformation(self, event=None):
-        """ Creates a popup window showing the beer's data """
-        popup = PopupWindow("View beer")
-        Label(popup.popup, text=self.name, font=("Helvetica", 18, "bold")).grid(row=0, column=0, columnspan=2)
-        Separator(popup.popup, orient=HORIZONTAL).grid(row=1, column=0, columnspan=2, sticky="ew")
-        datapairs = [("name", self.name), ("beer type", self.type), ("abv", self.abv), ("serving temp.", self.servingtemp),
-        ("gravity", self.gravity), ("ibu", self.ibu), ("srm", self.srm)]
-        for r in range(1, 8):
-            t, d = datapairs[r-1]
-            Label(popup.popup, text=t.capitalize()).grid(row=r+1, column=0)
-            Label(popup.popup, text=d).grid(row=r+1, column=1)
-        Separator(popup.popup, orient=HORIZONTAL).grid(row=9, column=0, columnspan=2, sticky="ew")
-        Button(popup.popup, text="Delete Beer", command=lambda: deleteBeer(self.name) ).grid(row=10, column=0, columnspan=2)
+        """ Shows the beer's data in a detail window, reusing the one already open rather than creating another """
+        application.showDetails(self)
 
 class PopupWindow(Toplevel):
     """ PopupWindow object. Blueprint for the popup windows shown when editing preferences, viewing beers, etc. """
+    @instrumented("PopupWindow")
     def __init__(self, title, minsize=(None, None), resizable=False):
         global styleguide
         self.popup = Toplevel(application.app)
@@ -126,11 +150,136 @@ class PopupWindow(Toplevel):
         self.bg = styleguide.lookup("TLabel", "background")
         self.popup.config(menu=menubar, bg=self.bg)
 
+class BeerDetails:
+    """ BeerDetails object. A popup window showing a beer's data, whose labels are relabelled in place to show another
+        beer, so that viewing any number of beers uses the same widgets. Closing it only hides it, ready to be shown
+        again, unless it has been pinned (ie. kept open on its beer while other beers are viewed in a new window) """
+
+    def __init__(self, application):
+        self.application, self.name, self.pinned = application, None, False
+        self.window = PopupWindow("View beer")
+        popup = self.window.popup
+        self.title = Label(popup, text="", font=("Helvetica", 18, "bold"))
+        self.title.grid(row=0, column=0, columnspan=2)
+        Separator(popup, orient=HORIZONTAL).grid(row=1, column=0, columnspan=2, sticky="ew")
+        self.values = dict() # Field to the label showing its value
+        for (row, (heading, field)) in enumerate(DETAIL_FIELDS, start=2):
+            Label(popup, text=heading.capitalize()).grid(row=row, column=0)
+            self.values[field] = Label(popup, text="")
+            self.values[field].grid(row=row, column=1)
+        Separator(popup, orient=HORIZONTAL).grid(row=len(DETAIL_FIELDS)+2, column=0, columnspan=2, sticky="ew")
+        self.pinbutton = Button(popup, text="Pin", command=lambda: application.pinDetails(self))
+        self.pinbutton.grid(row=len(DETAIL_FIELDS)+3, column=0)
+        Button(popup, text="Delete Beer", command=lambda: deleteBeer(self.name)).grid(row=len(DETAIL_FIELDS)+3, column=1)
+        popup.protocol("WM_DELETE_WINDOW", self.close)
+
+    def __repr__(self):
+        return f"<BeerDetails: {self.name}{' (pinned)' if self.pinned else ''}>"
+
+    def setBeer(self, beer):
+        """ Relabels the window with the given beer's data """
+        self.name = beer.name
+        self.title["text"] = beer.name
+        for (field, label) in self.values.items():
+            value = getattr(beer, field)
+            label["text"] = formatNumber(value) if field in NUMERIC_FIELDS else value
+
+    def show(self, beer):
+        """ Shows the given beer, bringing the window (back) to the front """
+        self.setBeer(beer)
+        self.window.popup.deiconify()
+        self.window.popup.lift()
+
+    def pin(self):
+        """ Keeps the window on its beer, titled with its name """
+        self.pinned = True
+        self.window.popup.title(f"View beer: {self.name}")
+        self.pinbutton.state(["disabled"])
+
+    def close(self):
+        """ Hides the window (and forgets its beer), or destroys it if it is pinned """
+        if self.pinned:
+            self.application.pinned.pop(self.name, None)
+            self.window.popup.destroy()
+        else:
+            self.window.popup.withdraw()
+            self.name = None
+
+class StyleSheet:
+    """ StyleSheet object. The styling rules (WIDGET_STYLES, OVERRIDE_WIDGET_FEATURES and TTKWIDGET_MAPPINGS) resolved
+        against one theme. The rules for each widget type (or overridden widget name) are resolved once, into a
+        dictionary of features, and ttk widgets whose resolved styles are identical share one interned ttk style,
+        so styling a widget costs the same however many differently named widgets there are """
+    def __init__(self, theme, ttkstyles):
+        self.theme = theme
+        self.resolved = dict()
+        self.ttkstyles = ttkstyles # Interned ttk style names, shared by every StyleSheet of the same Tk window
+
+    def __repr__(self):
+        return f"<StyleSheet: {len(self.resolved)} resolved styles>"
+
+    def resolve(self, widget_type, widget_name):
+        """ Returns the resolved features of a widget, or None if it isn't styled """
+        override = widget_name if widget_name in PARSED_OVERRIDES else None
+        if (widget_type, override) not in self.resolved:
+            # Widgets with overrides ignore WIDGET_STYLES, so all of their styles come from the override
+            rules = PARSED_OVERRIDES[override] if override else PARSED_WIDGET_STYLES[widget_type]
+            features = None if rules is None else self._resolveRules(rules, widget_type in TTKWIDGETS)
+            self.resolved[(widget_type, override)] = features
+        return self.resolved[(widget_type, override)]
+
+    def _resolveRules(self, rules, ttk):
+        features = dict()
+        for (feature, operator, value) in rules:
+            if operator == "-": col = value
+            elif not self.theme: # No theme to take the colour from, so the feature is left as (or set back to) default
+                if ttk: continue # Interned ttk styles without the feature already have the default
+                col = None # Looked up (per widget) when the widget is styled, as it may still have an earlier theme's
+            elif value not in self.theme:
+                print(f"Failed assigning '{value}' to [{feature}]")
+                print(f"No theme feature called '{value}'. Perhaps you meant '-' instead of '=' when defining overrides?")
+                quit()
+            else: col = self.theme[value]
+            if ttk: feature = FEATURE_TRANSLATE.get(feature, feature)
+            features[feature] = col
+        return features
+
+    @instrumented("StyleSheet.apply")
+    def apply(self, widget, widget_type, widget_name):
+        """ Styles a widget: regular tkinter widgets are configured directly (with their default for any feature the
+            theme has no colour for), ttk widgets are given an interned style """
+        features = self.resolve(widget_type, widget_name)
+        if widget_type in TTKWIDGETS:
+            mapping = next((i for (i, (pattern, _)) in enumerate(COMPILED_MAPPINGS) if pattern.search(widget_name)), None)
+            if features is not None or mapping is not None:
+                widget.configure(style=self.ttkStyle(widget_type, features or dict(), mapping))
+        elif features:
+            if None in features.values():
+                features = {feature:(widget.configure(feature)[3] if col is None else col) for (feature, col) in features.items()}
+            try: widget.configure(**features)
+            except TclError:
+                print(f"Failed assigning {features} to {repr(widget)}")
+                print(f"No built-in colour for one of them. Perhaps you meant '=' instead of '-' when defining overrides?")
+                quit()
+
+    @instrumented("StyleSheet.ttkStyle")
+    def ttkStyle(self, widget_type, features, mapping):
+        """ Returns the name of the ttk style with the given features and mapping, configuring it the first time """
+        global styleguide
+        key = (widget_type, tuple(sorted(features.items())), mapping)
+        if key not in self.ttkstyles:
+            stylename = f"s{len(self.ttkstyles)}.T{widget_type.__name__}"
+            styleguide.configure(stylename, **features)
+            if mapping is not None: styleguide.map(stylename, **COMPILED_MAPPINGS[mapping][1])
+            self.ttkstyles[key] = stylename
+        return self.ttkstyles[key]
+
 class Application(Tk):
     """ Application object. Blueprint for the window shown to user, with custom methods to allow for easier adding of widgets """
-    def __init__(self, /, *, title, jsonpath="data/beers.json", iconpath="assets/icon.ico"):
+    def __init__(self, /, *, title, datapath="data/beers.json", iconpath="assets/icon.ico"):
         self.app = Tk()
         self.title, self.iconpath = title, iconpath
+        self.worker = IOWorker()
         self.options = self.loadPickle()
         Beer.sorting_mode = self.options["SORTING"]
         self.rows, self.cols = 1, 1
@@ -138,9 +287,20 @@ class Application(Tk):
         self.app.resizable(False, False)
         self.app.minsize(665, 500)
         self.widgets = defaultdict(None)
-        self.beers = loadBeers(jsonpath)
+        self.widgettypes = dict()
+        self.viewframe, self.viewbuttons = None, list()
+        self.beerlist = None
+        self.details, self.pinned = None, OrderedDict() # The reused detail window, and the pinned ones by beer name
+        self.manager = RecipeManager(datapath, factory=Beer, worker=self.worker) # Loaded (and saved) by the worker
+        self.catalog = self.manager.catalog
+        self.beers = self.catalog.ordered(Beer.sorting_mode)
+        self.worker.submit(self.loadRecipes, Beer.sorting_mode, callback=self.recipesLoaded, errback=self.loadFailed)
+        self.app.after(WORKER_POLL, self.deliverResults)
+        self.app.after(CHANGES_POLL, self.checkChanges)
         self.theme_name = self.options["THEME"]
         self.theme = self.applyTheme()
+        self.ttkstyles = dict()
+        self.stylesheet = StyleSheet(self.theme, self.ttkstyles)
 
     def __repr__(self):
         return f"<Application: {self.title}>"
@@ -154,18 +314,60 @@ class Application(Tk):
             with open(persist, "rb") as pckl_file:
                 persist_data = pickle.load(pckl_file)
         except FileNotFoundError:
-            with open(persist, "wb") as pckl_file:
-                pickle.dump(BASIC_PERSIST, pckl_file)
-                persist_data = BASIC_PERSIST
+            self.worker.submit(savePickle, BASIC_PERSIST, persist, key=persist)
+            persist_data = BASIC_PERSIST
         return persist_data
 
+    def loadRecipes(self, sorting_mode):
+        """ Loads the recipes into a new catalog, sorted by the given sorting mode. Run by the worker """
+        catalog = self.manager.load()
+        catalog.ordering(sorting_mode)
+        return catalog
+
+    def recipesLoaded(self, catalog):
+        """ Shows the recipes once the worker has loaded them """
+        self.manager.useCatalog(catalog)
+        self.catalog = catalog
+        self.beers = catalog.ordered(Beer.sorting_mode)
+        if self.viewframe is not None: self.viewframe["text"] = "View Recipes"
+        self.refreshView()
+        if self.beerlist: self.beerlist.setBeers(self.beers)
+
+    def loadFailed(self, error):
+        if "label_errormessage" in self.widgets: self.widgets["label_errormessage"]["text"] = f"Error loading beers: {error}"
+
+    def waitForWorker(self):
+        """ Waits for every job given to the worker so far (eg. loading the recipes) and hands back their results,
+            rather than waiting for the next poll """
+        self.worker.flush()
+        self.worker.deliver()
+
+    def checkChanges(self):
+        """ Has the worker check the recipes file for changes saved by other instances, every CHANGES_POLL milliseconds """
+        if self.manager.loaded: self.worker.submit(self.manager.changes, key="changes", callback=self.mergeChanges)
+        self.app.after(CHANGES_POLL, self.checkChanges)
+
+    def mergeChanges(self, changes):
+        """ Merges the recipes changed by other instances into the beers list, refreshing the views if any changed """
+        if not changes or not self.manager.merge(changes): return
+        self.refreshView()
+        if self.beerlist: self.beerlist.refresh()
+        self.refreshDetails()
+
+    def deliverResults(self):
+        """ Hands the results of the worker's finished jobs to their callbacks, every WORKER_POLL milliseconds """
+        try: self.worker.deliver()
+        finally: self.app.after(WORKER_POLL, self.deliverResults)
+
     def applyTheme(self, override=None):
-        """ Applies the loaded theme to the application window. If the theme is default, do nothing and return """
-        loaded_theme = loadTheme(self.theme_name)
+        """ Applies the loaded theme (or the given one, if it has already been loaded) to the application window.
+            If the theme is default, do nothing and return """
+        loaded_theme = override if override is not None else loadTheme(self.theme_name)
         if loaded_theme == None: return None # If theme doesn't exist
         self.app["bg"] = loaded_theme["bg"]
         return loaded_theme
 
+    @instrumented("gridWidget")
     def gridWidget(self, master, widget_type, widget_name, *args, row, column, gkws=None, **kwargs):
         """ Resizes grid layout, creates a new widget instance with args and kwargs, styles it, adds to the grid,
             saves the instance to Application.items and returns widget instance for use """
@@ -174,176 +376,325 @@ class Application(Tk):
         if widget_type in COMPLEXWIDGETS: widget = widget_type(master, *args)
         elif widget_type in TTKWIDGETS: widget = widget_type(master, *args, **kwargs)
         else: widget = widget_type(master, kwargs)
-        if widget_type in TTKWIDGETS and WIDGET_STYLES[widget_type]: # If widget is from ttk and styling is available
-            self.ttkoverride(widget, widget_type, widget_name) # style the widget
-        elif (styles := WIDGET_STYLES[widget_type]): # If widget isn't ttk but styles are available
-            for feature in styles: # apply the styles
-                self.override(widget, feature)
-        # If widget isn't ttk but specific styling is available
-        if ( override := OVERRIDE_WIDGET_FEATURES[widget_name] ) and (widget_type not in TTKWIDGETS):
-            for feature in override: self.override(widget, feature) # apply the styles
-        # If widget is ttk and specific styling is available
-        elif ( override := OVERRIDE_WIDGET_FEATURES[widget_name] ) and (widget_type in TTKWIDGETS):
-            self.ttkoverride(widget, widget_type, widget_name, override) # apply the styling
-        for mapping in TTKWIDGET_MAPPINGS:
-            if re.search(mapping, widget_name) != None:
-                self.ttkApplyMapping(widget, TTKWIDGET_MAPPINGS[mapping])
-                break
+        self.styleWidget(widget, widget_type, widget_name)
         # grid to the application window
         if gkws: widget.grid(row=row, column=column, **gkws)
         else: widget.grid(row=row, column=column)
         self.widgets[widget_name] = widget
+        self.widgettypes[widget_name] = widget_type
         return widget
 
-    def override(self, widget, feature):
-        """ Method to override the style of given widget, if that widget is from regular tkinter widget set """
-        if "-" in feature: feature, col = feature.split("-")
-        elif "=" in feature and self.theme:
-            feature, col = feature.split("=")
-            try: col = self.theme[col]
-            except KeyError as e:
-                print(f"Failed assigning '{col}' to {repr(widget)}[{feature}]")
-                print(f"No theme feature called '{col}'. Perhaps you meant '-' instead of '=' when defining overrides?")
-                quit()
-        elif self.theme: col = self.theme[feature]
-        else: pass
-        try:
-            widget[feature] = col
-        except TclError as e:
-            print(f"Failed assigning '{col}' to {repr(widget)}[{feature}]")
-            print(f"No built-in colour called '{col}'. Perhaps you meant '=' instead of '-' when defining overrides?")
-            quit()
-
-    def ttkoverride(self, widget, widget_type, widget_name, override=None):
-        """ Method to override the style of given widget, if that widget is from tkinter.ttk widget set """
-        global styleguide
-        features = dict()
-        to_apply = WIDGET_STYLES[widget_type]
-        if override: to_apply = override
-        for feature in to_apply:
-            if "-" in feature: feature, col = feature.split("-")
-            elif "=" in feature and self.theme:
-                feature, col = feature.split("=")
-                col = self.theme[col]
-            elif self.theme: col = self.theme[feature]
-            else: pass
-            try: feature = FEATURE_TRANSLATE[feature]
-            except KeyError: pass
-            try: features[feature] = col
-            except UnboundLocalError: pass
-        formatted_type = repr(widget_type).split("'")[1].split(".")[-1]
-        styleguide.configure(f"{widget_name}.T{formatted_type}", **features)
-        widget.configure(style=f"{widget_name}.T{formatted_type}")
-
-    def ttkApplyMapping(self, widget, mapping):
-        global styleguide
-        _style = widget['style']
-        styleguide.map(_style, **mapping)
-        widget.configure(style=_style)
+    def styleWidget(self, widget, widget_type, widget_name):
+        """ Applies the styleguide, overrides and mappings of the current theme to the given widget """
+        self.stylesheet.apply(widget, widget_type, widget_name)
+        if widget_type is LabelFrame: widget["highlightbackground"] = self.highlight()
+
+    def highlight(self):
+        """ Returns the colour used to outline the frames of the main window """
+        return self.theme["tint"] if self.theme else 'black'
+
+    def changeTheme(self, theme_name):
+        """ Switches to the given theme (once the worker has loaded it) and re-styles every widget of the main window
+            in place """
+        def restyle(theme):
+            self.theme_name = theme_name
+            self.theme = self.applyTheme(theme) if theme is not None else None
+            if self.theme is None: self.app["bg"] = self.app.configure("bg")[3] # Back to default, from the last theme's
+            self.stylesheet = StyleSheet(self.theme, self.ttkstyles)
+            for (widget_name, widget) in self.widgets.items():
+                self.styleWidget(widget, self.widgettypes[widget_name], widget_name)
+        self.worker.submit(loadTheme, theme_name, key="theme", callback=restyle)
+
+    def changeSorting(self, sorting_mode):
+        """ Switches the beers list to the given sorting mode (sorting only if it isn't cached) and refreshes the
+            "View Recipes" frame """
+        Beer.sorting_mode = sorting_mode
+        self.beers = self.catalog.ordered(sorting_mode)
+        self.refreshView()
+        if self.beerlist: self.beerlist.setBeers(self.beers)
+
+    def addBeer(self, name, data):
+        """ Creates a beer (raising a RecipeError if it isn't valid) and inserts it into the (sorted) beers list,
+            refreshing only the view buttons that moved """
+        row, positions = self.manager.create(name, data)
+        self.refreshView(start=positions.get(Beer.sorting_mode, 0))
+        if self.beerlist: self.beerlist.refresh()
+        return self.catalog.view(row)
+
+    def removeBeer(self, beername):
+        """ Deletes the beer with the given name and removes it from the beers list, refreshing only the view buttons
+            that moved """
+        row, positions = self.manager.delete(beername)
+        if row is None: return None
+        self.refreshView(start=positions.get(Beer.sorting_mode, 0))
+        if self.beerlist: self.beerlist.refresh()
+        self.refreshDetails()
+        return self.catalog.view(row)
+
+    def undo(self, event=None):
+        """ Undoes the last change made to the recipes (see RecipeManager.undo), refreshing the views """
+        self.changeHistory(self.manager.undo, "undo")
+
+    def redo(self, event=None):
+        """ Makes the last change undone again """
+        self.changeHistory(self.manager.redo, "redo")
+
+    def changeHistory(self, change, verb):
+        try: names = change()
+        except RecipeError as error:
+            self.widgets["label_errormessage"]["text"] = f"Can't {verb}: {error}"
+            return
+        self.widgets["label_errormessage"]["text"] = f"Nothing to {verb}" if not names else ""
+        if not names: return
+        self.refreshView()
+        if self.beerlist: self.beerlist.refresh()
+        self.refreshDetails()
+
+    def showDetails(self, beer):
+        """ Shows a beer in its pinned detail window if it has one, or else in the reused one (created the first time) """
+        details = self.pinned.get(beer.name)
+        if details is not None: self.pinned.move_to_end(beer.name) # Now the most recently viewed
+        else:
+            if self.details is None: self.details = BeerDetails(self)
+            details = self.details
+        details.show(beer)
+        return details
+
+    def pinDetails(self, details):
+        """ Pins the reused detail window on its beer, so that the next beer viewed opens in a new one. Closes the least
+            recently viewed pinned window if more than MAX_PINNED are open """
+        if details.pinned or details.name is None: return
+        details.pin()
+        self.details, self.pinned[details.name] = None, details
+        while len(self.pinned) > MAX_PINNED: next(iter(self.pinned.values())).close()
+
+    def refreshDetails(self):
+        """ Relabels the open detail windows with their beer's current data, closing those whose beer was deleted """
+        for details in [self.details, *self.pinned.values()]:
+            if details is None or details.name is None: continue
+            beer = self.catalog.get(details.name)
+            if beer is None: details.close()
+            else: details.setBeer(beer)
+
+    def refreshView(self, start=0):
+        """ Updates the recipe buttons in the "View Recipes" frame from the given position onwards.
+            Existing buttons are reconfigured in place, so the cost doesn't depend on the number of beers stored """
+        if self.viewframe is None: return
+        slots = VIEW_ROWSIZE*VIEW_ROWNUM
+        for slot in range(start, slots):
+            beer = self.beers[slot] if slot < len(self.beers) else None
+            if slot < len(self.viewbuttons) and beer: # Reuse the button already in this slot
+                btn = self.viewbuttons[slot]
+                btn.configure(text=beer.name, command=beer.displayInformation)
+                btn.bind('<Return>', beer.displayInformation)
+            elif beer: # Create a new button for this slot
+                _row, _col = 1 + (slot//VIEW_ROWSIZE), slot%VIEW_ROWSIZE
+                btn = self.gridWidget(self.viewframe, Button, f"button_beer_{slot}", row=_row, column=_col, text=beer.name,
+                command=beer.displayInformation, width=14, gkws={"ipadx":2, "ipady":1, "padx":2, "pady":2})
+                btn.bind('<Return>', beer.displayInformation)
+                self.viewbuttons.append(btn)
+            elif slot < len(self.viewbuttons): # No beer left for this slot, so remove its button (and those after it)
+                for (_slot, btn) in enumerate(self.viewbuttons[slot:], start=slot):
+                    del self.widgets[f"button_beer_{_slot}"]
+                    btn.destroy()
+                del self.viewbuttons[slot:]
+                break
+        viewmore = self.widgets.get("button_viewmorebeers")
+        if len(self.beers) > slots and viewmore is None:
+            btn = self.gridWidget(self.viewframe, Button, "button_viewmorebeers", row=VIEW_ROWNUM, column=VIEW_ROWSIZE-1,
+            text="View more...", command=displayBeerList, width=14, gkws={"ipadx":2, "ipady":1, "padx":2, "pady":2})
+            btn.bind('<Return>', displayBeerList)
+        elif len(self.beers) <= slots and viewmore is not None:
+            del self.widgets["button_viewmorebeers"]
+            viewmore.destroy()
+        elif viewmore is not None: viewmore.lift() # Keep the button on top of the last recipe button
 
 def createBeer(application, data):
-    """ Creates a new beer, adds it to the 'application.beers' list, and saves it to the JSON file """
+    """ Creates a new beer from the values entered in the "create" form, showing why in the error message if it can't """
     name = data.pop(0)
-    if name.get().lower() in map(lambda b: b.name.lower(), application.beers):
-        application.widgets["label_errormessage"]["text"] = "Error adding beer: Name already taken"
-        return False
-    elif name.get() == "":
-        application.widgets["label_errormessage"]["text"] = "Error adding beer: Enter valid name"
+    headers = ["type", "servingtemp", "abv", "ibu", "srm", "gravity"]
+    values = {kw:v.get() for (kw, v) in zip(headers, data)}
+    for (kw, placeholder) in CREATE_PLACEHOLDERS.items():
+        if values[kw] == placeholder: values[kw] = ""
+    try: application.addBeer(name.get(), values)
+    except RecipeError as error:
+        application.widgets["label_errormessage"]["text"] = f"Error adding beer: {error}"
         return False
-    elif len(name.get()) > 16:
-        application.widgets["label_errormessage"]["text"] = "Error adding beer: Name must not be more than 16 characters long"
-        return False
-    else:
-        headers = ["type", "servingtemp", "abv", "ibu", "srm", "gravity"]
-        newbeer = Beer(name.get())
-        for (kw, v) in zip(headers, data):
-            val = repr(v.get())
-            if len(v.get()) == 0 or (kw=="type" and v.get()=="Choose a type") or (kw=="srm" and v.get()=="Choose an SRM value"):
-                keyword = kw if kw != "servingtemp" else "serving temp"
-                application.widgets["label_errormessage"]["text"] = f"Error adding beer: Enter valid {keyword}."
-                return False
-            exec(f"newbeer.{kw} = {val}")
-        application.beers.append(newbeer)
-        saveBeers(application.beers)
-        application = restartApplication(application)
+    # Clear the "create" form, ready for the next beer
+    application.widgets["label_errormessage"]["text"] = ""
+    name.delete(0, END)
+    for (kw, v) in zip(headers, data):
+        if kw in CREATE_PLACEHOLDERS: v.set(CREATE_PLACEHOLDERS[kw])
+        else: v.delete(0, END)
+    return True
 
 def deleteBeer(beername):
-    """ Removes the beer with the given name from the beers list, saves the list, then reloads the application """
+    """ Deletes the beer with the given name, removing it from the beers list and the "View Recipes" frame """
     global application
-    application.beers = filter(lambda b: b.name != beername, application.beers)
-    saveBeers(application.beers)
-    application = restartApplication(application)
-
-def loadBeers(path="data/beers.json"):
-    """ Loads beer data from JSON file passed as arg """
-    try:
-        with open(path, "r") as beerfile:
-            beerdata = json.load(beerfile)
-        return [Beer(k, v) for (k,v) in beerdata.items()]
-    except json.JSONDecodeError:
-        return list()
-
-def saveBeers(beers, path="data/beers.json"):
-    """ Saves beer data to JSON file passed as arg """
-    JSONstrings = [json.dumps(beer, cls=BeerEncoder) for beer in beers]
-    loadedJSON = [json.loads(s) for s in JSONstrings]
-    saveJSON = dict()
-    for beer in filter(lambda b: b["name"] != '', loadedJSON):
-        name = beer["name"]
-        del(beer["name"])
-        saveJSON[name] = beer
-    json.dump(saveJSON, open(path, "w"), indent=2)
+    return application.removeBeer(beername) is not None
 
+@instrumented("displayBeerList")
 def displayBeerList(event=None):
     """ Creates a popup window which shows the list of all beers (when there are more than 8 beers stored in the application) """
     global styleguide
+    if application.beerlist is not None: # Only one list is needed, so bring the open one to the front
+        application.beerlist.master.winfo_toplevel().lift()
+        return
     beerlist = PopupWindow("Beer List")
+    searchframe = Frame(beerlist.popup, bg=beerlist.bg)
+    searchframe.pack(fill="x", padx=5, pady=(5, 0))
+    Label(searchframe, text="Search: ").pack(side="left")
+    searchentry = Entry(searchframe, width=17)
+    searchentry.pack(side="left", fill="x", expand=1)
+    searchcount = Label(searchframe, text="")
+    searchcount.pack(side="left", padx=(5, 0))
+    jumpframe = Frame(beerlist.popup, bg=beerlist.bg)
+    jumpframe.pack(fill="x", padx=5, pady=5)
+    Label(jumpframe, text="Jump to: ").pack(side="left")
+    jumpentry = Entry(jumpframe, width=17)
+    jumpentry.pack(side="left", fill="x", expand=1)
     mainframe = Frame(beerlist.popup)
     mainframe.pack(fill="both", expand=1)
-    canvas = Canvas(mainframe)
-    canvas.pack(side="left", fill="both", expand=1)
-    scrollbar = Scrollbar(mainframe, orient="vertical", command=canvas.yview)
-    scrollbar.pack(side="right", fill="y")
-    canvas.configure(yscrollcommand=scrollbar.set)
-    canvas.bind("<Configure>", lambda e: canvas.configure(scrollregion=canvas.bbox("all")))
-    # canvas.bind("<MouseWheel>", canvas.yview)
-    innerframe = Frame(canvas)
-    canvas.create_window((0, 0), window=innerframe, anchor="nw")
-
-    # features = {}
-    # mappings = TTKWIDGET_MAPPINGS["button_morebeers"]
-    # styleguide.configure("morebeers.TButton", **features)
-    # stylguide.map("morebeers.TButton", **mappings)
-
-    for beer in application.beers:
-        btn = Button(innerframe, text=beer.name, command=beer.displayInformation, width=40)
-        btn.configure(style='TLabel') # btn.configure(style="morebeers.TButton")
-        btn.pack(anchor='w', padx=5)
+    application.beerlist = VirtualBeerList(mainframe, application.beers)
+    searchentry.bind("<KeyRelease>", lambda e: searchBeers(searchentry.get(), searchcount))
+    jumpentry.bind("<Return>", lambda e: application.beerlist.jumpTo(jumpentry.get()))
+    mainframe.bind("<Destroy>", lambda e: setattr(application, "beerlist", None))
+
+def searchBeers(query, countlabel=None):
+    """ Shows only the beers matching the search query (eg. 'type:IPA abv:5-7 ibu>50') in the list of all beers """
+    try: filters = parseQuery(query, application.catalog.vocabularies)
+    except RecipeError:
+        if countlabel: countlabel["text"] = "?"
+        return False
+    application.beerlist.setFilters(filters)
+    if countlabel: countlabel["text"] = f"{len(application.beerlist.beers)} found" if filters else ""
+    return True
+
+class VirtualBeerList:
+    """ VirtualBeerList object. A scrolling list of beer buttons that only creates widgets for the rows on screen.
+        A fixed pool of buttons (twice the number of visible rows) is placed on a canvas as tall as the whole list,
+        and as the list scrolls the buttons are moved and relabelled, so the number of Tk widgets (and the time taken to
+        open the list) stays the same whatever the number of beers """
+
+    VISIBLE_ROWS = 20
+
+    def __init__(self, master, beers, width=40):
+        self.master, self.allbeers, self.beers = master, beers, beers
+        self.filters = None
+        self.canvas = Canvas(master)
+        self.canvas.pack(side="left", fill="both", expand=1)
+        scrollbar = Scrollbar(master, orient="vertical", command=self.yview)
+        scrollbar.pack(side="right", fill="y")
+        self.canvas.configure(yscrollcommand=scrollbar.set)
+        self.pool, self.shown = list(), list() # The pooled buttons' canvas windows, and the index each one is showing
+        for slot in range(2*self.VISIBLE_ROWS):
+            btn = Button(self.canvas, width=width, command=lambda slot=slot: self.select(slot))
+            btn.configure(style='TLabel')
+            for sequence in ("<MouseWheel>", "<Button-4>", "<Button-5>"): btn.bind(sequence, self.scroll)
+            self.pool.append((btn, self.canvas.create_window(5, 0, window=btn, anchor="nw", state="hidden")))
+            self.shown.append(None)
+        self.rowheight = self.pool[0][0].winfo_reqheight()
+        self.canvas.configure(width=self.pool[0][0].winfo_reqwidth() + 10, height=self.VISIBLE_ROWS*self.rowheight,
+            yscrollincrement=self.rowheight)
+        for sequence in ("<MouseWheel>", "<Button-4>", "<Button-5>"): self.canvas.bind(sequence, self.scroll)
+        self.canvas.bind("<Configure>", lambda e: self.layout())
+        self.refresh()
 
+    def __repr__(self):
+        return f"<VirtualBeerList: {len(self.beers)} beers>"
+
+    def setBeers(self, beers):
+        """ Shows a different list of beers (eg. after the sorting mode has changed), scrolled back to the top.
+            If a search is being shown, only the beers matching it are shown """
+        self.allbeers = beers
+        self.beers = beers.catalog.search(self.filters, beers.sorting_mode) if self.filters else beers
+        self.canvas.yview_moveto(0)
+        self.refresh()
+
+    def setFilters(self, filters):
+        """ Shows only the beers matching the given search filters (as RecipeCatalog.match takes them), or every beer if
+            there are none """
+        self.filters = filters
+        self.setBeers(self.allbeers)
+
+    def refresh(self):
+        """ Resizes the list to the number of beers, and relabels every visible row (eg. after a beer is added) """
+        self.canvas.configure(scrollregion=(0, 0, 0, len(self.beers)*self.rowheight))
+        self.shown = [None]*len(self.pool)
+        self.layout()
+
+    def layout(self):
+        """ Moves the pooled buttons to cover the visible rows (and half a screen either side), relabelling only the
+            buttons whose row has changed """
+        top = int(self.canvas.canvasy(0)) // self.rowheight
+        first = max(0, top - self.VISIBLE_ROWS//2)
+        for (slot, (btn, window)) in enumerate(self.pool):
+            index = first + (slot - first) % len(self.pool) # Each button keeps its slot modulo the pool size
+            if index >= len(self.beers):
+                self.canvas.itemconfigure(window, state="hidden")
+                self.shown[slot] = None
+            elif self.shown[slot] != index:
+                btn.configure(text=self.beers[index].name)
+                self.canvas.coords(window, 5, index*self.rowheight)
+                self.canvas.itemconfigure(window, state="normal")
+                self.shown[slot] = index
+
+    def yview(self, *args):
+        self.canvas.yview(*args)
+        self.layout()
+
+    def scroll(self, event):
+        """ Scrolls the list with the mouse wheel (<MouseWheel> on Windows and Mac, <Button-4>/<Button-5> on Linux) """
+        if event.num == 4 or getattr(event, "delta", 0) > 0: units = -3
+        else: units = 3
+        self.yview("scroll", units, "units")
+
+    def select(self, slot):
+        """ Shows the information of the beer on the given pooled button """
+        if self.shown[slot] is not None: self.beers[self.shown[slot]].displayInformation()
+
+    def jumpTo(self, name):
+        """ Scrolls to the beer with the given name, or the first beer (in name order) whose name starts with it, out of
+            the beers being shown (ie. those matching the search, if there is one) """
+        catalog, filters, prefix = self.beers.catalog, dict(self.filters or ()), name
+        if "prefix" in filters: # The beers shown already start with the search's words, so keep the longer prefix
+            if filters["prefix"].lower().startswith(name.lower()): prefix = filters["prefix"]
+            elif not name.lower().startswith(filters["prefix"].lower()): return False
+        rows = catalog.match({**filters, "prefix": prefix})
+        if not rows: return False
+        index = self.beers.position(min(rows, key=catalog.rowKey('abc+'))) # An exact match comes first in name order
+        if index is None: return False
+        self.canvas.yview_moveto(index / max(1, len(self.beers)))
+        self.layout()
+        return True
+
+@instrumented("loadTheme")
 def loadTheme(themename, path="data/themes.json"):
-    """ Loads the theme needed for the application to be styled """
-    global THEMES
-    THEMES = json.load(open(path, "r")) # Load all themes
-    try:
-        return THEMES[themename] # Return theme
-    except KeyError: # If theme doesn't exist
-        return None
-
-def restartApplication(application):
-    """ Destroys the TKinter Window, deletes the instance of Application class, and creates a new one from scratch """
-    try: application.app.destroy()
-    except: application.app.quit()
-    application = setupWindow()
-    return application
-
-def submitSettings(settings):
-    """ Applies settings to the Application object, and saves them to the pickle """
+    """ Loads the theme needed for the application to be styled. Themes come from the theme registry, which only
+        reads the themes file again when it has changed """
+    return openRegistry(path).get(themename)
+
+def submitSettings(settings, popup=None):
+    """ Applies settings to the Application object in place, and saves them to the pickle """
     global application
     persist = {option:setting.get() for (option,setting) in settings.items()}
-    with open("data/persist.pk", "wb") as pickle_file:
+    application.worker.submit(savePickle, persist, key="data/persist.pk")
+    if persist["THEME"] != application.theme_name: application.changeTheme(persist["THEME"])
+    if persist["SORTING"] != Beer.sorting_mode: application.changeSorting(persist["SORTING"])
+    application.options = persist
+    if popup: popup.destroy()
+
+def savePickle(persist, path="data/persist.pk"):
+    """ Saves the persistant data (ie. options kept between program instances) to the pickle. Run by the worker """
+    with open(path, "wb") as pickle_file:
         pickle.dump(persist, pickle_file)
-    application = restartApplication(application)
 
+def closeApplication(application):
+    """ Saves everything still waiting to be saved by the worker, then closes the window """
+    application.manager.close()
+    application.app.destroy()
+
+@instrumented("settingsPopup")
 def settingsPopup():
     """ Manages the popup window shown when the user clicks 'Preferences' button """
     # Add more settings here
@@ -353,7 +704,7 @@ def settingsPopup():
         SORTING = StringVar(value=Beer.sorting_mode)
     )
     val_dict = {
-        "THEME": list(sorted(THEMES)),
+        "THEME": openRegistry().names(),
         "SORTING": Beer.sorting_modes
     }
     Label(settings_popup.popup, text="").grid(row=0, column=0, columnspan=2)
@@ -363,19 +714,78 @@ def settingsPopup():
         om = OptionMenu(settings_popup.popup, settings[option], *val_dict[option])
         om.configure(bg = settings_popup.bg)
         om.grid(row=_row+1, column=1, padx=5, ipady=5)
-    submit = Button(settings_popup.popup, text="Submit", command=lambda: submitSettings(settings))
+    submit = Button(settings_popup.popup, text="Submit", command=lambda: submitSettings(settings, settings_popup.popup))
     submit.grid(row=len(application.options)+1, column=0, columnspan=2, sticky="s", padx=5, pady=15)
 
+def statisticsPopup():
+    """ Manages the popup window showing the number of recipes and their ABV and IBU for each beer type (or SRM value),
+        and the histograms of the whole catalog. The statistics are kept up to date by the manager, so refreshing
+        only reads the recipes changed since """
+    popup = PopupWindow("Statistics", resizable=True)
+    grouping = StringVar(value=next(iter(STATISTICS_GROUPS)))
+    def show(*args):
+        for widget in table.winfo_children(): widget.destroy()
+        summary = application.manager.stats()
+        headings = [grouping.get(), "Recipes", *(heading for (heading, field, aggregate) in STATISTICS_COLUMNS)]
+        for (column, heading) in enumerate(headings):
+            Label(table, text=heading, font=("Helvetica", 10, "bold")).grid(row=0, column=column, padx=4)
+        groups = summary["groups"][STATISTICS_GROUPS[grouping.get()]]
+        for (row, (group, stats)) in enumerate(groups.items(), start=1):
+            values = [group or "(none)", stats["recipes"],
+                *(formatNumber(stats[field][aggregate]) for (heading, field, aggregate) in STATISTICS_COLUMNS)]
+            for (column, value) in enumerate(values):
+                Label(table, text=value).grid(row=row, column=column, padx=4, sticky="w" if column == 0 else "e")
+        row = len(groups) + 1
+        for (field, histogram) in summary["histograms"].items():
+            Label(table, text=f"{field.capitalize()} histogram", font=("Helvetica", 10, "bold")).grid(row=row, column=0,
+                pady=(10, 0), sticky="w")
+            longest = max(histogram.values(), default=1)
+            for (row, (bins, count)) in enumerate(histogram.items(), start=row+1):
+                Label(table, text=bins).grid(row=row, column=0, padx=4, sticky="w")
+                Label(table, text=count).grid(row=row, column=1, padx=4, sticky="e")
+                Label(table, text="\u2588"*max(1, round(HISTOGRAM_WIDTH*count/longest))).grid(row=row, column=2,
+                    columnspan=len(STATISTICS_COLUMNS), sticky="w")
+            row += 1
+        countlabel["text"] = f"{summary['recipes']} recipes"
+    options = OptionMenu(popup.popup, grouping, *STATISTICS_GROUPS, command=show)
+    options.configure(bg=popup.bg)
+    options.grid(row=0, column=0, padx=5, pady=5, sticky="w")
+    countlabel = Label(popup.popup, text="")
+    countlabel.grid(row=0, column=1, padx=5, pady=5, sticky="e")
+    table = Frame(popup.popup, bg=popup.bg)
+    table.grid(row=1, column=0, columnspan=2, padx=5, pady=5)
+    Button(popup.popup, text="Refresh", command=show).grid(row=2, column=0, columnspan=2, pady=5)
+    show()
+
+def diagnosticsPopup():
+    """ Manages the popup window showing the time taken by each instrumented stage (when diagnostics are enabled) """
+    popup = PopupWindow("Diagnostics", resizable=True)
+    columns = ["stage", "calls", "mean_ms", "p50_ms", "p90_ms", "p99_ms", "max_ms"]
+    def show():
+        for widget in table.winfo_children(): widget.destroy()
+        for (column, heading) in enumerate(columns):
+            Label(table, text=heading.replace("_ms", " (ms)"), font=("Helvetica", 10, "bold")).grid(row=0, column=column, padx=4)
+        for (row, (stage, stats)) in enumerate(diagnostics.summary().items(), start=1):
+            values = [stage, stats["calls"], *(f"{stats[c]:.2f}" for c in columns[2:])]
+            for (column, value) in enumerate(values):
+                Label(table, text=value).grid(row=row, column=column, padx=4, sticky="w" if column == 0 else "e")
+    table = Frame(popup.popup, bg=popup.bg)
+    table.grid(row=0, column=0, columnspan=2, padx=5, pady=5)
+    Button(popup.popup, text="Refresh", command=show).grid(row=1, column=0, pady=5)
+    Button(popup.popup, text=f"Save to {diagnostics.STATS_PATH}", command=diagnostics.dump).grid(row=1, column=1, pady=5)
+    show()
+
 def configure(event):
     """ This method is called when the application.app window is resized """
     width, height = event.width, event.height
     pass
 
-def setupWindow():
+@instrumented("setupWindow")
+def setupWindow(datapath="data/beers.json"):
     """ Sets up GUI with widgets """
     global styleguide
     # Create basic window layout
-    root = Application(title="Crown Brewery Recipe Manager")
+    root = Application(title="Crown Brewery Recipe Manager", datapath=datapath)
 
     # Create a style guide for ttk widgets
     styleguide = Style()
@@ -383,6 +793,15 @@ def setupWindow():
     # Create a custom menu
     menubar = Menu(root.app)
     root.app.config(menu=menubar)
+    editmenu = Menu(menubar, tearoff=0)
+    modifier = "Command" if SYSTEM == 'Darwin' else "Control"
+    editmenu.add_command(label="Undo", command=root.undo, accelerator=f"{modifier}+Z")
+    editmenu.add_command(label="Redo", command=root.redo, accelerator=f"{modifier}+Shift+Z")
+    menubar.add_cascade(label="Edit", menu=editmenu)
+    root.app.bind_all(f"<{modifier}-z>", root.undo)
+    root.app.bind_all(f"<{modifier}-Z>", root.redo) # Shift+Z
+    menubar.add_command(label="Statistics", command=statisticsPopup)
+    if diagnostics.ENABLED: menubar.add_command(label="Diagnostics", command=diagnosticsPopup)
     # Add more menu options here
 
     if SYSTEM == 'Darwin': # If the application is running on a Mac
@@ -393,8 +812,7 @@ def setupWindow():
     elif SYSTEM == 'Linux': # If the application is running on a Linux machine
         pass
 
-    if root.theme: highlight = root.theme["tint"]
-    else: highlight = 'black'
+    highlight = root.highlight()
     titleframe = root.gridWidget(root.app, Frame, "frame_titleframe", row=0, column=0, height=15,
         gkws={"sticky":"new", "pady":5, "padx":20, "ipadx": 20})
     bodyframe = root.gridWidget(root.app, Frame, "frame_bodyframe", row=0, column=0, #highlightthickness=1,
@@ -423,13 +841,11 @@ def setupWindow():
         srm = StringVar()
     )
 
-    with open("data/beertypes.csv", "r") as typecsvfile:
-        BEERTYPES = list(csv.reader(typecsvfile))[0]
-    with open("data/srm.csv", "r") as srmcsvfile:
-        SRMSCALE = list(csv.reader(srmcsvfile))[0]
+    BEERTYPES = loadVocabulary("data/beertypes.csv")
+    SRMSCALE = loadVocabulary("data/srm.csv")
 
-    newbeer["type"].set("Choose a type")
-    newbeer["srm"].set("Choose an SRM value")
+    newbeer["type"].set(CREATE_PLACEHOLDERS["type"])
+    newbeer["srm"].set(CREATE_PLACEHOLDERS["srm"])
 
     root.gridWidget(createframe, Label, "label_beername", row=0, column=0, text="Enter beer name: ")
     name = root.gridWidget(createframe, Entry, "entry_beername", row=0, column=1, width=17, gkws={"sticky":"w"})
@@ -456,27 +872,23 @@ def setupWindow():
         command=lambda: createBeer(root, [name, newbeer["type"], servingtemp, abv, ibu, newbeer["srm"], gravity]),
         gkws={"columnspan":2, "sticky":"ew", "padx":5, "pady":5})
 
-    # Set up the "view" frame
-    ROWSIZE, ROWNUM = 4, 2
-    for beernum, beer in enumerate(sorted(root.beers)[:(ROWNUM*ROWSIZE)]):
-        buttonname = "button_beer_"+beer._getformattedname()
-        _row, _col = 1 + (beernum//ROWSIZE), beernum%ROWSIZE
-        btn = root.gridWidget(viewframe, Button, buttonname, row=_row, column=_col, text=beer.name,
-        command=beer.displayInformation, width=14, gkws={"ipadx":2, "ipady":1, "padx":2, "pady":2})
-        btn.bind('<Return>', beer.displayInformation)
-    if len(root.beers) > ROWSIZE*ROWNUM:
-        btn = root.gridWidget(viewframe, Button, "button_viewmorebeers", row=ROWNUM, column=ROWSIZE-1, text="View more...",
-        command=displayBeerList, width=14, gkws={"ipadx":2, "ipady":1, "padx":2, "pady":2})
-        btn.bind('<Return>', displayBeerList)
+    # Set up the "view" frame (its recipes are shown once the worker has loaded them)
+    root.viewframe = viewframe
+    if not root.manager.loaded: viewframe["text"] = "View Recipes (loading...)"
+    root.refreshView()
 
     # Add an empty error message label for use later
     root.gridWidget(root.app, Label, "label_errormessage", row=2, column=0, text="",
         gkws={"columnspan":5, "sticky":"s"})
 
     root.app.bind("<Configure>", configure)
+    root.app.protocol("WM_DELETE_WINDOW", lambda: closeApplication(root))
     return root
 
 if __name__ == "__main__":
     SYSTEM = platform.system() # Gets the system of the machine running the application (ie. MAC, WINDOWS or LINUX)
-    application = setupWindow()
+    # A recipes file can be given as an argument, eg. 'python main.py data/beers.db' (see 'python storage.py migrate')
+    # Add --diagnostics (or --profile) to record how long each stage takes (see diagnostics.py)
+    arguments = diagnostics.stripFlags(sys.argv[1:])
+    application = setupWindow(arguments[0] if arguments else "data/beers.json")
     application.app.mainloop()
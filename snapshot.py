@@ -0,0 +1,117 @@
+""" Binary snapshots of a recipes catalog, so that starting up doesn't have to parse (and index) the whole recipes JSON
+    file. A snapshot is saved next to the JSON file (eg. data/beers.snapshot) whenever the file has to be loaded, holding
+    the catalog's columns, names, name ordering and posting lists as raw arrays, which are read back from a memory map
+    with a single copy each. It is keyed on the JSON file's size, modification time and hash, and on the part of its
+    journal already applied. The JSON file is always what is saved to: a snapshot is only used while it is up to date
+    with it, with any journal records appended since replayed on top """
+import json, mmap, os, struct, sys
+from array import array
+from catalog import CODED_FIELDS, RecipeCatalog, loadVocabulary
+from storage import JSONBackend
+
+# The first bytes of every snapshot (changed whenever the layout changes, so that older snapshots are ignored)
+MAGIC = b"RCPSNAP\x01"
+
+# The start of every snapshot: the magic, then the length of the JSON header that follows it (and precedes the arrays)
+PREFIX = struct.Struct("<8sQ")
+
+# The size of each type of array saved, which (along with the byte order) must match for a snapshot to be read back
+ITEMSIZES = {typecode:array(typecode).itemsize for typecode in "dHIq"}
+
+def snapshotPath(path):
+    """ Returns the path of the snapshot of the given recipes file """
+    return os.path.splitext(path)[0] + ".snapshot"
+
+def saveSnapshot(backend, catalog):
+    """ Saves a snapshot of a catalog just loaded from a JSON backend, before any change is made to it. Returns False
+        (without saving) if it can't be saved, eg. if the recipes file doesn't exist yet or can't be written next to """
+    if not isinstance(backend, JSONBackend) or catalog.deleted: return False
+    key, names = backend.journal.key(), "\0".join(catalog.names)
+    if key is None or names.count("\0") != max(0, len(catalog.names) - 1): return False # A name holds the separator
+    seen = backend._lastSeen()
+    sections = {
+        "names": names.encode(),
+        "byname": catalog.ordering('abc+').tobytes(),
+        "digests": array("q", [seen[name] for name in catalog.names]).tobytes(),
+        "extra": json.dumps(catalog.extra).encode()
+    }
+    sections.update((f"column:{field}", column.tobytes()) for (field, column) in catalog.columns.items())
+    postings = {field:[[code, len(rows)] for (code, rows) in catalog.postings[field].items()] for field in CODED_FIELDS}
+    for field in CODED_FIELDS:
+        sections[f"postings:{field}"] = b"".join(catalog.postings[field][code].tobytes() for (code, _) in postings[field])
+    layout, offset = dict(), 0
+    for (name, data) in sections.items():
+        layout[name], offset = (offset, len(data)), offset + len(data)
+    header = json.dumps({"key": key, "rows": len(catalog.names), "byteorder": sys.byteorder, "itemsizes": ITEMSIZES,
+        "vocabularies": catalog.vocabularies, "postings": postings, "sections": layout}).encode()
+    path = snapshotPath(backend.path)
+    try:
+        with open(path + ".tmp", "wb") as snapshotfile:
+            snapshotfile.write(PREFIX.pack(MAGIC, len(header)) + header)
+            for data in sections.values(): snapshotfile.write(data)
+            snapshotfile.flush()
+            os.fsync(snapshotfile.fileno())
+        os.replace(path + ".tmp", path)
+    except OSError: return False # Only a cache, so loading carries on without one
+    return True
+
+def loadSnapshot(backend, factory=None):
+    """ Returns the catalog saved in the snapshot of a JSON backend's recipes file, with the journal records appended
+        since it was saved replayed on top, or None if there is no (readable) snapshot or the file has changed since """
+    if not isinstance(backend, JSONBackend): return None
+    try:
+        with open(snapshotPath(backend.path), "rb") as snapshotfile:
+            with mmap.mmap(snapshotfile.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                snapshot = readSnapshot(mapped, factory)
+    except (OSError, ValueError, KeyError, TypeError, struct.error): return None # Missing, empty, truncated or corrupt
+    if snapshot is None: return None
+    catalog, key, digests = snapshot
+    records = backend.resume(key, catalog.names[:], digests)
+    if records is None: return None
+    for record in records: replayRecord(catalog, record)
+    return catalog
+
+def readSnapshot(mapped, factory=None):
+    """ Reads a catalog from a (memory-mapped) snapshot, returning it along with the key and digests it was saved with,
+        or None if it was saved by a different version or platform, or with different vocabularies """
+    magic, length = PREFIX.unpack_from(mapped)
+    if magic != MAGIC: return None
+    start = PREFIX.size + length
+    header = json.loads(mapped[PREFIX.size:start])
+    if header["byteorder"] != sys.byteorder or header["itemsizes"] != ITEMSIZES: return None
+    for (field, path) in CODED_FIELDS.items(): # The vocabularies may only have been extended since
+        vocabulary = loadVocabulary(path)
+        if header["vocabularies"][field][:len(vocabulary)] != vocabulary: return None
+    rows, layout = header["rows"], header["sections"]
+    with memoryview(mapped) as view:
+        def section(name, typecode=None):
+            offset, size = layout[name]
+            if start + offset + size > len(mapped): raise ValueError(f"Snapshot section {name} is truncated")
+            with view[start+offset:start+offset+size] as data:
+                if typecode is None: return bytes(data)
+                values = array(typecode)
+                values.frombytes(data)
+                return values
+        catalog = RecipeCatalog(vocabularies=header["vocabularies"], factory=factory)
+        catalog.names = section("names").decode().split("\0") if rows else list()
+        for field in catalog.columns: catalog.columns[field] = section(f"column:{field}", catalog.columns[field].typecode)
+        byname, digests = section("byname", "I"), section("digests", "q")
+        for field in CODED_FIELDS:
+            rowsbycode, position = section(f"postings:{field}", "I"), 0
+            for (code, size) in header["postings"][field]:
+                catalog.postings[field][code] = rowsbycode[position:position+size]
+                position += size
+            if position != len(rowsbycode) or position != rows: raise ValueError(f"Snapshot postings of {field} are corrupt")
+        catalog.extra = {int(row):extra for (row, extra) in json.loads(section("extra")).items()}
+    if any(len(values) != rows for values in (catalog.names, byname, digests, *catalog.columns.values())):
+        raise ValueError("Snapshot columns are corrupt")
+    catalog.alive, catalog.orderings = bytearray(b"\x01")*rows, {'abc+': byname}
+    catalog.changes += 1
+    return catalog, header["key"], digests
+
+def replayRecord(catalog, record):
+    """ Applies a single journal record to a catalog, as journal.applyRecord applies it to a dictionary of recipes """
+    name = record["name"]
+    if record["op"] == "add" or (record["op"] == "update" and name not in catalog): catalog.add(name, record["data"])
+    elif record["op"] == "update": catalog.update(name, record["data"])
+    elif record["op"] == "delete": catalog.remove(name)
@@ -0,0 +1,400 @@
+import hashlib, json, os, re, sqlite3, sys
+from journal import openJournal
+
+# The recipe fields stored by every backend (the name is stored separately, as the key of each recipe)
+FIELDS = ["type", "abv", "gravity", "ibu", "srm", "servingtemp"]
+
+# Fields holding numbers (parsed once when loaded, and stored as typed columns by the SQLite backend)
+NUMERIC_FIELDS = ["abv", "gravity", "ibu", "servingtemp"]
+
+# A dictionary to translate the field parts of a sorting mode (eg. 'abc' in 'abc+') to the field they sort by
+SORT_FIELDS = {
+    "abc": "name",
+    "abv": "abv",
+    "ibu": "ibu",
+    "gravity": "gravity",
+    "temp": "servingtemp",
+    "type": "type"
+}
+
+# File extensions of recipe files that are opened with the SQLite backend (anything else is treated as JSON)
+SQLITE_EXTENSIONS = [".db", ".sqlite", ".sqlite3"]
+
+def parseSortingMode(sorting_mode):
+    """ Splits a sorting mode (eg. 'abv-' or 'type+abv-') into a list of the fields it sorts by and whether each is
+        descending. Recipes that are otherwise equal are always ordered by name """
+    parts = re.findall(r"([a-z]+)([+-])", sorting_mode)
+    if not parts or "".join(map("".join, parts)) != sorting_mode: raise KeyError(sorting_mode)
+    keys = [(SORT_FIELDS[field], direction == "-") for (field, direction) in parts]
+    if "name" not in dict(keys): keys.append(("name", False))
+    return keys
+
+def numeric(value):
+    """ Returns value as a float for sorting/filtering, or None if it isn't a number """
+    try: return float(value)
+    except (TypeError, ValueError): return None
+
+def compactNumber(value):
+    """ Returns a parsed number as it should be saved (ie. whole numbers as ints, so 5.0 is saved as 5) """
+    if isinstance(value, float) and value.is_integer(): return int(value)
+    return value
+
+def entryDigest(data):
+    """ Returns a (64 bit) hash of a recipe's data, to tell whether it has changed without keeping a copy of it. The
+        same in every process, so that it can be saved (see snapshot.py) """
+    return int.from_bytes(hashlib.blake2b(repr(data).encode(), digest_size=8).digest(), "little", signed=True)
+
+class RecipeBackend:
+    """ RecipeBackend object. The interface the Application uses to load, save and query recipes.
+        Recipes are passed around as (name, data) pairs, where data is a dictionary of the recipe's FIELDS.
+        A hash of every recipe as last loaded is kept, so that changes made by other processes sharing the recipes
+        file can be picked out (and merged) without reloading every recipe """
+
+    pageable = False # Whether query and count run in the backend, rather than having to load every recipe to match
+
+    def __init__(self, path):
+        self.path = path
+        self.digests = None # Name to the entryDigest of every recipe last seen in the file (None until first loaded)
+        self.baseline = None # Returns the digests of the recipes first loaded, only once needed (so loading isn't slowed)
+        self.unseen = dict() # Recipes found to have changed, by name (None where removed), not yet returned by changes
+        self.lowered = None # The lowercase name of every recipe in digests to its name (None until first needed)
+
+    def __repr__(self):
+        return f"<{type(self).__name__}: {self.path}>"
+
+    def load(self):
+        """ Returns a dictionary of all recipes by name """
+        raise NotImplementedError
+
+    def add(self, name, data):
+        raise NotImplementedError
+
+    def update(self, name, data):
+        raise NotImplementedError
+
+    def delete(self, name):
+        raise NotImplementedError
+
+    def addMany(self, beerdata):
+        """ Adds every recipe in the given dictionary of recipes by name, in a single write """
+        raise NotImplementedError
+
+    def apply(self, records):
+        """ Saves a list of changes (as journal records, ie. {"op": "add", "name": ..., "data": ...}) in a single write """
+        raise NotImplementedError
+
+    def changes(self):
+        """ Returns the recipes that have changed in the file since they were last loaded or returned by changes (ie.
+            changes made by other processes, and possibly this one's own), as a dictionary of name to data, or None
+            where removed """
+        raise NotImplementedError
+
+    def _lastSeen(self):
+        """ Returns the digests of the recipes last seen in the file, working them out from the first load if needed """
+        if self.digests is None:
+            self.digests = self.baseline() if self.baseline else dict()
+            self.baseline, self.lowered = None, None
+        return self.digests
+
+    def _seen(self, beerdata):
+        """ Notes every recipe as last seen in the file, keeping those changed since they were last seen for changes to
+            return. Returns beerdata """
+        if self.digests is None and self.baseline is None:
+            self.baseline = lambda: {name:entryDigest(data) for (name, data) in beerdata.items()}
+            return beerdata
+        previous = self._lastSeen()
+        digests = {name:entryDigest(data) for (name, data) in beerdata.items()}
+        self.unseen.update((name, None) for name in previous.keys() - digests.keys())
+        self.unseen.update((name, beerdata[name]) for (name, digest) in digests.items() if previous.get(name) != digest)
+        self.digests, self.lowered = digests, None
+        return beerdata
+
+    def _resume(self, names, digests, records):
+        """ Notes the recipes loaded from a snapshot (by name, with their digests) and the journal records replayed on
+            top of it as last seen, without working out their digests until they are needed """
+        def baseline():
+            seen = dict(zip(names, digests))
+            lowered = dict(zip(map(str.lower, seen), seen)) if records else None
+            for record in records:
+                name, other = record["name"], lowered.get(record["name"].lower())
+                if other is not None and other != name: seen.pop(other) # The same recipe (see journal.applyRecord)
+                if record["op"] == "delete": seen.pop(name, None)
+                else: seen[name] = entryDigest(record["data"])
+                lowered[name.lower()] = name
+            return seen
+        self.digests, self.baseline, self.lowered = None, baseline, None
+
+    def _seenRecords(self, records):
+        """ Notes the recipes changed by journal records (in order) as last seen, as _seen does, keeping the changes in
+            the order they were saved. Updates are taken to hold the whole recipe, as RecipeManager saves them. A record
+            for a name differing only by case from a recipe's is a change to that recipe (see journal.applyRecord) """
+        digests = self._lastSeen()
+        if self.lowered is None: self.lowered = dict(zip(map(str.lower, digests), digests))
+        for record in records:
+            name, data = record["name"], record.get("data") if record["op"] != "delete" else None
+            digest, other = None if data is None else entryDigest(data), self.lowered.get(name.lower())
+            if other is not None and other != name: # Now saved under this name, which replaces the other in the catalog
+                digests.pop(other, None)
+                self.unseen.pop(other, None)
+            elif digests.get(name) == digest: continue
+            self.unseen.pop(name, None) # So that it is merged after every change saved before it
+            self.unseen[name] = data
+            if digest is None:
+                digests.pop(name, None)
+                self.lowered.pop(name.lower(), None)
+            else:
+                digests[name] = digest
+                self.lowered[name.lower()] = name
+
+    def saveAll(self, beerdata):
+        """ Replaces every stored recipe with the given dictionary of recipes by name """
+        raise NotImplementedError
+
+    def count(self, filters=None):
+        """ Returns the number of recipes matching filters """
+        raise NotImplementedError
+
+    def query(self, sorting_mode='abc+', filters=None, offset=0, limit=None):
+        """ Returns a page of (name, data) pairs matching filters, sorted by the given sorting mode (with missing numbers
+            last, as RecipeCatalog sorts them). filters is a dictionary of field to either a value to match exactly (or a
+            list of values, matching any of them), or a (low, high) range for numeric fields (either end may be None),
+            with the special 'prefix' key matching the start of the name (ignoring case) """
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+class JSONBackend(RecipeBackend):
+    """ JSONBackend object. Stores recipes in a JSON file, with each change appended to its journal. No copy of the
+        recipes is kept in memory: compacting the journal reads the file and journal back from disk """
+
+    def __init__(self, path):
+        super().__init__(path)
+        self.journal = openJournal(path)
+
+    def load(self):
+        return self._seen(self.journal.replay())
+
+    def apply(self, records):
+        with self.journal.locked():
+            self.journal.appendMany(records)
+            if self.journal.due: self.journal.compact(self._seen(self.journal.replay()))
+
+    def resume(self, key, names, digests):
+        """ Picks up from a snapshot of the recipes (see snapshot.py), taken when the file was as the key (as
+            RecipeJournal.key returns it) identifies it, with the given names and digests. Returns the journal records
+            appended since, or None if the file has changed since the snapshot, which must then be loaded instead """
+        records = self.journal.resume(key)
+        if records is not None: self._resume(names, digests, records)
+        return records
+
+    def changes(self):
+        records = self.journal.changes()
+        if records is None: self._seen(self.journal.replay())
+        else: self._seenRecords(records)
+        changes, self.unseen = self.unseen, dict()
+        return changes
+
+    def add(self, name, data):
+        self.apply([{"op": "add", "name": name, "data": data}])
+
+    def update(self, name, data):
+        self.apply([{"op": "update", "name": name, "data": data}])
+
+    def delete(self, name):
+        self.apply([{"op": "delete", "name": name}])
+
+    def addMany(self, beerdata):
+        with self.journal.locked():
+            self.journal.compact({**self.load(), **beerdata})
+        self._lastSeen().update((name, entryDigest(data)) for (name, data) in beerdata.items())
+        self.lowered = None
+
+    def saveAll(self, beerdata):
+        self.journal.compact(beerdata)
+        self.digests, self.baseline, self.lowered = None, lambda: {name:entryDigest(data) for (name, data) in beerdata.items()}, None
+
+    def _matches(self, name, data, filters):
+        for (field, value) in filters.items():
+            if field == "prefix":
+                if not name.lower().startswith(value.lower()): return False
+            elif isinstance(value, tuple):
+                low, high, number = *value, numeric(data.get(field))
+                if number is None or (low is not None and number < low) or (high is not None and number > high):
+                    return False
+            elif isinstance(value, list):
+                if data.get(field) not in value: return False
+            elif data.get(field) != value: return False
+        return True
+
+    def count(self, filters=None):
+        beerdata = self.load()
+        if not filters: return len(beerdata)
+        return sum(1 for (name, data) in beerdata.items() if self._matches(name, data, filters))
+
+    def query(self, sorting_mode='abc+', filters=None, offset=0, limit=None):
+        pairs = [(name, data) for (name, data) in self.load().items() if not filters or self._matches(name, data, filters)]
+        for (field, descending) in reversed(parseSortingMode(sorting_mode)): # Stable sorts, from the last key to the first
+            if field == "name": pairs.sort(key=lambda pair: pair[0].lower(), reverse=descending)
+            elif field in NUMERIC_FIELDS: # Missing numbers are set aside, and always sort last
+                missing = [pair for pair in pairs if numeric(pair[1].get(field)) is None]
+                pairs = [pair for pair in pairs if numeric(pair[1].get(field)) is not None]
+                pairs.sort(key=lambda pair: numeric(pair[1].get(field)), reverse=descending)
+                pairs += missing
+            else: pairs.sort(key=lambda pair: str(pair[1].get(field)).lower(), reverse=descending)
+        return pairs[offset:] if limit is None else pairs[offset:offset+limit]
+
+class SQLiteBackend(RecipeBackend):
+    """ SQLiteBackend object. Stores recipes in an indexed SQLite database, so that large catalogs can be paged,
+        sorted and filtered without loading every recipe """
+
+    pageable = True
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS beers (
+            name TEXT PRIMARY KEY COLLATE NOCASE,
+            type TEXT, srm TEXT,
+            abv NUMERIC, gravity NUMERIC, ibu NUMERIC, servingtemp NUMERIC,
+            extra TEXT
+        );
+        CREATE INDEX IF NOT EXISTS beers_type ON beers(type);
+        CREATE INDEX IF NOT EXISTS beers_srm ON beers(srm);
+        CREATE INDEX IF NOT EXISTS beers_abv ON beers(abv);
+        CREATE INDEX IF NOT EXISTS beers_ibu ON beers(ibu);
+        CREATE INDEX IF NOT EXISTS beers_gravity ON beers(gravity);
+    """
+
+    def __init__(self, path):
+        super().__init__(path)
+        # May be used from the GUI's I/O thread (see worker.py), which is the only thread using it once it has started
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.executescript(self.SCHEMA)
+        self.version = None
+
+    def _row(self, name, data):
+        """ Returns the column values stored for a recipe, with any fields that don't have a column kept as JSON """
+        extra = {k:v for (k,v) in data.items() if k not in FIELDS}
+        return (name, *(data.get(field) for field in FIELDS), json.dumps(extra) if extra else None)
+
+    def _pair(self, row):
+        """ Converts a row (as selected by query) back to a (name, data) pair """
+        name, *values, extra = row
+        data = dict(zip(FIELDS, values))
+        if extra: data.update(json.loads(extra))
+        return name, data
+
+    def load(self):
+        self.version = self.connection.execute("PRAGMA data_version").fetchone()[0]
+        return self._seen(dict(self.query()))
+
+    def changes(self):
+        # data_version only changes when another connection commits, and there is no log of what it changed, so every
+        # recipe is compared (by its hash) when it has
+        if self.connection.execute("PRAGMA data_version").fetchone()[0] != self.version: self.load()
+        changes, self.unseen = self.unseen, dict()
+        return changes
+
+    def add(self, name, data):
+        self.apply([{"op": "add", "name": name, "data": data}])
+
+    def update(self, name, data):
+        self.apply([{"op": "update", "name": name, "data": data}])
+
+    def delete(self, name):
+        self.apply([{"op": "delete", "name": name}])
+
+    def apply(self, records):
+        with self.connection:
+            for record in records:
+                name, data = record["name"], record.get("data")
+                if record["op"] == "add":
+                    self.connection.execute(f"INSERT OR REPLACE INTO beers (name, {', '.join(FIELDS)}, extra) "
+                        f"VALUES ({', '.join('?'*(len(FIELDS)+2))})", self._row(name, data))
+                elif record["op"] == "update": self._update(name, data)
+                elif record["op"] == "delete": self.connection.execute("DELETE FROM beers WHERE name = ?", (name,))
+
+    def _update(self, name, data):
+        columns = [field for field in data if field in FIELDS]
+        extra = {k:v for (k,v) in data.items() if k not in FIELDS}
+        if columns:
+            self.connection.execute(f"UPDATE beers SET {', '.join(f'{c} = ?' for c in columns)} WHERE name = ?",
+                [data[c] for c in columns] + [name])
+        if extra:
+            row = self.connection.execute("SELECT extra FROM beers WHERE name = ?", (name,)).fetchone()
+            merged = json.loads(row[0]) if row and row[0] else dict()
+            merged.update(extra)
+            self.connection.execute("UPDATE beers SET extra = ? WHERE name = ?", (json.dumps(merged), name))
+
+    def addMany(self, beerdata):
+        with self.connection:
+            self.connection.executemany(f"INSERT OR REPLACE INTO beers (name, {', '.join(FIELDS)}, extra) "
+                f"VALUES ({', '.join('?'*(len(FIELDS)+2))})", (self._row(k, v) for (k,v) in beerdata.items()))
+
+    def saveAll(self, beerdata):
+        with self.connection:
+            self.connection.execute("DELETE FROM beers")
+            self.connection.executemany(f"INSERT OR REPLACE INTO beers (name, {', '.join(FIELDS)}, extra) "
+                f"VALUES ({', '.join('?'*(len(FIELDS)+2))})", (self._row(k, v) for (k,v) in beerdata.items()))
+
+    def _where(self, filters):
+        """ Builds the WHERE clause (and its parameters) for the given filters """
+        clauses, params = list(), list()
+        for (field, value) in (filters or dict()).items():
+            if field == "prefix":
+                # A range on the NOCASE primary key, rather than LIKE, so that the index is used
+                clauses.append("name >= ? AND name < ?")
+                params += [value, value + "\U0010ffff"]
+            elif isinstance(value, tuple):
+                low, high = value
+                # Missing (and unparseable) numbers are kept as text, which SQLite compares as greater than any number
+                clauses.append(f"typeof({field}) IN ('integer', 'real')")
+                if low is not None: clauses.append(f"{field} >= ?"); params.append(low)
+                if high is not None: clauses.append(f"{field} <= ?"); params.append(high)
+            elif isinstance(value, list):
+                clauses.append(f"{field} IN ({', '.join('?'*len(value))})" if value else "0"); params += value
+            else:
+                clauses.append(f"{field} = ?"); params.append(value)
+        return (" WHERE " + " AND ".join(clauses) if clauses else ""), params
+
+    def count(self, filters=None):
+        where, params = self._where(filters)
+        return self.connection.execute(f"SELECT COUNT(*) FROM beers{where}", params).fetchone()[0]
+
+    def query(self, sorting_mode='abc+', filters=None, offset=0, limit=None):
+        where, params = self._where(filters)
+        # Missing numbers (kept as NULL or text) sort last either way, as RecipeCatalog sorts them
+        order = ", ".join(f"{field} COLLATE NOCASE {'DESC' if descending else 'ASC'}" if field in ("name", "type")
+            else f"typeof({field}) NOT IN ('integer', 'real'), {field} {'DESC' if descending else 'ASC'}"
+            for (field, descending) in parseSortingMode(sorting_mode))
+        sql = f"SELECT name, {', '.join(FIELDS)}, extra FROM beers{where} ORDER BY {order} LIMIT ? OFFSET ?"
+        rows = self.connection.execute(sql, params + [-1 if limit is None else limit, offset])
+        return [self._pair(row) for row in rows]
+
+    def close(self):
+        self.connection.close()
+        _BACKENDS.pop(self.path, None)
+
+_BACKENDS = dict()
+
+def openBackend(path):
+    """ Returns the (shared) recipe backend for the given path, chosen by its file extension """
+    if path not in _BACKENDS:
+        if os.path.splitext(path)[1].lower() in SQLITE_EXTENSIONS: _BACKENDS[path] = SQLiteBackend(path)
+        else: _BACKENDS[path] = JSONBackend(path)
+    return _BACKENDS[path]
+
+def migrate(source, destination):
+    """ Copies every recipe from one recipes file to another (eg. from data/beers.json into an SQLite database) """
+    beerdata = openBackend(source).load()
+    backend = openBackend(destination)
+    backend.saveAll(beerdata)
+    backend.close()
+    return len(beerdata)
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "migrate":
+        source = sys.argv[2] if len(sys.argv) > 2 else "data/beers.json"
+        destination = sys.argv[3] if len(sys.argv) > 3 else "data/beers.db"
+        print(f"Migrated {migrate(source, destination)} recipes from {source} to {destination}")
+    else:
+        print("Usage: python storage.py migrate [SOURCE=data/beers.json] [DESTINATION=data/beers.db]")
@@ -0,0 +1,89 @@
+import json, os, re, threading
+
+# The colours every theme must define
+THEME_FEATURES = ["fg", "bg", "dark", "light", "tint"]
+
+# Colours are either hex codes ('#rgb' or '#rrggbb') or Tk colour names (eg. 'white', 'light grey')
+HEX_COLOUR = re.compile(r"#([0-9a-fA-F]{3}|[0-9a-fA-F]{6})")
+NAMED_COLOUR = re.compile(r"[A-Za-z][A-Za-z0-9 ]*")
+
+def resolveColour(colour):
+    """ Returns a colour in the form used by the application ('#rrggbb' for hex codes), or None if it isn't valid """
+    if not isinstance(colour, str): return None
+    colour = colour.strip()
+    if (match := HEX_COLOUR.fullmatch(colour)):
+        digits = match.group(1).lower()
+        if len(digits) == 3: digits = "".join(d*2 for d in digits)
+        return f"#{digits}"
+    elif NAMED_COLOUR.fullmatch(colour): return colour
+    return None
+
+class ThemeRegistry:
+    """ ThemeRegistry object. Loads and validates every theme in the themes file once, keeping each theme's resolved
+        colours, and only reads the file again when its modification time changes. Themes that are missing a colour
+        (or have an invalid one) are left out, with the reason kept in ThemeRegistry.invalid.
+        Safe to share between threads (eg. the GUI and the worker): only one thread reloads the file at a time, and the
+        reloaded themes replace the old ones all at once, so a theme is never looked up in a half-loaded registry """
+
+    def __init__(self, path="data/themes.json"):
+        self.path = path
+        self.themes, self.invalid = dict(), dict()
+        self.mtime = None
+        self.lock = threading.Lock()
+
+    def __repr__(self):
+        return f"<ThemeRegistry: {self.path} ({len(self.themes)} themes)>"
+
+    def __len__(self):
+        self.refresh()
+        return len(self.themes)
+
+    def __contains__(self, themename):
+        self.refresh()
+        return themename in self.themes
+
+    def refresh(self):
+        """ Reloads the themes file if it has changed since it was last loaded """
+        with self.lock:
+            try: mtime = os.stat(self.path).st_mtime_ns
+            except FileNotFoundError: mtime = None
+            if mtime == self.mtime: return False
+            themes, invalid = dict(), dict()
+            if mtime is not None:
+                with open(self.path, "r") as themefile:
+                    for (themename, theme) in json.load(themefile).items():
+                        resolved = self._resolve(themename, theme, invalid)
+                        if resolved: themes[themename] = resolved
+            self.themes, self.invalid, self.mtime = themes, invalid, mtime
+            return True
+
+    def _resolve(self, themename, theme, invalid):
+        """ Returns the theme's resolved colours, or None (recording why in invalid) if it isn't valid """
+        if not isinstance(theme, dict):
+            invalid[themename] = "Theme is not a dictionary of colours"
+            return None
+        if (missing := [feature for feature in THEME_FEATURES if feature not in theme]):
+            invalid[themename] = f"Missing colours: {', '.join(missing)}"
+            return None
+        resolved = {feature:resolveColour(theme[feature]) for feature in THEME_FEATURES}
+        if (bad := [feature for feature in THEME_FEATURES if resolved[feature] is None]):
+            invalid[themename] = f"Invalid colours: {', '.join(f'{f}={theme[f]!r}' for f in bad)}"
+            return None
+        return resolved
+
+    def get(self, themename):
+        """ Returns the resolved colours of the given theme, or None if there is no such (valid) theme """
+        self.refresh()
+        return self.themes.get(themename)
+
+    def names(self):
+        """ Returns the names of every valid theme, sorted """
+        self.refresh()
+        return sorted(self.themes)
+
+_REGISTRIES = dict()
+
+def openRegistry(path="data/themes.json"):
+    """ Returns the (shared) theme registry for the given themes file """
+    if path not in _REGISTRIES: _REGISTRIES[path] = ThemeRegistry(path)
+    return _REGISTRIES[path]
@@ -0,0 +1,85 @@
+""" A background thread for the GUI's file I/O (loading and saving recipes, themes and settings), so that a slow disk or
+    a large recipes file never freezes the Tk mainloop. Doesn't import tkinter: results are handed back to whichever
+    thread calls IOWorker.deliver, which the GUI does from an after() loop """
+import atexit, threading
+from collections import deque
+from queue import Empty, SimpleQueue
+
+class IOWorker:
+    """ IOWorker object. Runs jobs one at a time, in the order they were submitted, on a single background thread.
+        A job submitted with the same key as one still waiting to run replaces it (keeping its place in the queue), so
+        rapid successive saves of the same thing are written once, with the latest data. Every job still waiting is run
+        before the worker is closed, which happens at the latest when the interpreter exits """
+
+    def __init__(self, name="IOWorker"):
+        self.condition = threading.Condition()
+        self.queue = deque() # The keys of the jobs waiting to run, in order (jobs without a key get a key of their own)
+        self.waiting = dict() # Key to its job, as [function, args, callback, errback]
+        self.results = SimpleQueue() # (callback, errback, result, error) of finished jobs, waiting to be delivered
+        self.running, self.closed = False, False
+        self.thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
+
+    def __repr__(self):
+        return f"<IOWorker: {len(self.queue)} jobs waiting{' (closed)' if self.closed else ''}>"
+
+    def submit(self, function, *args, key=None, callback=None, errback=None):
+        """ Queues function(*args) to run on the worker's thread. When it has run, deliver calls callback with its
+            result (or errback with the exception it raised). If a job with the same key is still waiting, it is
+            replaced by this one instead. Returns True if the job was merged into one already waiting """
+        with self.condition:
+            if self.closed: raise RuntimeError("IOWorker is closed")
+            if key is not None and key in self.waiting:
+                self.waiting[key][:] = [function, args, callback, errback]
+                return True
+            key = object() if key is None else key
+            self.waiting[key] = [function, args, callback, errback]
+            self.queue.append(key)
+            self.condition.notify_all()
+        return False
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while not self.queue and not self.closed: self.condition.wait()
+                if not self.queue: return # Closed, with nothing left to run
+                function, args, callback, errback = self.waiting.pop(self.queue.popleft())
+                self.running = True
+            try: result, error = function(*args), None
+            except Exception as exception: result, error = None, exception
+            if callback or errback or error: self.results.put((callback, errback, result, error))
+            with self.condition:
+                self.running = False
+                self.condition.notify_all()
+
+    def deliver(self):
+        """ Calls the callbacks of every job that has finished since the last delivery, on the calling thread.
+            The error of a job without an errback is raised (after delivering the others), so that it isn't lost """
+        unhandled = None
+        while True:
+            try: callback, errback, result, error = self.results.get_nowait()
+            except Empty: break
+            if error is None:
+                if callback: callback(result)
+            elif errback: errback(error)
+            else: unhandled = error
+        if unhandled is not None: raise unhandled
+
+    def pending(self):
+        """ Returns the number of jobs waiting to run (or running) """
+        with self.condition:
+            return len(self.queue) + self.running
+
+    def flush(self, timeout=None):
+        """ Waits until every job submitted so far has run, returning False if the timeout ran out first """
+        with self.condition:
+            return self.condition.wait_for(lambda: not self.queue and not self.running, timeout)
+
+    def close(self, timeout=None):
+        """ Runs every job still waiting, then stops the thread. Jobs can't be submitted once closed """
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+        atexit.unregister(self.close)
+        if self.thread is not threading.current_thread(): self.thread.join(timeout)